@@ -0,0 +1,233 @@
+# Import necessary libraries
+import os
+import torch
+from transformers.pytorch_utils import Conv1D
+from metrics import Counter
+from model_loader import load_mmap_model
+
+# File names of the converted models, saved next to the fp32 checkpoint
+ONNX_FILE = "model.onnx"
+INT8_FILE = "model-int8.pt"
+
+
+def load_fp32_model(model_path):
+    # Map the fine-tuned weights instead of reading them into memory
+    model = load_mmap_model(model_path)
+    model.config.pad_token_id = model.config.eos_token_id if model.config.pad_token_id is None else model.config.pad_token_id
+    model.eval()
+    return model
+
+
+def conv1d_to_linear(module):
+    r"""
+    Replace the GPT-2 `Conv1D` layers with equivalent `nn.Linear` layers.
+
+    `Conv1D` is a transposed linear layer that dynamic quantization does not
+    know about, so without this only the classification head gets quantized.
+
+    """
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            n_in, n_out = child.weight.shape
+            linear = torch.nn.Linear(n_in, n_out)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def quantize_model(model):
+    # Quantize every linear layer's weights to int8, activations stay fp32
+    return torch.quantization.quantize_dynamic(conv1d_to_linear(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class _LogitsAndFeatures(torch.nn.Module):
+    # Wrap the model so the exported graph has plain tensor inputs and outputs:
+    # the logits and the last-token hidden states the head computes them from
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        from features import last_token_features
+
+        features = last_token_features(self.model, input_ids, attention_mask)
+        return self.model.score(features), features
+
+
+def export_onnx(model, output_path, opset_version=17):
+    r"""
+    Export the classifier to ONNX with dynamic batch and sequence axes.
+
+    The graph outputs the `logits` and the `features` served by `/embed`.
+
+    """
+
+    dummy = torch.full((2, 8), model.config.eos_token_id, dtype=torch.long)
+    mask = torch.ones_like(dummy)
+    torch.onnx.export(_LogitsAndFeatures(model), (dummy, mask), output_path,
+                      input_names=["input_ids", "attention_mask"],
+                      output_names=["logits", "features"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                    "attention_mask": {0: "batch", 1: "sequence"},
+                                    "logits": {0: "batch"},
+                                    "features": {0: "batch"}},
+                      opset_version=opset_version,
+                      dynamo=False)
+
+
+class EagerBackend(object):
+    r"""
+    Run the fp32 PyTorch model, as the server always did.
+
+    All backends take the tokenizer output and return the logits as a CPU
+    tensor of shape `[batch, labels]`. `logits` is `run(prepare(inputs))`,
+    split so moving the inputs to the device can be timed on its own.
+    `features` returns the hidden states the head classifies from, when
+    `serves_features` is true. `calibrated` tells the logits are already
+    divided by their fitted temperature.
+
+    """
+
+    serves_features = True
+    calibrated = False
+
+    def __init__(self, model_path, device=None):
+
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = load_fp32_model(model_path).to(self.device)
+
+        return
+
+    def prepare(self, inputs):
+        # Copy the tokenizer output to the model's device
+        return {k: v.to(self.device) for k, v in inputs.items()}
+
+    def run(self, inputs):
+        # Forward pass on prepared inputs
+        with torch.no_grad():
+            return self.model(**inputs).logits.cpu()
+
+    def logits(self, inputs):
+        return self.run(self.prepare(inputs))
+
+    def features(self, inputs):
+        # Last-token hidden states the classification head reads
+        from features import last_token_features
+
+        inputs = self.prepare(inputs)
+        with torch.no_grad():
+            return last_token_features(self.model, inputs["input_ids"], inputs["attention_mask"]).float().cpu()
+
+
+class Int8Backend(EagerBackend):
+    r"""
+    Run the PyTorch model with int8 dynamically quantized linear layers.
+
+    Uses the model saved by `python export_model.py int8` when present and
+    quantizes the fp32 checkpoint on load otherwise. CPU only.
+
+    """
+
+    def __init__(self, model_path, device=None):
+
+        self.device = torch.device("cpu")
+        converted = os.path.join(model_path, INT8_FILE)
+        if os.path.exists(converted):
+            self.model = torch.load(converted, weights_only=False)
+        else:
+            self.model = quantize_model(load_fp32_model(model_path))
+        self.model.eval()
+
+        return
+
+
+class EarlyExitBackend(EagerBackend):
+    r"""
+    Run the fp32 PyTorch model with the exit heads saved by `early_exit.py`.
+
+    Each text stops at the first exit whose calibrated confidence reaches the
+    saved threshold, and the rest of the batch goes on without it. Each exit
+    has its own temperature, so the logits are calibrated already.
+
+    """
+
+    calibrated = True
+
+    def __init__(self, model_path, device=None):
+
+        from early_exit import EarlyExitClassifier
+
+        super().__init__(model_path, device)
+        self.early_exit = EarlyExitClassifier.load(self.model, model_path).to(self.device)
+        # Blocks run, summed over the texts, to follow the average depth
+        self.texts = Counter()
+        self.layers_run = Counter()
+
+        return
+
+    def run(self, inputs):
+        logits, layers = self.early_exit.predict(inputs["input_ids"], inputs["attention_mask"])
+        self.texts.inc(len(layers))
+        self.layers_run.inc(int(layers.sum()))
+        return logits.cpu()
+
+    def stats(self):
+        texts = self.texts.snapshot()
+        return {"threshold": self.early_exit.threshold,
+                "exit_layers": self.early_exit.exit_layers,
+                "texts": texts,
+                "average_layers": self.layers_run.snapshot() / texts if texts else None}
+
+
+class OnnxBackend(object):
+    r"""
+    Run the graph saved by `python export_model.py onnx` with onnxruntime.
+
+    """
+
+    calibrated = False
+
+    def __init__(self, model_path, device=None):
+
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Use as many intra-op threads as torch would
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(os.path.join(model_path, ONNX_FILE), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.device = torch.device("cpu")
+        # Graphs exported before `features` was added only output the logits
+        self.serves_features = "features" in [output.name for output in self.session.get_outputs()]
+
+        return
+
+    def prepare(self, inputs):
+        # onnxruntime takes numpy arrays
+        return {"input_ids": inputs["input_ids"].cpu().numpy(),
+                "attention_mask": inputs["attention_mask"].cpu().numpy()}
+
+    def run(self, feed):
+        return torch.from_numpy(self.session.run(["logits"], feed)[0])
+
+    def logits(self, inputs):
+        return self.run(self.prepare(inputs))
+
+    def features(self, inputs):
+        return torch.from_numpy(self.session.run(["features"], self.prepare(inputs))[0])
+
+
+# Backends selectable by name
+BACKENDS = {"eager": EagerBackend, "int8": Int8Backend, "onnx": OnnxBackend, "early-exit": EarlyExitBackend}
+
+
+def load_backend(name, model_path, device=None):
+    # Create the inference backend with the given name
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend `%s`, use one of: %s." % (name, ", ".join(BACKENDS)))
+    return BACKENDS[name](model_path, device=device)
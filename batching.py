@@ -0,0 +1,150 @@
+# Import necessary libraries
+import asyncio
+import time
+
+from executor import Overloaded
+from metrics import LATENCY_BUCKETS, Gauge, Histogram
+
+
+class MicroBatcher(object):
+    r"""
+    Gather concurrent requests into batches that are run with one forward pass.
+
+    Callers `await submit(text)` and get back their own result. A background
+    task takes the first queued request, then keeps collecting until the batch
+    is full or `max_wait_ms` has passed, and hands the whole batch to
+    `predict_fn`.
+
+    Arguments:
+
+      predict_fn (:obj:`callable`):
+          Function that takes a list of texts and returns a list of results in
+          the same order. It is run outside the event loop.
+
+      executor (:obj:`executor.BoundedExecutor`):
+          Pool the batches are run on. Up to `executor.max_workers` batches
+          are in flight at the same time.
+
+      max_batch_size (:obj:`int`):
+          Largest number of requests put in a single batch.
+
+      max_wait_ms (:obj:`float`):
+          How long to wait for more requests once the first one arrived.
+
+      max_queue_size (:obj:`int`):
+          Number of waiting requests after which `submit` raises `Overloaded`.
+
+    """
+
+    def __init__(self, predict_fn, executor, max_batch_size=8, max_wait_ms=5.0, max_queue_size=256):
+
+        # Function running the model on a list of texts.
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        # Queue of (text, future, enqueue time) waiting to be batched.
+        self.queue = None
+        self._task = None
+        # Limits the batches in flight to the number of workers.
+        self._in_flight = None
+        self._batches = set()
+        # Stats used to tune the batch size and wait time.
+        self.queue_depth = Gauge()
+        self.queue_depth_histogram = Histogram([0, 1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.batch_size_histogram = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_histogram = Histogram(LATENCY_BUCKETS)
+
+        return
+
+    async def start(self):
+        # Create the queue inside the running loop and start the worker task.
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._in_flight = asyncio.Semaphore(self.executor.max_workers)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Stop the worker task.
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, text):
+        # Queue the text and wait until its batch has been run.
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((text, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise Overloaded("%d requests are already waiting." % self.max_queue_size)
+        self.queue_depth.set(self.queue.qsize())
+        return await future
+
+    def stats(self):
+        # Return the batcher stats as a JSON serializable dictionary.
+        return {"queue_depth": self.queue_depth.snapshot(),
+                "queue_depth_histogram": self.queue_depth_histogram.snapshot(),
+                "batch_size_histogram": self.batch_size_histogram.snapshot(),
+                "queue_wait_histogram": self.queue_wait_histogram.snapshot()}
+
+    async def _collect(self):
+        # Block until the first request arrives.
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        # Keep collecting until the batch is full or the wait time is over.
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run_batch(self, batch):
+        # Run the forward pass on the executor, outside the event loop.
+        texts = [text for text, _, _ in batch]
+        # Time each request spent queued before its forward pass started.
+        now = time.perf_counter()
+        for _, _, enqueued in batch:
+            self.queue_wait_histogram.observe(now - enqueued)
+        try:
+            results = await self.executor.run(self.predict_fn, texts, block=True)
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        finally:
+            self._in_flight.release()
+
+        # Hand each caller its own result.
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker so requests keep batching up meanwhile.
+            await self._in_flight.acquire()
+            batch = await self._collect()
+            # Drop requests whose caller went away while waiting.
+            batch = [item for item in batch if not item[1].done()]
+            self.queue_depth.set(self.queue.qsize())
+            self.queue_depth_histogram.observe(self.queue.qsize())
+            if not batch:
+                self._in_flight.release()
+                continue
+            self.batch_size_histogram.observe(len(batch))
+            task = asyncio.create_task(self._run_batch(batch))
+            # Keep a reference so the task is not garbage collected early.
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
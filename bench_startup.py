@@ -0,0 +1,123 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Ways of loading the model compared by the benchmark
+LOADERS = ("from_pretrained", "mmap")
+
+
+def memory_mb():
+    # Anonymous (private) and file-backed (shareable) resident memory of this process
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {name: int(fields[name].split()[0]) / 1024 for name in ("VmRSS", "RssAnon", "RssFile")}
+
+
+def child(args):
+    # Time one cold start in this fresh process and print the result as JSON
+    timings = {}
+    start = time.perf_counter()
+    import torch
+    from transformers import GPT2ForSequenceClassification, GPT2Tokenizer
+    from model_loader import load_mmap_model, load_tokenizer
+    timings["import_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.child == "mmap":
+        model = load_mmap_model(args.model_path)
+    else:
+        model = GPT2ForSequenceClassification.from_pretrained(args.model_path).eval()
+    timings["model_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.child == "mmap":
+        tokenizer = load_tokenizer(args.model_path)
+    else:
+        tokenizer = GPT2Tokenizer.from_pretrained(args.tokenizer)
+        tokenizer.padding_side = "left"
+        tokenizer.pad_token = tokenizer.eos_token
+    timings["tokenizer_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    inputs = tokenizer(["warm-up"], return_tensors="pt", padding=True)
+    with torch.no_grad():
+        model(**inputs)
+    timings["warm_up_s"] = time.perf_counter() - start
+
+    timings.update(memory_mb())
+    print(json.dumps(timings))
+
+
+def time_server(args):
+    # Seconds until a fresh server answers at all, and until /ready says 200
+    env = dict(os.environ, MODEL_PATH=os.path.abspath(args.model_path))
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    listening = None
+    try:
+        while time.perf_counter() - start < args.timeout:
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:%d/ready" % args.port) as response:
+                    if response.status == 200:
+                        return {"listening_s": listening or time.perf_counter() - start, "ready_s": time.perf_counter() - start}
+            except urllib.error.HTTPError:
+                # 503 while loading: the server is up but not ready yet
+                listening = listening or time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise SystemExit("Server was not ready after %d seconds." % args.timeout)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    results = {}
+    for loader in LOADERS:
+        runs = []
+        for _ in range(args.repeats):
+            output = subprocess.run([sys.executable, __file__, "--child", loader,
+                                     "--model-path", args.model_path, "--tokenizer", args.tokenizer],
+                                    check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        # Median over fresh processes
+        results[loader] = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+
+    columns = list(results[LOADERS[0]])
+    print("%-16s" % "loader" + "".join("%12s" % name for name in columns))
+    for loader, result in results.items():
+        print("%-16s" % loader + "".join("%12.3f" % result[name] for name in columns))
+
+    if args.server:
+        results["server"] = time_server(args)
+        print("server: listening after %.3f s - ready after %.3f s" % (results["server"]["listening_s"], results["server"]["ready_s"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cold start times and memory of the model loaders.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--tokenizer", default="gpt2", help="Tokenizer loaded by the `from_pretrained` baseline.")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh processes per loader.")
+    parser.add_argument("--server", action="store_true", help="Also time a uvicorn server until /ready.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=int, default=300)
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--child", choices=LOADERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,148 @@
+# Import necessary libraries
+import asyncio
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from metrics import Counter, Gauge
+
+
+def normalize_text(text):
+    # Use one unicode form and collapse runs of whitespace
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def checkpoint_fingerprint(path):
+    r"""
+    Identify a checkpoint directory by the names, sizes and modification times
+    of its files, so cache entries never outlive the weights they came from.
+
+    """
+
+    digest = hashlib.sha256(os.path.realpath(path).encode("utf-8"))
+    for name in sorted(os.listdir(path)):
+        stat = os.stat(os.path.join(path, name))
+        digest.update(("%s:%d:%d" % (name, stat.st_size, stat.st_mtime_ns)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache(object):
+    r"""
+    Size-bounded LRU cache of predictions with optional expiry.
+
+    Entries are keyed by a hash of the checkpoint id and the normalized text.
+    Identical requests that arrive while a prediction is already running wait
+    for that prediction instead of computing their own.
+
+    Arguments:
+
+      checkpoint_id (:obj:`str`):
+          Identifier of the weights the predictions come from.
+
+      max_entries (:obj:`int`):
+          Largest number of predictions kept. `0` disables the cache.
+
+      ttl (:obj:`float`, `optional`):
+          Seconds after which an entry expires. If no value is passed entries
+          only leave the cache when evicted.
+
+    """
+
+    def __init__(self, checkpoint_id, max_entries=10000, ttl=None):
+
+        self.checkpoint_id = checkpoint_id
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Key -> (expiry time, value), oldest first.
+        self._entries = OrderedDict()
+        # Key -> task of the prediction currently running for that key.
+        self._pending = {}
+        # Counters exported with the server stats.
+        self.hits = Counter()
+        self.misses = Counter()
+        self.coalesced = Counter()
+        self.size = Gauge()
+
+        return
+
+    def key(self, text, checkpoint_id=None):
+        # Hash the checkpoint id, `self.checkpoint_id` by default, together
+        # with the normalized text.
+        digest = hashlib.sha256((checkpoint_id or self.checkpoint_id).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalize_text(text).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        # Return the cached value or `None`, dropping it if it expired.
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            self.size.set(len(self._entries))
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        # Store the value and evict the least recently used entries.
+        if self.max_entries <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.size.set(len(self._entries))
+
+    def lookup(self, key):
+        # Same as `get`, counting the hit or miss.
+        value = self.get(key)
+        (self.misses if value is None else self.hits).inc()
+        return value
+
+    async def get_or_compute(self, key, compute):
+        r"""
+        Return the cached value for `key`, or await `compute()` to produce it.
+
+        Arguments:
+
+          compute (:obj:`callable`):
+              Function without arguments returning an awaitable of the value.
+
+        """
+
+        value = self.get(key)
+        if value is not None:
+            self.hits.inc()
+            return value
+
+        # Join the prediction already running for this key.
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced.inc()
+            return await asyncio.shield(task)
+
+        self.misses.inc()
+        # Run in its own task so a caller leaving does not cancel the others.
+        task = asyncio.ensure_future(compute())
+        self._pending[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        # Cache successful predictions; failures are retried by the next request.
+        self._pending.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self):
+        return {"hits": self.hits.snapshot(),
+                "misses": self.misses.snapshot(),
+                "coalesced": self.coalesced.snapshot(),
+                "size": self.size.snapshot()}
@@ -0,0 +1,180 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import torch
+
+# File holding the fitted temperature and label names, saved next to the weights
+CALIBRATION_FILE = "calibration.json"
+
+
+def collect_logits(model, dataloader, device_):
+    r"""
+    Run the model over a data loader and keep the logits and labels.
+
+    Returns:
+      :obj:`Tuple[torch.Tensor, torch.Tensor]`: fp32 logits of shape
+      `[examples, labels]` and the true labels.
+
+    """
+
+    logits = []
+    labels = []
+    model.eval()
+    with torch.no_grad():
+        for batch in dataloader:
+            labels.append(batch.pop('labels'))
+            batch = {k: v.type(torch.long).to(device_) for k, v in batch.items()}
+            logits.append(model(**batch).logits.float().cpu())
+    return torch.cat(logits), torch.cat(labels).long()
+
+
+def expected_calibration_error(probabilities, labels, n_bins=15):
+    r"""
+    Gap between confidence and accuracy, averaged over confidence bins.
+
+    """
+
+    confidence, predicted = probabilities.max(dim=-1)
+    correct = (predicted == labels).float()
+    bins = torch.clamp((confidence * n_bins).long(), max=n_bins - 1)
+    counts = torch.bincount(bins, minlength=n_bins).float()
+    gaps = (torch.bincount(bins, weights=confidence, minlength=n_bins)
+            - torch.bincount(bins, weights=correct, minlength=n_bins)).abs()
+    return (gaps.sum() / counts.sum()).item()
+
+
+def fit_temperature(logits, labels, max_iter=100):
+    r"""
+    Fit the softmax temperature that minimizes the negative log likelihood.
+
+    Dividing the logits by one scalar temperature leaves the predicted label
+    unchanged and only makes the probabilities sharper or flatter, so it can
+    be fitted on held-out data after training (Guo et al., 2017). The log of
+    the temperature is optimized so it stays positive.
+
+    Arguments:
+
+      logits (:obj:`torch.Tensor`):
+          Validation logits of shape `[examples, labels]`.
+
+      labels (:obj:`torch.Tensor`):
+          True labels of the examples.
+
+    Returns:
+      :obj:`Dict[str, float]`: The temperature, and the negative log likelihood
+      and expected calibration error before and after scaling.
+
+    """
+
+    logits = logits.float()
+    log_temperature = torch.zeros(1, requires_grad=True)
+    # The line search keeps LBFGS from overshooting on small validation sets
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=max_iter, line_search_fn='strong_wolfe')
+    nll = torch.nn.CrossEntropyLoss()
+
+    def closure():
+        optimizer.zero_grad()
+        loss = nll(logits / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    temperature = log_temperature.exp().item()
+
+    with torch.no_grad():
+        return {'temperature': temperature,
+                'nll_before': nll(logits, labels).item(),
+                'nll_after': nll(logits / temperature, labels).item(),
+                'ece_before': expected_calibration_error(torch.softmax(logits, dim=-1), labels),
+                'ece_after': expected_calibration_error(torch.softmax(logits / temperature, dim=-1), labels),
+                'n_examples': len(labels)}
+
+
+def calibrate(model, dataloader, device_, model_path, labels):
+    r"""
+    Fit the temperature on validation data and save it with the model.
+
+    Arguments:
+
+      model_path (:obj:`str`):
+          Checkpoint directory the model is served from.
+
+      labels (:obj:`List[str]`):
+          Label names in the order of the label ids.
+
+    Returns:
+      :obj:`Dict[str, float]`: What `fit_temperature` returns.
+
+    """
+
+    logits, true_labels = collect_logits(model, dataloader, device_)
+    result = fit_temperature(logits, true_labels)
+    os.makedirs(model_path, exist_ok=True)
+    with open(os.path.join(model_path, CALIBRATION_FILE), 'w') as f:
+        json.dump(dict(result, labels=list(labels)), f, indent=2)
+    print('temperature: %.4f - nll: %.5f -> %.5f - ece: %.5f -> %.5f' % (
+        result['temperature'], result['nll_before'], result['nll_after'], result['ece_before'], result['ece_after']))
+    return result
+
+
+def load_calibration(model_path, backend=None):
+    r"""
+    Read the temperature and label names to serve a checkpoint with.
+
+    Without a calibration file the temperature is 1, i.e. the plain softmax,
+    and the label names come from `id2label` in the model config.
+
+    Arguments:
+
+      backend (:obj:`object`, `optional`):
+          Backend the logits come from. When its logits are calibrated
+          already (`backend.calibrated`, e.g. the early exits with their own
+          temperatures), the temperature is 1.
+
+    Returns:
+      :obj:`Dict[str, object]`: `temperature` and `labels`.
+
+    """
+
+    path = os.path.join(model_path, CALIBRATION_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            calibration = json.load(f)
+        calibration = {'temperature': calibration['temperature'], 'labels': calibration['labels']}
+    else:
+        with open(os.path.join(model_path, 'config.json')) as f:
+            id2label = json.load(f).get('id2label', {})
+        calibration = {'temperature': 1.0, 'labels': [id2label[key] for key in sorted(id2label, key=int)]}
+
+    if backend is not None and backend.calibrated:
+        calibration['temperature'] = 1.0
+    return calibration
+
+
+def main(args):
+    # Calibrate an existing checkpoint on the held-out split used for validation.
+    # The data stack is only imported here: the server imports this module
+    # for `load_calibration`, and the serving image does not install it
+    from dataset_cache import bucket_dataloader, load_tokenized_splits
+    from model_loader import load_mmap_model
+    from tokenization import load_gpt2_tokenizer
+
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    # Truncate the way the checkpoint was trained and is served
+    splits = load_tokenized_splits(args.data, tokenizer, args.cache_dir, args.model_path, args.max_length, splits=('valid',))
+    dataloader = bucket_dataloader(splits['valid'], splits['collator'], args.batch_size)
+
+    calibrate(load_mmap_model(args.model_path), dataloader, torch.device('cpu'), args.model_path, splits['classes'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit temperature scaling for a checkpoint on the validation split.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    main(parser.parse_args())
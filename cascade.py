@@ -0,0 +1,188 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+# Files of the linear first stage, saved next to the GPT-2 weights
+CASCADE_MODEL_FILE = "cascade.joblib"
+CASCADE_FILE = "cascade.json"
+
+# Confidence thresholds evaluated by the report
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99)
+
+
+def train_linear_model(texts, labels):
+    r"""
+    Fit the cheap first stage: hashed word n-grams, TF-IDF and logistic regression.
+
+    Hashing needs no vocabulary, so the features of a text are computed
+    without any lookup table, and the classes are weighted the same way as in
+    the GPT-2 training.
+
+    Arguments:
+
+      texts (:obj:`List[str]`):
+          Training texts.
+
+      labels (:obj:`np.ndarray`):
+          Encoded labels, ids in the same order as the GPT-2 labels.
+
+    Returns:
+      :obj:`sklearn.pipeline.Pipeline`: Fitted pipeline with `predict_proba`.
+
+    """
+
+    pipeline = make_pipeline(HashingVectorizer(ngram_range=(1, 2), n_features=2 ** 20, alternate_sign=False, norm=None),
+                             TfidfTransformer(sublinear_tf=True),
+                             LogisticRegression(C=1.0, max_iter=1000, class_weight='balanced'))
+    return pipeline.fit(texts, labels)
+
+
+class LinearCascade(object):
+    r"""
+    First stage of the cascade, answering texts it is confident about.
+
+    Arguments:
+
+      pipeline (:obj:`sklearn.pipeline.Pipeline`):
+          Model made by `train_linear_model`.
+
+      threshold (:obj:`float`):
+          Smallest top probability for which the linear model's answer is
+          used instead of running GPT-2.
+
+    """
+
+    def __init__(self, pipeline, threshold):
+
+        self.pipeline = pipeline
+        self.threshold = threshold
+        # Columns of `predict_proba` are these label ids.
+        self.label_ids = np.asarray(pipeline.classes_)
+
+        return
+
+    @classmethod
+    def load(cls, model_path, threshold=None):
+        # Load the saved first stage, with its chosen threshold unless one is given
+        with open(os.path.join(model_path, CASCADE_FILE)) as f:
+            saved = json.load(f)
+        pipeline = joblib.load(os.path.join(model_path, CASCADE_MODEL_FILE))
+        return cls(pipeline, saved['threshold'] if threshold is None else threshold)
+
+    def rank(self, texts):
+        r"""
+        Rank the labels of a batch of texts from most to least likely.
+
+        Returns:
+          :obj:`Tuple[np.ndarray, np.ndarray]`: Label ids and probabilities of
+          shape `[texts, labels]`, each row sorted by probability.
+
+        """
+
+        probabilities = self.pipeline.predict_proba(texts)
+        order = np.argsort(-probabilities, axis=1, kind='stable')
+        return self.label_ids[order], np.take_along_axis(probabilities, order, axis=1)
+
+
+def deflection_report(linear_labels, linear_confidence, model_labels, true_labels, thresholds=THRESHOLDS):
+    r"""
+    Share of texts the linear stage answers, and the accuracy that costs.
+
+    Arguments:
+
+      linear_labels (:obj:`np.ndarray`):
+          Labels predicted by the linear stage.
+
+      linear_confidence (:obj:`np.ndarray`):
+          Top probability of the linear stage.
+
+      model_labels (:obj:`np.ndarray`):
+          Labels predicted by GPT-2.
+
+      true_labels (:obj:`np.ndarray`):
+          Correct labels.
+
+    Returns:
+      :obj:`List[Dict[str, float]]`: One row per threshold.
+
+    """
+
+    model_accuracy = float((model_labels == true_labels).mean())
+    report = []
+    for threshold in thresholds:
+        deflected = linear_confidence >= threshold
+        cascade_labels = np.where(deflected, linear_labels, model_labels)
+        cascade_accuracy = float((cascade_labels == true_labels).mean())
+        report.append({'threshold': threshold,
+                       'deflected': float(deflected.mean()),
+                       'linear_accuracy_deflected': float((linear_labels[deflected] == true_labels[deflected]).mean()) if deflected.any() else None,
+                       'model_accuracy_deflected': float((model_labels[deflected] == true_labels[deflected]).mean()) if deflected.any() else None,
+                       'cascade_accuracy': cascade_accuracy,
+                       'model_accuracy': model_accuracy,
+                       'accuracy_change': cascade_accuracy - model_accuracy})
+    return report
+
+
+def main(args):
+    # Train the linear stage on the training split and pick its threshold on the held-out split
+    from backends import load_backend
+    from calibration import load_calibration
+    from data import encode_labels
+    from dataset_cache import load_tokenized_splits
+    from score import score_texts
+    from tokenization import load_gpt2_tokenizer
+    from truncation import TitledText
+
+    # Only the texts are needed, the linear stage does its own tokenizing
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+    splits = load_tokenized_splits(args.data, tokenizer, None, args.model_path, splits=())
+    train_data, test_data, classes, collator = splits['train_data'], splits['test_data'], splits['classes'], splits['collator']
+    train_labels = encode_labels(classes, train_data['news_list'])
+    true_labels = encode_labels(classes, test_data['news_list'])
+
+    pipeline = train_linear_model(list(train_data['text']), train_labels)
+    cascade = LinearCascade(pipeline, threshold=1.0)
+    label_ids, probabilities = cascade.rank(list(test_data['text']))
+
+    # GPT-2 predictions on the same texts, as served
+    backend = load_backend(args.backend, args.model_path)
+    model_labels, _ = score_texts([TitledText(title, paragraph) for title, paragraph in zip(test_data['title'], test_data['paragraph'])],
+                                  tokenizer, backend, args.batch_size, load_calibration(args.model_path, backend)['temperature'],
+                                  collator.max_sequence_len, collator.strategy)
+
+    report = deflection_report(label_ids[:, 0], probabilities[:, 0], np.asarray(model_labels), true_labels)
+    print("%9s %10s %14s %14s %14s %10s" % ("threshold", "deflected", "linear acc*", "gpt2 acc*", "cascade acc", "change"))
+    for row in report:
+        print("%9.2f %9.1f%% %14s %14s %14.4f %+10.4f" % (
+            row['threshold'], 100 * row['deflected'],
+            "-" if row['linear_accuracy_deflected'] is None else "%.4f" % row['linear_accuracy_deflected'],
+            "-" if row['model_accuracy_deflected'] is None else "%.4f" % row['model_accuracy_deflected'],
+            row['cascade_accuracy'], row['accuracy_change']))
+    print("* on the deflected texts only")
+
+    # The lowest threshold, i.e. the most deflection, within the allowed accuracy drop
+    allowed = [row for row in report if row['accuracy_change'] >= -args.max_accuracy_drop]
+    threshold = allowed[0]['threshold'] if allowed else 1.0
+    print("Chosen threshold: %.2f" % threshold)
+
+    joblib.dump(pipeline, os.path.join(args.model_path, CASCADE_MODEL_FILE))
+    with open(os.path.join(args.model_path, CASCADE_FILE), 'w') as f:
+        json.dump({'threshold': threshold, 'labels': classes, 'max_accuracy_drop': args.max_accuracy_drop, 'report': report}, f, indent=2)
+    print("Saved the cascade to %s" % args.model_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the linear first stage of the cascade and report deflection against accuracy.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005, help="Accuracy the cascade may lose against GPT-2 alone.")
+    main(parser.parse_args())
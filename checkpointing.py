@@ -0,0 +1,182 @@
+# Import necessary libraries
+import json
+import os
+import random
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from safetensors.torch import load_file, save_file
+
+# Checkpoint directories are named after the global optimizer step
+_checkpoint_re = re.compile(r"^checkpoint-(\d+)$")
+
+
+def _snapshot_optimizer(optimizer):
+    # Split the optimizer state into tensors for safetensors and plain values for json
+    state_dict = optimizer.state_dict()
+    tensors = {}
+    values = {}
+    for param_id, param_state in state_dict['state'].items():
+        values[param_id] = {}
+        for name, value in param_state.items():
+            if torch.is_tensor(value):
+                tensors["%s.%s" % (param_id, name)] = value.detach().cpu().contiguous().clone()
+            else:
+                values[param_id][name] = value
+    return tensors, {'state': values, 'param_groups': state_dict['param_groups']}
+
+
+def _rng_state():
+    # Random generator states, so a resumed run draws the same numbers
+    numpy_state = np.random.get_state()
+    return {'python': random.getstate(),
+            'numpy': [numpy_state[0], numpy_state[1].tolist()] + list(numpy_state[2:]),
+            'torch': torch.get_rng_state().tolist()}
+
+
+def _set_rng_state(state):
+    python_state = state['python']
+    random.setstate((python_state[0], tuple(python_state[1]), python_state[2]))
+    numpy_state = state['numpy']
+    np.random.set_state((numpy_state[0], np.array(numpy_state[1], dtype=np.uint32)) + tuple(numpy_state[2:]))
+    torch.set_rng_state(torch.tensor(state['torch'], dtype=torch.uint8))
+
+
+class Checkpointer(object):
+    r"""
+    Save and restore everything needed to resume training.
+
+    A checkpoint holds the model weights and optimizer tensors in safetensors
+    files, and the scheduler state, random generator states and data position
+    in `trainer_state.json`. The model files are loadable with
+    `from_pretrained`, so a checkpoint can be served directly.
+
+    `save` takes a copy of the state on the calling thread and writes it on a
+    background thread, so training only waits for the copy. Each checkpoint is
+    written to a temporary directory and renamed into place, so a crash never
+    leaves a half written checkpoint. Only the last `keep_last` are kept.
+
+    Arguments:
+
+      output_dir (:obj:`str`):
+          Directory holding the `checkpoint-<step>` directories.
+
+      keep_last (:obj:`int`):
+          Number of checkpoints kept on disk.
+
+    """
+
+    def __init__(self, output_dir, keep_last=3):
+
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        # One writer thread, so checkpoints are written in order.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending = None
+        os.makedirs(output_dir, exist_ok=True)
+
+        return
+
+    def save(self, step, model, optimizer, scheduler, position):
+        r"""
+        Snapshot the training state and write it in the background.
+
+        Arguments:
+
+          step (:obj:`int`):
+              Global optimizer step, used to name the checkpoint.
+
+          position (:obj:`dict`):
+              Where to continue in the data, e.g. `{'epoch': 1, 'batch': 500}`.
+
+        """
+
+        # Hold at most one snapshot in memory besides the live state.
+        self.wait()
+
+        weights = {name: tensor.detach().cpu().contiguous().clone() for name, tensor in model.state_dict().items()}
+        optimizer_tensors, optimizer_values = _snapshot_optimizer(optimizer)
+        trainer_state = {'step': step,
+                         'position': position,
+                         'optimizer': optimizer_values,
+                         'scheduler': scheduler.state_dict(),
+                         'rng': _rng_state()}
+        config = model.config.to_json_string()
+
+        self._pending = self._writer.submit(self._write, step, weights, optimizer_tensors, trainer_state, config)
+
+    def wait(self):
+        # Block until the checkpoint being written is on disk. A failed write
+        # is raised once, later saves start from a clean state.
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+    def _write(self, step, weights, optimizer_tensors, trainer_state, config):
+        path = os.path.join(self.output_dir, "checkpoint-%d" % step)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        save_file(weights, os.path.join(tmp_path, "model.safetensors"), metadata={'format': 'pt'})
+        save_file(optimizer_tensors, os.path.join(tmp_path, "optimizer.safetensors"))
+        with open(os.path.join(tmp_path, "trainer_state.json"), "w") as f:
+            json.dump(trainer_state, f)
+        with open(os.path.join(tmp_path, "config.json"), "w") as f:
+            f.write(config)
+
+        # Make the checkpoint visible in one step.
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        # Drop the oldest checkpoints.
+        for old_path in self.checkpoints()[:-self.keep_last]:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def checkpoints(self):
+        # Complete checkpoints, oldest first.
+        steps = []
+        for name in os.listdir(self.output_dir):
+            match = _checkpoint_re.match(name)
+            if match:
+                steps.append(int(match.group(1)))
+        return [os.path.join(self.output_dir, "checkpoint-%d" % step) for step in sorted(steps)]
+
+    def latest(self):
+        # Path of the newest checkpoint or `None`.
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def restore(self, path, model, optimizer, scheduler):
+        r"""
+        Load a checkpoint into the model, optimizer and scheduler.
+
+        Returns:
+          :obj:`Tuple[int, dict]`: Global step and data position saved with it.
+
+        """
+
+        model.load_state_dict(load_file(os.path.join(path, "model.safetensors")))
+        with open(os.path.join(path, "trainer_state.json")) as f:
+            trainer_state = json.load(f)
+
+        # Put tensors and plain values back into one optimizer state dict.
+        optimizer_tensors = load_file(os.path.join(path, "optimizer.safetensors"))
+        state = {}
+        for param_id, values in trainer_state['optimizer']['state'].items():
+            state[int(param_id)] = dict(values)
+        for key, tensor in optimizer_tensors.items():
+            param_id, name = key.split(".", 1)
+            state.setdefault(int(param_id), {})[name] = tensor
+        optimizer.load_state_dict({'state': state, 'param_groups': trainer_state['optimizer']['param_groups']})
+
+        scheduler.load_state_dict(trainer_state['scheduler'])
+        _set_rng_state(trainer_state['rng'])
+        return trainer_state['step'], trainer_state['position']
+
+    def close(self):
+        # Finish the last write and stop the writer thread.
+        self.wait()
+        self._writer.shutdown(wait=True)
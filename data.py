@@ -0,0 +1,316 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sklearn.model_selection import train_test_split
+
+# Columns cleaned by `preprocess_text`, and the one that is dropped
+TEXT_COLUMNS = ('title', 'paragraph', 'news_list')
+DROPPED_COLUMNS = ('event_timestamp',)
+
+# What `preprocess_text` removes from ASCII text, spelled out for RE2 whose
+# `\w` and `\s` are narrower than those of `re`
+_SPECIAL_CHARACTERS = r'[^0-9A-Za-z_\t\n\x0b\x0c\r \x1c-\x1f]'
+
+# Files written by `prepare_splits`
+SPLIT_FILES = {'train': 'train.parquet', 'test': 'test.parquet'}
+SPLITS_META_FILE = 'splits.json'
+
+
+def preprocess_text(text):
+    text = text.lower()  # Convert to lowercase
+    text = re.sub(r'[^\w\s]', '', text)  # Remove special characters
+    return text
+
+
+def encode_labels(classes, values):
+    r"""
+    Map label names to their index in the sorted `classes`.
+
+    Like `LabelEncoder.transform`, a label that is not one of `classes`,
+    e.g. a validation label never seen in training, is an error instead of
+    silently taking the id of its sorted neighbour.
+
+    Arguments:
+
+      classes (:obj:`List[str]`):
+          Sorted label names.
+
+      values (:obj:`pd.Series`):
+          Label names to encode.
+
+    Returns:
+      :obj:`np.ndarray`: int64 label ids.
+
+    """
+
+    values = np.asarray(values, dtype=object)
+    unknown = ~np.isin(values, np.asarray(classes, dtype=object))
+    if unknown.any():
+        raise ValueError("%d labels are not among the %d training labels: %s." % (
+            unknown.sum(), len(classes), ", ".join(sorted(set(map(str, values[unknown]))))))
+    return np.searchsorted(classes, values).astype(np.int64)
+
+
+def preprocess_column(values):
+    r"""
+    `preprocess_text` over a whole column at once.
+
+    ASCII texts, nearly all of the news, are lowercased and cleaned by pyarrow
+    compute kernels. The few others go through `preprocess_text` itself, so
+    the result is the same as applying it row by row.
+
+    Arguments:
+
+      values (:obj:`pd.Series`):
+          Column of strings.
+
+    Returns:
+      :obj:`pd.Series`: Cleaned strings with the index of `values`.
+
+    """
+
+    array = pa.array(values.to_numpy(dtype=object), type=pa.large_string())
+    cleaned = pc.replace_substring_regex(pc.ascii_lower(array), pattern=_SPECIAL_CHARACTERS, replacement='')
+    result = pd.Series(cleaned.to_numpy(zero_copy_only=False), index=values.index, dtype=object)
+
+    other = np.flatnonzero(pc.fill_null(pc.invert(pc.string_is_ascii(array)), False).to_numpy(zero_copy_only=False))
+    if len(other):
+        result.iloc[other] = [preprocess_text(text) for text in values.iloc[other]]
+    return result
+
+
+def preprocess_frame(data):
+    r"""
+    Clean a split the way training expects it.
+
+    The unused columns are dropped, the text columns are preprocessed and a
+    `text` column joins title and paragraph.
+
+    """
+
+    data = data.drop(columns=[column for column in DROPPED_COLUMNS if column in data])
+    for column in TEXT_COLUMNS:
+        data[column] = preprocess_column(data[column])
+    data['text'] = data['title'] + ' ' + data['paragraph']
+    return data
+
+
+def row_hashes(data):
+    # 64-bit hash of every row over all columns, equal rows hash equally
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def drop_duplicate_rows(data):
+    r"""
+    `DataFrame.drop_duplicates` by comparing row hashes instead of the rows.
+
+    Keeps the first of every group of equal rows, in order.
+
+    """
+
+    return data[~pd.Series(row_hashes(data)).duplicated().to_numpy()]
+
+
+def _repair_chunk(texts):
+    # Import here so each pool process only loads the helper library once it works
+    from ml_things import fix_text
+
+    return [fix_text(text) for text in texts]
+
+
+def repair_texts(texts, workers=None, chunk_size=2000):
+    r"""
+    Fix unicode problems with `fix_text`, over chunks in a process pool.
+
+    `fix_text` is pure Python and slow, so the texts are split into chunks
+    repaired by `workers` processes. Small inputs are repaired in place.
+
+    Arguments:
+
+      texts (:obj:`List[str]`):
+          Texts to repair.
+
+      workers (:obj:`int`, `optional`):
+          Number of processes. If no value is passed one per core.
+
+    Returns:
+      :obj:`List[str]`: Repaired texts in the order of `texts`.
+
+    """
+
+    texts = list(texts)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(texts) <= chunk_size:
+        return _repair_chunk(texts)
+
+    chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        return [text for chunk in pool.map(_repair_chunk, chunks) for text in chunk]
+
+
+def _uniform(hashes, seed):
+    # Mix row hashes with the seed (splitmix64) into numbers in [0, 1)
+    with np.errstate(over='ignore'):
+        z = hashes.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15) * np.uint64(seed + 1)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def prepare_splits(path, output_dir, test_size=0.3, random_state=42, batch_size=100000):
+    r"""
+    Deduplicate, split and preprocess a parquet export without loading it.
+
+    The file is read twice in batches. The first pass only keeps a hash and
+    the label of every row: rows without a label are dropped, the first of
+    every group of equal rows is kept, and within every label the rows with the lowest seeded hash values go to
+    the test split, so the split is stratified exactly and does not depend on
+    the row order. The second pass preprocesses the kept rows and writes
+    them to `train.parquet` and `test.parquet` in `output_dir`. Memory use
+    is a few bytes per row plus one batch.
+
+    Arguments:
+
+      path (:obj:`str`):
+          Parquet file with `title`, `paragraph` and `news_list` columns.
+
+      output_dir (:obj:`str`):
+          Directory the splits are written to; `load_splits` reads it.
+
+      test_size (:obj:`float`):
+          Share of every label that goes to the test split.
+
+    Returns:
+      :obj:`Dict[str, object]`: Row counts, also saved as `splits.json`.
+
+    """
+
+    source = pq.ParquetFile(path)
+    columns = source.schema_arrow.names
+
+    # First pass: hashes and label codes of all rows
+    hashes = np.empty(source.metadata.num_rows, dtype=np.uint64)
+    codes = np.empty(source.metadata.num_rows, dtype=np.int32)
+    labels = {}
+    start = 0
+    for batch in source.iter_batches(batch_size=batch_size, columns=columns):
+        frame = batch.to_pandas()
+        hashes[start:start + len(frame)] = row_hashes(frame)
+        batch_codes, uniques = pd.factorize(frame['news_list'])
+        # `factorize` codes a missing label as -1, which the last entry keeps
+        mapping = np.array([labels.setdefault(label, len(labels)) for label in uniques] + [-1], dtype=np.int32)
+        codes[start:start + len(frame)] = mapping[batch_codes]
+        start += len(frame)
+
+    # The first row of every hash, in file order, unless it has no label
+    _, first = np.unique(hashes, return_index=True)
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[first] = True
+    unlabeled = codes < 0
+    keep &= ~unlabeled
+
+    # The lowest `test_size` of every label, ordered by the seeded hash
+    kept = np.flatnonzero(keep)
+    order = kept[np.lexsort((_uniform(hashes[kept], random_state), codes[kept]))]
+    class_counts = np.bincount(codes[order], minlength=len(labels))
+    class_starts = np.concatenate(([0], np.cumsum(class_counts)[:-1]))
+    rank = np.arange(len(order)) - class_starts[codes[order]]
+    is_test = np.zeros(len(hashes), dtype=bool)
+    is_test[order[rank < np.round(class_counts * test_size)[codes[order]]]] = True
+
+    # Second pass: preprocess and write the kept rows of each batch
+    os.makedirs(output_dir, exist_ok=True)
+    writers = {}
+    start = 0
+    for batch in source.iter_batches(batch_size=batch_size, columns=columns):
+        frame = batch.to_pandas()
+        rows = slice(start, start + len(frame))
+        start += len(frame)
+        for split, mask in (('train', keep[rows] & ~is_test[rows]), ('test', is_test[rows])):
+            if not mask.any():
+                continue
+            table = pa.Table.from_pandas(preprocess_frame(frame[mask]), preserve_index=False)
+            if split not in writers:
+                writers[split] = pq.ParquetWriter(os.path.join(output_dir, SPLIT_FILES[split] + '.tmp'), table.schema)
+            writers[split].write_table(table)
+    for split, writer in writers.items():
+        writer.close()
+        os.replace(os.path.join(output_dir, SPLIT_FILES[split] + '.tmp'), os.path.join(output_dir, SPLIT_FILES[split]))
+
+    meta = {'source': os.path.abspath(path),
+            'rows': int(len(hashes)),
+            'unlabeled': int(unlabeled.sum()),
+            'duplicates': int(len(hashes) - keep.sum() - unlabeled.sum()),
+            'train': int((keep & ~is_test).sum()),
+            'test': int(is_test.sum()),
+            'test_by_label': {label: int(is_test[codes == code].sum()) for label, code in labels.items()},
+            'test_size': test_size,
+            'random_state': random_state}
+    with open(os.path.join(output_dir, SPLITS_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_splits(path, test_size=0.3, random_state=42):
+    r"""
+    Load the news parquet file and split it the same way `gpt2.py` does.
+
+    Duplicates are dropped, the split is stratified on `news_list`, the text
+    columns are preprocessed and a `text` column joins title and paragraph.
+    A directory written by `prepare_splits` is read as is.
+
+    Arguments:
+
+      path (:obj:`str`):
+          Path to the parquet file, e.g. `query_resul.parquet`, or to a
+          directory made by `prepare_splits`.
+
+    Returns:
+      :obj:`Tuple[pd.DataFrame, pd.DataFrame]`: Train and test data.
+
+    """
+
+    if os.path.isdir(path):
+        return (pd.read_parquet(os.path.join(path, SPLIT_FILES['train'])),
+                pd.read_parquet(os.path.join(path, SPLIT_FILES['test'])))
+
+    return split_frame(pd.read_parquet(path), test_size, random_state)
+
+
+def split_frame(data, test_size=0.3, random_state=42):
+    # `load_splits` of a data frame already in memory
+    data = drop_duplicate_rows(data)
+
+    # Splitting dataset in test and train
+    train_data, test_data = train_test_split(data, test_size=test_size, random_state=random_state, stratify=data['news_list'])
+
+    return preprocess_frame(train_data), preprocess_frame(test_data)
+
+
+def main(args):
+    start = time.perf_counter()
+    meta = prepare_splits(args.input, args.output_dir, test_size=args.test_size,
+                          random_state=args.random_state, batch_size=args.batch_size)
+    print("%d rows, %d duplicates and %d without a label dropped - train %d, test %d - %.1fs" % (
+        meta['rows'], meta['duplicates'], meta['unlabeled'], meta['train'], meta['test'], time.perf_counter() - start))
+    print("Saved the splits to %s" % args.output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicate, split and preprocess a large parquet export in batches.")
+    parser.add_argument("input", help="Parquet file with `title`, `paragraph` and `news_list` columns.")
+    parser.add_argument("output_dir", help="Directory for train.parquet and test.parquet; pass it to `--data` of the other scripts.")
+    parser.add_argument("--test-size", type=float, default=0.3)
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=100000, help="Rows read at a time.")
+    main(parser.parse_args())
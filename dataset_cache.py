@@ -0,0 +1,295 @@
+# Import necessary libraries
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset
+from data import encode_labels, load_splits, repair_texts
+from samplers import BucketBatchSampler, dataset_lengths
+from truncation import load_truncation, truncate_ids
+
+
+def file_fingerprint(path):
+    # Hash the content of a file in blocks, or of every file of a directory
+    digest = hashlib.sha256()
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    for file_path in paths:
+        digest.update(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    # Hash everything that decides which ids a text is turned into
+    digest = hashlib.sha256(type(tokenizer).__name__.encode('utf-8'))
+    if hasattr(tokenizer, 'backend_tokenizer'):
+        digest.update(tokenizer.backend_tokenizer.to_str().encode('utf-8'))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+        digest.update(json.dumps(sorted((' '.join(pair), rank) for pair, rank in tokenizer.bpe_ranks.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_token_cache(data, tokenizer, cache_dir, source_path, split, classes=None):
+    r"""
+    Tokenize a data split once and save it as memory-mappable numpy files.
+
+    The token ids of all texts are stored back to back in `input_ids.npy`,
+    with `offsets.npy` marking where each text starts, and the encoded labels in
+    `labels.npy`. Texts are stored untruncated so the sequence length can still
+    be chosen at training time, and `title_lengths.npy` keeps how many leading
+    tokens of each text are its title, for the `title+lead` truncation. Nothing
+    is recomputed when a cache for the same tokenizer, source file and split
+    already exists.
+
+    Arguments:
+
+      data (:obj:`pd.DataFrame`):
+          Split with a `text` and a `news_list` column, and optionally the
+          `title` that `text` starts with.
+
+      tokenizer (:obj:`transformers.tokenization_?`):
+          Tokenizer used to turn the texts into ids.
+
+      cache_dir (:obj:`str`):
+          Directory holding one sub directory per cache.
+
+      source_path (:obj:`str`):
+          Parquet file the split was made from.
+
+      split (:obj:`str`):
+          Name of the split, e.g. `train`.
+
+      classes (:obj:`list`, `optional`):
+          Sorted label names. If no value is passed the labels of `data` are
+          used, the same way `LabelEncoder` does.
+
+    Returns:
+      :obj:`str`: Path of the cache directory.
+
+    """
+
+    classes = sorted(data['news_list'].unique()) if classes is None else list(classes)
+    # Fails before tokenizing when the split has labels outside `classes`
+    labels = encode_labels(classes, data['news_list'])
+
+    # The cache key covers the tokenizer, the source file and the split, and
+    # the rows themselves in case the split is subsampled.
+    digest = hashlib.sha256()
+    for part in (tokenizer_fingerprint(tokenizer), file_fingerprint(source_path), split, json.dumps(classes)):
+        digest.update(part.encode('utf-8'))
+    columns = ['title', 'text', 'news_list'] if 'title' in data else ['text', 'news_list']
+    digest.update(pd.util.hash_pandas_object(data[columns], index=False).to_numpy().tobytes())
+    path = os.path.join(cache_dir, '%s-%s' % (split, digest.hexdigest()[:16]))
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+
+    # Fix unicode problems the same way `ReviewDataset` does.
+    texts = repair_texts(data['text'])
+    encodings = tokenizer(texts, truncation=False, verbose=False)['input_ids']
+
+    lengths = np.array([len(ids) for ids in encodings], dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    input_ids = np.fromiter((token for ids in encodings for token in ids), dtype=np.int32, count=int(offsets[-1]))
+    if 'title' in data:
+        titles = tokenizer(repair_texts(data['title']), truncation=False, verbose=False)['input_ids']
+        title_lengths = np.array([len(ids) for ids in titles], dtype=np.int32)
+    else:
+        title_lengths = np.zeros(len(lengths), dtype=np.int32)
+
+    # Write into a temporary directory and rename it once complete.
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'input_ids.npy'), input_ids)
+    np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp_path, 'labels.npy'), labels)
+    np.save(os.path.join(tmp_path, 'title_lengths.npy'), title_lengths)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'classes': classes, 'n_examples': len(labels), 'split': split}, f)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+class TokenizedDataset(Dataset):
+    r"""PyTorch Dataset reading token ids from a cache made by `build_token_cache`.
+
+    The arrays are memory-mapped, so examples are read straight from the page
+    cache without tokenizing or copying the whole split into memory.
+
+    Arguments:
+
+      path (:obj:`str`):
+          Path returned by `build_token_cache`.
+
+    """
+
+    def __init__(self, path):
+
+        self.input_ids = np.load(os.path.join(path, 'input_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+        # Caches made before titles were tracked read as untitled texts
+        title_path = os.path.join(path, 'title_lengths.npy')
+        self.title_lengths = np.load(title_path, mmap_mode='r') if os.path.exists(title_path) else None
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.classes = meta['classes']
+        self.n_examples = meta['n_examples']
+
+    def __len__(self):
+        r"""When used `len` return the number of examples.
+
+        """
+
+        return self.n_examples
+
+    def length(self, item):
+        r"""Number of tokens of an example, without reading its ids.
+
+        """
+
+        return int(self.offsets[item + 1] - self.offsets[item])
+
+    def __getitem__(self, item):
+        r"""Given an index return an example from the position.
+
+        Returns:
+          :obj:`Dict[str, object]`: Dictionary with a read-only view on the token
+          ids, the encoded label and the number of title tokens.
+
+        """
+
+        return {'input_ids': self.input_ids[self.offsets[item]:self.offsets[item + 1]],
+                'label': int(self.labels[item]),
+                'title_length': int(self.title_lengths[item]) if self.title_lengths is not None else 0}
+
+
+class TokenizedCollator(object):
+    r"""
+    Data Collator for `TokenizedDataset` examples.
+
+    It truncates and left-pads the cached token ids into the same batch format
+    `Gpt2ClassificationCollator` produces, without calling the tokenizer. The
+    texts are cut with `truncation.truncate_ids`, as the server does.
+
+    Arguments:
+
+      pad_token_id (:obj:`int`):
+          Id used for padding, the EOS token for GPT2.
+
+      max_sequence_len (:obj:`int`):
+          Value to indicate the maximum desired sequence to truncate text
+          sequences to, i.e. the token budget.
+
+      strategy (:obj:`str`, `optional`):
+          Which tokens of a longer text are kept, one of
+          `truncation.STRATEGIES`. By default the head of the text.
+
+    """
+
+    def __init__(self, pad_token_id, max_sequence_len, strategy="head"):
+
+        self.pad_token_id = pad_token_id
+        self.max_sequence_len = max_sequence_len
+        self.strategy = strategy
+
+        return
+
+    def __call__(self, sequences):
+        r"""
+        Turn a list of examples into a dictionary that feeds into the model.
+
+        """
+
+        ids = [truncate_ids(sequence['input_ids'], self.max_sequence_len, self.strategy, sequence.get('title_length', 0))
+               for sequence in sequences]
+        longest = max(len(row) for row in ids)
+
+        input_ids = np.full((len(ids), longest), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(ids), longest), dtype=np.int64)
+        for i, row in enumerate(ids):
+            # Pad on the left, GPT2 classifies from the last token.
+            if len(row):
+                input_ids[i, -len(row):] = row
+                attention_mask[i, -len(row):] = 1
+
+        return {'input_ids': torch.from_numpy(input_ids),
+                'attention_mask': torch.from_numpy(attention_mask),
+                'labels': torch.tensor([sequence['label'] for sequence in sequences])}
+
+
+def load_tokenized_splits(data_path, tokenizer, cache_dir, model_path=None, max_length=None, strategy=None,
+                          limit=None, splits=('train', 'valid')):
+    r"""
+    The training and held-out splits of the data, tokenized through the token
+    cache, and the collator that cuts them the way a checkpoint was trained.
+
+    The splits are those of `data.load_splits`, and the label names those of
+    the training split, so every script sees the same examples and label ids
+    as fine-tuning did.
+
+    Arguments:
+
+      data_path (:obj:`str`):
+          Parquet file, or directory written by `python data.py`.
+
+      tokenizer (:obj:`transformers.tokenization_?`):
+          Tokenizer used to turn the texts into ids.
+
+      cache_dir (:obj:`str`):
+          Directory holding the token caches.
+
+      model_path (:obj:`str`, `optional`):
+          Checkpoint whose `token_budget` and `truncation_strategy` the
+          collator uses. Without one, or for a hub name, texts keep their head
+          up to the tokenizer's `model_max_length`.
+
+      max_length (:obj:`int`, `optional`):
+          Token budget used instead of the checkpoint's.
+
+      strategy (:obj:`str`, `optional`):
+          Truncation strategy used instead of the checkpoint's.
+
+      limit (:obj:`int`, `optional`):
+          Only use the first `limit` examples of each split.
+
+      splits (:obj:`Tuple[str]`):
+          Splits to tokenize, among `train` and `valid`.
+
+    Returns:
+      :obj:`Dict[str, object]`: The `train_data` and `test_data` frames, the
+      sorted label names as `classes`, a `TokenizedDataset` for each split
+      in `splits` under its name, and the `collator`.
+
+    """
+
+    train_data, test_data = load_splits(data_path)
+    if limit:
+        train_data, test_data = train_data[:limit], test_data[:limit]
+    classes = sorted(train_data['news_list'].unique())
+    result = {'train_data': train_data, 'test_data': test_data, 'classes': classes}
+    for split, data in (('train', train_data), ('valid', test_data)):
+        if split in splits:
+            result[split] = TokenizedDataset(build_token_cache(data, tokenizer, cache_dir, source_path=data_path, split=split,
+                                                               classes=classes))
+
+    truncation = load_truncation(model_path, tokenizer.model_max_length) if model_path and os.path.isdir(model_path) else {}
+    result['collator'] = TokenizedCollator(pad_token_id=tokenizer.pad_token_id,
+                                           max_sequence_len=max_length or truncation.get('budget') or tokenizer.model_max_length,
+                                           strategy=strategy or truncation.get('strategy') or 'head')
+    return result
+
+
+def bucket_dataloader(dataset, collator, batch_size, shuffle=False, seed=0):
+    # Batches of examples of similar length, see `samplers.BucketBatchSampler`;
+    # call `dataloader.batch_sampler.set_epoch` to reshuffle every epoch
+    sampler = BucketBatchSampler(dataset_lengths(dataset, collator.max_sequence_len), batch_size=batch_size, shuffle=shuffle, seed=seed)
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collator)
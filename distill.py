@@ -0,0 +1,264 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.utils.class_weight import compute_class_weight
+from torch.utils.data import DataLoader, Dataset
+from transformers import (set_seed,
+                          get_linear_schedule_with_warmup,
+                          GPT2ForSequenceClassification)
+from cache import checkpoint_fingerprint
+from calibration import calibrate
+from dataset_cache import TokenizedCollator, bucket_dataloader, load_tokenized_splits
+from model_loader import load_mmap_model
+from samplers import BucketBatchSampler, dataset_lengths
+from tokenization import load_gpt2_tokenizer
+from truncation import STRATEGIES, TitledText, encode
+import training
+
+
+def cache_teacher_logits(teacher, dataset, collator, teacher_path, batch_size=16):
+    r"""
+    Run the teacher over a tokenized split once and keep its logits on disk.
+
+    The logits are saved in the token cache directory of the split, named
+    after the teacher checkpoint, so later runs and other students reuse them.
+
+    Returns:
+      :obj:`np.ndarray`: fp32 logits of shape `[examples, labels]`, memory-mapped.
+
+    """
+
+    path = os.path.join(os.path.dirname(dataset.offsets.filename),
+                        'teacher-%s-%d-%s.npy' % (checkpoint_fingerprint(teacher_path), collator.max_sequence_len, collator.strategy))
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+
+    logits = np.zeros((len(dataset), teacher.config.num_labels), dtype=np.float32)
+    # Length-sorted batches waste the least compute on padding.
+    sampler = BucketBatchSampler(dataset_lengths(dataset, collator.max_sequence_len), batch_size=batch_size, shuffle=False)
+    teacher.eval()
+    with torch.no_grad():
+        for indices in sampler:
+            batch = collator([dataset[i] for i in indices])
+            logits[indices] = teacher(input_ids=batch['input_ids'], attention_mask=batch['attention_mask']).logits.float().numpy()
+
+    np.save(path + '.tmp.npy', logits)
+    os.replace(path + '.tmp.npy', path)
+    return np.load(path, mmap_mode='r')
+
+
+class DistillationDataset(Dataset):
+    r"""
+    `TokenizedDataset` examples together with the teacher's logits.
+
+    """
+
+    def __init__(self, dataset, teacher_logits):
+
+        self.dataset = dataset
+        self.teacher_logits = teacher_logits
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, item):
+        return dict(self.dataset[item], teacher_logits=self.teacher_logits[item])
+
+
+class DistillationCollator(TokenizedCollator):
+    r"""
+    `TokenizedCollator` that also stacks the teacher logits of the batch.
+
+    """
+
+    def __call__(self, sequences):
+        batch = super().__call__(sequences)
+        batch['teacher_logits'] = torch.from_numpy(np.stack([sequence['teacher_logits'] for sequence in sequences]))
+        return batch
+
+
+class DistillationLoss(torch.nn.Module):
+    r"""
+    Soft-target loss of the student against the teacher, mixed with the usual
+    class weighted cross entropy against the true labels.
+
+    The KL divergence between the temperature-softened distributions is scaled
+    by `temperature ** 2` so its gradients keep the same size whatever the
+    temperature (Hinton et al., 2015).
+
+    Arguments:
+
+      class_weights (:obj:`torch.Tensor`):
+          Weights of the cross entropy, as in training the teacher.
+
+      temperature (:obj:`float`):
+          Softening of both distributions; higher shows more of the teacher's
+          ranking of the wrong labels.
+
+      alpha (:obj:`float`):
+          Share of the soft-target loss, the rest is the cross entropy.
+
+    """
+
+    def __init__(self, class_weights, temperature=2.0, alpha=0.5):
+
+        super().__init__()
+        self.cross_entropy = torch.nn.CrossEntropyLoss(weight=class_weights)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, logits, labels, teacher_logits):
+        soft = torch.nn.functional.kl_div(torch.log_softmax(logits / self.temperature, dim=-1),
+                                          torch.log_softmax(teacher_logits / self.temperature, dim=-1),
+                                          reduction='batchmean', log_target=True)
+        return self.alpha * self.temperature ** 2 * soft + (1 - self.alpha) * self.cross_entropy(logits, labels)
+
+
+def truncated_student(teacher, n_layers):
+    r"""
+    Build a shallower GPT-2 classifier initialized from the teacher.
+
+    The student keeps the teacher's embeddings, final layer norm and
+    classification head, and `n_layers` of its blocks spread evenly over the
+    depth (always including the first and last), the way DistilBERT is
+    initialized from BERT.
+
+    """
+
+    config = teacher.config.__class__.from_dict(teacher.config.to_dict())
+    config.n_layer = n_layers
+    student = GPT2ForSequenceClassification(config)
+
+    kept = np.linspace(0, teacher.config.n_layer - 1, n_layers).round().astype(int).tolist()
+    state_dict = {}
+    for name, tensor in teacher.state_dict().items():
+        if name.startswith('transformer.h.'):
+            layer, rest = name[len('transformer.h.'):].split('.', 1)
+            if int(layer) not in kept:
+                continue
+            name = 'transformer.h.%d.%s' % (kept.index(int(layer)), rest)
+        state_dict[name] = tensor.clone()
+    student.load_state_dict(state_dict)
+    return student
+
+
+def benchmark(model, tokenizer, texts, batch_sizes=(1, 8), repeats=20):
+    r"""
+    Median CPU latency of a forward pass at a few batch sizes, and model size.
+
+    The `texts` are token ids, already fit into the token budget.
+
+    """
+
+    result = {'parameters': sum(p.numel() for p in model.parameters()),
+              'size_mb': sum(p.numel() * p.element_size() for p in model.parameters()) / 2 ** 20}
+    model.eval()
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            inputs = tokenizer.pad({'input_ids': texts[:batch_size]}, return_tensors='pt')
+            model(**inputs)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model(**inputs)
+                timings.append(time.perf_counter() - start)
+            result['latency_ms_batch_%d' % batch_size] = 1000 * float(np.median(timings))
+    return result
+
+
+def evaluate(model, dataloader, device_):
+    # Macro-F1 and accuracy on the validation split
+    true_labels, predictions_labels, _ = training.validation(model, dataloader, device_, progress=False)
+    return {'macro_f1': f1_score(true_labels, predictions_labels, average='macro'),
+            'accuracy': accuracy_score(true_labels, predictions_labels)}
+
+
+def main(args):
+    set_seed(args.seed)
+    device = torch.device('cpu')
+
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    # The teacher's budget and strategy unless others are given
+    splits = load_tokenized_splits(args.data, tokenizer, args.cache_dir, args.teacher, args.max_length, args.truncation, args.limit)
+    train_dataset, valid_dataset, collator = splits['train'], splits['valid'], splits['collator']
+    max_sequence_len, strategy = collator.max_sequence_len, collator.strategy
+
+    teacher = load_mmap_model(args.teacher)
+    print('Caching teacher logits...')
+    teacher_logits = cache_teacher_logits(teacher, train_dataset, collator, args.teacher, args.batch_size)
+
+    if args.student_model:
+        # A separately pretrained smaller GPT-2, e.g. `distilgpt2`
+        student = GPT2ForSequenceClassification.from_pretrained(args.student_model, num_labels=len(train_dataset.classes))
+        student.resize_token_embeddings(len(tokenizer))
+        student.config.pad_token_id = student.config.eos_token_id
+    else:
+        student = truncated_student(teacher, args.student_layers)
+    student.config.id2label = dict(enumerate(train_dataset.classes))
+    student.config.label2id = {label: i for i, label in enumerate(train_dataset.classes)}
+    student.config.token_budget = max_sequence_len
+    student.config.truncation_strategy = strategy
+
+    class_weights = compute_class_weight('balanced', classes=np.arange(len(train_dataset.classes)), y=np.asarray(train_dataset.labels))
+    loss_fn = DistillationLoss(torch.tensor(class_weights, dtype=torch.float), temperature=args.temperature, alpha=args.alpha)
+
+    train_sampler = BucketBatchSampler(dataset_lengths(train_dataset, max_sequence_len), batch_size=args.batch_size, seed=args.seed)
+    train_dataloader = DataLoader(DistillationDataset(train_dataset, teacher_logits), batch_sampler=train_sampler,
+                                  collate_fn=DistillationCollator(tokenizer.pad_token_id, max_sequence_len, strategy))
+    valid_dataloader = bucket_dataloader(valid_dataset, collator, args.batch_size)
+
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, eps=1e-8)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=len(train_dataloader) * args.epochs)
+
+    for epoch in range(args.epochs):
+        train_sampler.set_epoch(epoch)
+        _, _, train_loss = training.train(student, train_dataloader, optimizer, scheduler, device, loss_fn)
+        scores = evaluate(student, valid_dataloader, device)
+        print("epoch %d - distill_loss: %.5f - val_macro_f1: %.5f - val_acc: %.5f" % (epoch + 1, train_loss, scores['macro_f1'], scores['accuracy']))
+
+    student.save_pretrained(args.output_dir)
+    tokenizer.save_pretrained(args.output_dir)
+    calibrate(student, valid_dataloader, device, args.output_dir, train_dataset.classes)
+
+    # Compare with the teacher on the same held-out split and texts
+    test_data = splits['test_data']
+    texts = encode(tokenizer, [TitledText(title, paragraph) for title, paragraph in zip(test_data['title'][:8], test_data['paragraph'][:8])],
+                   max_sequence_len, strategy)
+    report = {}
+    for name, model in (('teacher', teacher), ('student', student)):
+        report[name] = dict(benchmark(model, tokenizer, texts), **evaluate(model, valid_dataloader, device))
+        report[name]['layers'] = model.config.n_layer
+
+    columns = ['layers', 'parameters', 'size_mb', 'latency_ms_batch_1', 'latency_ms_batch_8', 'macro_f1', 'accuracy']
+    print("%-8s" % "model" + "".join("%20s" % column for column in columns))
+    for name, row in report.items():
+        print("%-8s" % name + "".join("%20.4g" % row[column] for column in columns))
+    with open(os.path.join(args.output_dir, 'distill_report.json'), 'w') as f:
+        json.dump(dict(report, settings=vars(args)), f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the fine-tuned GPT-2 classifier into a smaller student that main.py can serve.")
+    parser.add_argument("--teacher", default="weights/garr-epoch-0")
+    parser.add_argument("--output-dir", default="weights/student")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--student-layers", type=int, default=6, help="Blocks kept from the teacher.")
+    parser.add_argument("--student-model", default=None, help="Start from this pretrained model instead, e.g. distilgpt2.")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the soft-target loss.")
+    parser.add_argument("--max-length", type=int, default=None, help="Token budget, the teacher's by default.")
+    parser.add_argument("--truncation", default=None, choices=list(STRATEGIES), help="Tokens kept of longer texts, the teacher's by default.")
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N examples of each split.")
+    main(parser.parse_args())
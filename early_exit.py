@@ -0,0 +1,444 @@
+# Import necessary libraries
+import argparse
+import copy
+import json
+import os
+import time
+import numpy as np
+import torch
+from features import last_token_indices
+
+# Exit heads, their temperatures and the chosen threshold, saved next to the GPT-2 weights
+EARLY_EXIT_FILE = "early_exit.pt"
+EARLY_EXIT_REPORT_FILE = "early_exit.json"
+
+# Confidence thresholds evaluated by the report
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99)
+
+
+def causal_padding_mask(attention_mask, dtype):
+    r"""
+    Additive attention mask of shape `[batch, 1, tokens, tokens]`.
+
+    Every token attends to itself and the tokens before it, never to
+    padding. Rows that are all padding get a uniform mask instead of NaNs.
+
+    """
+
+    n_tokens = attention_mask.shape[1]
+    causal = torch.ones(n_tokens, n_tokens, dtype=torch.bool, device=attention_mask.device).tril()
+    allowed = causal[None, None] & attention_mask.bool()[:, None, None, :]
+    return torch.zeros(allowed.shape, dtype=dtype, device=attention_mask.device).masked_fill(~allowed, torch.finfo(dtype).min)
+
+
+class EarlyExitClassifier(torch.nn.Module):
+    r"""
+    Fine-tuned GPT-2 classifier that can stop after an intermediate block.
+
+    A small head, a copy of the final layer norm and classification head,
+    reads the last token after each of `exit_layers`. Only the heads are
+    trained; the fine-tuned model stays frozen and still answers at the last
+    layer. `predict` runs the blocks one exit at a time and stops for the
+    rows whose calibrated top probability reaches the threshold, so the
+    remaining blocks only run on the rows that are still unsure.
+
+    Arguments:
+
+      model (:obj:`transformers.GPT2ForSequenceClassification`):
+          Fine-tuned classifier, whose weights are frozen.
+
+      exit_layers (:obj:`List[int]`):
+          Number of blocks run before each exit head, between 1 and
+          `n_layer - 1`.
+
+    """
+
+    def __init__(self, model, exit_layers):
+
+        super().__init__()
+        n_layer = model.config.n_layer
+        if not exit_layers or any(layer < 1 or layer >= n_layer for layer in exit_layers):
+            raise ValueError("Exit layers must be between 1 and %d." % (n_layer - 1))
+
+        self.model = model
+        for parameter in self.model.parameters():
+            parameter.requires_grad_(False)
+        self.exit_layers = sorted(set(exit_layers))
+
+        # Starting from the final head gives every exit a sensible first guess
+        self.heads = torch.nn.ModuleList(
+            torch.nn.Sequential(copy.deepcopy(model.transformer.ln_f), copy.deepcopy(model.score))
+            for _ in self.exit_layers)
+        for parameter in self.heads.parameters():
+            parameter.requires_grad_(True)
+
+        # Temperature of every exit and, last, of the full model, fitted by `calibrate`
+        self.register_buffer('temperatures', torch.ones(len(self.exit_layers) + 1))
+        # Smallest calibrated top probability that stops at an exit
+        self.threshold = 1.0
+
+        return
+
+    def train(self, mode=True):
+        # The frozen backbone always runs without dropout
+        super().train(mode)
+        self.model.eval()
+        return self
+
+    def _embed(self, input_ids):
+        # Token and position embeddings, as the first step of `GPT2Model`
+        transformer = self.model.transformer
+        positions = torch.arange(input_ids.shape[1], device=input_ids.device)
+        return transformer.drop(transformer.wte(input_ids) + transformer.wpe(positions)[None])
+
+    def _run_blocks(self, hidden, mask, start, end):
+        for block in self.model.transformer.h[start:end]:
+            output = block(hidden, attention_mask=mask, use_cache=False)
+            # Older transformers versions return a tuple
+            hidden = output[0] if isinstance(output, tuple) else output
+        return hidden
+
+    def _last_tokens(self, hidden, input_ids):
+        return hidden[torch.arange(len(input_ids), device=hidden.device), last_token_indices(input_ids, self.model.config.pad_token_id)]
+
+    def _exit_logits(self, exit_index, features):
+        # The last exit is the fine-tuned model itself
+        if exit_index < len(self.heads):
+            return self.heads[exit_index](features)
+        return self.model.score(self.model.transformer.ln_f(features))
+
+    def exit_logits(self, input_ids, attention_mask, final=True):
+        r"""
+        Logits of every exit for the whole batch.
+
+        Arguments:
+
+          final (:obj:`bool`):
+              Also run the remaining blocks and add the full model's logits
+              as the last exit.
+
+        Returns:
+          :obj:`torch.Tensor`: Logits of shape `[batch, exits, labels]`.
+
+        """
+
+        # Only the heads learn, so the blocks run without keeping activations
+        with torch.no_grad():
+            hidden = self._embed(input_ids)
+            mask = causal_padding_mask(attention_mask, hidden.dtype)
+            features = []
+            start = 0
+            for layer in self.exit_layers + ([self.model.config.n_layer] if final else []):
+                hidden = self._run_blocks(hidden, mask, start, layer)
+                start = layer
+                features.append(self._last_tokens(hidden, input_ids))
+        return torch.stack([self._exit_logits(i, exit_features) for i, exit_features in enumerate(features)], dim=1)
+
+    def forward(self, input_ids, attention_mask, labels=None):
+        # Training pass for `training.train`: the logits of the exit heads, and
+        # their mean cross entropy when labels are given
+        logits = self.exit_logits(input_ids, attention_mask, final=False)
+        loss = None
+        if labels is not None:
+            loss = torch.nn.functional.cross_entropy(logits.flatten(0, 1), labels.repeat_interleave(logits.shape[1]))
+        return loss, logits
+
+    @torch.no_grad()
+    def predict(self, input_ids, attention_mask, threshold=None):
+        r"""
+        Classify a left-padded batch, stopping every row at its first
+        confident exit.
+
+        After each exit the rows that are done leave the batch, and columns
+        that are padding in every remaining row are cut, so later blocks only
+        run on the unsure rows.
+
+        Arguments:
+
+          threshold (:obj:`float`, `optional`):
+              Smallest calibrated top probability that stops a row. If no
+              value is passed `self.threshold` is used.
+
+        Returns:
+          :obj:`Tuple[torch.Tensor, torch.Tensor]`: Calibrated logits of shape
+          `[batch, labels]` (their softmax gives the probabilities) and the
+          number of blocks run for every row.
+
+        """
+
+        threshold = self.threshold if threshold is None else threshold
+        n_layer = self.model.config.n_layer
+        logits = torch.zeros(len(input_ids), self.model.config.num_labels, device=input_ids.device)
+        layers = torch.full((len(input_ids),), n_layer, dtype=torch.long, device=input_ids.device)
+        rows = torch.arange(len(input_ids), device=input_ids.device)
+
+        hidden = self._embed(input_ids)
+        mask = causal_padding_mask(attention_mask, hidden.dtype)
+        start = 0
+        for exit_index, layer in enumerate(self.exit_layers + [n_layer]):
+            hidden = self._run_blocks(hidden, mask, start, layer)
+            start = layer
+            exit_logits = self._exit_logits(exit_index, self._last_tokens(hidden, input_ids)).float() / self.temperatures[exit_index]
+            if layer == n_layer:
+                done = torch.ones(len(rows), dtype=torch.bool, device=rows.device)
+            else:
+                done = exit_logits.softmax(dim=-1).max(dim=-1).values >= threshold
+            logits[rows[done]] = exit_logits[done]
+            layers[rows[done]] = layer
+            if done.all():
+                break
+
+            # Keep the unsure rows, and only the columns some of them use
+            keep = ~done
+            rows, hidden, input_ids, attention_mask = rows[keep], hidden[keep], input_ids[keep], attention_mask[keep]
+            first = int(attention_mask.any(dim=0).int().argmax())
+            if first:
+                hidden, input_ids, attention_mask = hidden[:, first:], input_ids[:, first:], attention_mask[:, first:]
+            mask = causal_padding_mask(attention_mask, hidden.dtype)
+
+        return logits, layers
+
+    def calibrate(self, exit_logits, labels):
+        r"""
+        Fit the temperature of every exit so thresholds mean the same at
+        every depth.
+
+        Arguments:
+
+          exit_logits (:obj:`torch.Tensor`):
+              Validation logits of shape `[examples, exits, labels]` from
+              `collect_exit_logits`, the full model last.
+
+        Returns:
+          :obj:`List[Dict[str, float]]`: What `fit_temperature` returns, per exit.
+
+        """
+
+        from calibration import fit_temperature
+
+        results = [fit_temperature(exit_logits[:, i], labels) for i in range(exit_logits.shape[1])]
+        self.temperatures.copy_(torch.tensor([result['temperature'] for result in results]))
+        return results
+
+    def save(self, model_path, report=None):
+        # Heads, temperatures and threshold; the backbone is the checkpoint itself
+        torch.save({'exit_layers': self.exit_layers,
+                    'heads': self.heads.state_dict(),
+                    'temperatures': self.temperatures,
+                    'threshold': self.threshold},
+                   os.path.join(model_path, EARLY_EXIT_FILE))
+        if report is not None:
+            with open(os.path.join(model_path, EARLY_EXIT_REPORT_FILE), 'w') as f:
+                json.dump(report, f, indent=2)
+
+    @classmethod
+    def load(cls, model, model_path, threshold=None):
+        # Add the saved exit heads to the checkpoint's model, with the chosen threshold unless one is given
+        saved = torch.load(os.path.join(model_path, EARLY_EXIT_FILE), map_location='cpu')
+        early_exit = cls(model, saved['exit_layers'])
+        early_exit.heads.load_state_dict(saved['heads'])
+        early_exit.temperatures.copy_(saved['temperatures'])
+        early_exit.threshold = saved['threshold'] if threshold is None else threshold
+        return early_exit.eval()
+
+
+class ExitLoss(torch.nn.Module):
+    r"""
+    Class weighted cross entropy averaged over the exit heads.
+
+    Arguments:
+
+      class_weights (:obj:`torch.Tensor`):
+          Weights of the cross entropy, as in fine-tuning.
+
+    """
+
+    def __init__(self, class_weights):
+
+        super().__init__()
+        self.cross_entropy = torch.nn.CrossEntropyLoss(weight=class_weights)
+
+    def forward(self, logits, labels):
+        # `logits` are `[batch, exits, labels]`
+        return self.cross_entropy(logits.flatten(0, 1), labels.repeat_interleave(logits.shape[1]))
+
+
+def collect_exit_logits(early_exit, dataloader, device_):
+    # Logits of every exit and the full model over a data loader, with the labels
+    logits = []
+    labels = []
+    early_exit.eval()
+    with torch.no_grad():
+        for batch in dataloader:
+            labels.append(batch['labels'])
+            logits.append(early_exit.exit_logits(batch['input_ids'].to(device_), batch['attention_mask'].to(device_)).float().cpu())
+    return torch.cat(logits), torch.cat(labels).long()
+
+
+def threshold_report(exit_logits, labels, temperatures, exit_layers, thresholds=THRESHOLDS):
+    r"""
+    Accuracy and depth of early exit at every threshold, from the logits of
+    all exits.
+
+    Arguments:
+
+      exit_logits (:obj:`torch.Tensor`):
+          Logits of shape `[examples, exits, labels]`, the full model last.
+
+      exit_layers (:obj:`List[int]`):
+          Blocks run before each exit, the full model's `n_layer` last.
+
+    Returns:
+      :obj:`List[Dict[str, float]]`: One row per threshold.
+
+    """
+
+    from sklearn.metrics import accuracy_score, f1_score
+
+    probabilities = (exit_logits.float() / temperatures[None, :, None]).softmax(dim=-1)
+    confidence, predictions = probabilities.max(dim=-1)
+    true_labels = labels.numpy()
+    model_labels = predictions[:, -1].numpy()
+    model_accuracy = accuracy_score(true_labels, model_labels)
+    layers = np.asarray(exit_layers)
+
+    report = []
+    for threshold in thresholds:
+        # The first confident exit, the full model when none is
+        confident = confidence >= threshold
+        confident[:, -1] = True
+        first = confident.int().argmax(dim=1).numpy()
+        exit_labels = predictions.numpy()[np.arange(len(first)), first]
+        accuracy = accuracy_score(true_labels, exit_labels)
+        report.append({'threshold': threshold,
+                       'accuracy': accuracy,
+                       'macro_f1': f1_score(true_labels, exit_labels, average='macro'),
+                       'accuracy_change': accuracy - model_accuracy,
+                       'average_layers': float(layers[first].mean()),
+                       'exited': {int(layer): float((first == i).mean()) for i, layer in enumerate(layers)}})
+    return report
+
+
+def measure_latency(early_exit, tokenizer, texts, threshold, batch_size=16):
+    r"""
+    Latency of single texts and throughput over batches, with the same early
+    exit path the server runs. `threshold` of `None` runs the full model.
+
+    The `texts` are token ids, already fit into the token budget.
+
+    """
+
+    def run(ids):
+        inputs = tokenizer.pad({'input_ids': ids}, return_tensors='pt')
+        if threshold is None:
+            with torch.no_grad():
+                return early_exit.model(**inputs).logits
+        return early_exit.predict(inputs['input_ids'], inputs['attention_mask'], threshold)
+
+    run(texts[:1])
+    timings = []
+    for ids in texts:
+        start = time.perf_counter()
+        run([ids])
+        timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        run(texts[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+    return {'latency_ms_p50': 1000 * float(np.percentile(timings, 50)),
+            'latency_ms_p95': 1000 * float(np.percentile(timings, 95)),
+            'texts_per_second': len(texts) / elapsed}
+
+
+def main(args):
+    # Train exit heads on the frozen checkpoint, calibrate them and pick the threshold
+    from sklearn.metrics import accuracy_score, f1_score
+    from sklearn.utils.class_weight import compute_class_weight
+    from transformers import set_seed, get_linear_schedule_with_warmup
+    from dataset_cache import bucket_dataloader, load_tokenized_splits
+    from model_loader import load_mmap_model
+    from tokenization import load_gpt2_tokenizer
+    from truncation import TitledText, encode
+    import training
+
+    set_seed(args.seed)
+    device = torch.device('cpu')
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    splits = load_tokenized_splits(args.data, tokenizer, args.cache_dir, args.model_path, limit=args.limit)
+    train_dataset, collator, test_data = splits['train'], splits['collator'], splits['test_data']
+
+    model = load_mmap_model(args.model_path)
+    model.config.pad_token_id = model.config.eos_token_id if model.config.pad_token_id is None else model.config.pad_token_id
+    early_exit = EarlyExitClassifier(model, args.exit_layers)
+
+    class_weights = compute_class_weight('balanced', classes=np.arange(len(train_dataset.classes)), y=np.asarray(train_dataset.labels))
+    loss_fn = ExitLoss(torch.tensor(class_weights, dtype=torch.float))
+
+    train_dataloader = bucket_dataloader(train_dataset, collator, args.batch_size, shuffle=True, seed=args.seed)
+    valid_dataloader = bucket_dataloader(splits['valid'], collator, args.batch_size)
+
+    optimizer = torch.optim.AdamW(early_exit.heads.parameters(), lr=args.lr, eps=1e-8)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=len(train_dataloader) * args.epochs)
+    for epoch in range(args.epochs):
+        train_dataloader.batch_sampler.set_epoch(epoch)
+        # The predictions `train` returns cover every exit, only the loss is used
+        _, _, train_loss = training.train(early_exit, train_dataloader, optimizer, scheduler, device, loss_fn)
+        print("epoch %d - exit_loss: %.5f" % (epoch + 1, train_loss))
+
+    # Calibrated logits of every exit on the held-out split
+    exit_logits, labels = collect_exit_logits(early_exit, valid_dataloader, device)
+    calibration = early_exit.calibrate(exit_logits, labels)
+    exit_layers = early_exit.exit_layers + [model.config.n_layer]
+    for layer, result, logits in zip(exit_layers, calibration, exit_logits.unbind(dim=1)):
+        predictions = logits.argmax(dim=-1).numpy()
+        print("exit after %2d blocks - temperature %.3f - val_macro_f1: %.5f - val_acc: %.5f" % (
+            layer, result['temperature'], f1_score(labels.numpy(), predictions, average='macro'), accuracy_score(labels.numpy(), predictions)))
+
+    # Accuracy, depth and latency at every threshold, against the full model
+    report = threshold_report(exit_logits, labels, early_exit.temperatures, exit_layers, args.thresholds)
+    texts = encode(tokenizer, [TitledText(title, paragraph) for title, paragraph in
+                               zip(test_data['title'][:args.latency_samples], test_data['paragraph'][:args.latency_samples])],
+                   collator.max_sequence_len, collator.strategy)
+    baseline = measure_latency(early_exit, tokenizer, texts, None, args.batch_size)
+    for row in report:
+        row.update(measure_latency(early_exit, tokenizer, texts, row['threshold'], args.batch_size))
+
+    print("%9s %10s %10s %8s %8s %10s %10s %10s" % ("threshold", "accuracy", "macro-f1", "change", "layers", "p50 ms", "p95 ms", "texts/s"))
+    print("%9s %10.4f %10s %8s %8d %10.1f %10.1f %10.1f" % (
+        "full", report[0]['accuracy'] - report[0]['accuracy_change'], "-", "-", model.config.n_layer,
+        baseline['latency_ms_p50'], baseline['latency_ms_p95'], baseline['texts_per_second']))
+    for row in report:
+        print("%9.2f %10.4f %10.4f %+8.4f %8.2f %10.1f %10.1f %10.1f" % (
+            row['threshold'], row['accuracy'], row['macro_f1'], row['accuracy_change'], row['average_layers'],
+            row['latency_ms_p50'], row['latency_ms_p95'], row['texts_per_second']))
+
+    # The lowest threshold, i.e. the fewest layers, within the allowed accuracy drop
+    allowed = [row for row in report if row['accuracy_change'] >= -args.max_accuracy_drop]
+    early_exit.threshold = allowed[0]['threshold'] if allowed else 1.0
+    print("Chosen threshold: %.2f" % early_exit.threshold)
+
+    early_exit.save(args.model_path, {'threshold': early_exit.threshold, 'exit_layers': exit_layers,
+                                      'temperatures': early_exit.temperatures.tolist(), 'full_model': baseline,
+                                      'report': report, 'settings': vars(args)})
+    print("Saved the exit heads to %s, serve them with MODEL_BACKEND=early-exit" % args.model_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train early-exit heads on intermediate GPT-2 layers and report accuracy against latency per threshold.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--exit-layers", type=lambda s: [int(v) for v in s.split(",")], default=[3, 6, 9],
+                        help="Blocks run before each exit head.")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--thresholds", type=lambda s: [float(v) for v in s.split(",")], default=list(THRESHOLDS))
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005, help="Accuracy early exit may lose against the full model.")
+    parser.add_argument("--latency-samples", type=int, default=100, help="Held-out texts timed at every threshold.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N examples of each split.")
+    parser.add_argument("--seed", type=int, default=123)
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+# Import necessary libraries
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    r"""
+    Raised when inference can not take more work right now.
+
+    """
+
+
+class BoundedExecutor(object):
+    r"""
+    Thread pool that runs inference off the event loop with a fixed capacity.
+
+    PyTorch releases the GIL inside its kernels, so a few threads are enough to
+    keep the cores busy while the event loop keeps serving other requests.
+    Each worker thread gets its own intra-op thread budget so workers do not
+    oversubscribe the cores.
+
+    Arguments:
+
+      max_workers (:obj:`int`):
+          Number of forward passes that can run at the same time.
+
+      threads_per_worker (:obj:`int`, `optional`):
+          Value passed to `torch.set_num_threads` in each worker. If no value
+          is passed the cores are split evenly between the workers.
+
+    """
+
+    def __init__(self, max_workers=1, threads_per_worker=None):
+
+        self.max_workers = max_workers
+        self.threads_per_worker = threads_per_worker
+        self._threads_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="inference",
+                                        initializer=self._set_threads)
+        # Free worker slots, only touched from the event loop.
+        self._slots = None
+
+        return
+
+    def _set_threads(self):
+        # torch is only imported once the first worker starts.
+        import torch
+
+        with self._threads_lock:
+            # Split the cores between workers unless told otherwise.
+            if self.threads_per_worker is None:
+                self.threads_per_worker = max(1, torch.get_num_threads() // self.max_workers)
+        torch.set_num_threads(self.threads_per_worker)
+
+    def full(self):
+        # Tell if every worker is busy.
+        return self._slots is not None and self._slots.locked()
+
+    async def run(self, fn, *args, block=False):
+        r"""
+        Run `fn(*args)` on a worker thread and wait for the result.
+
+        Arguments:
+
+          block (:obj:`bool`):
+              Wait for a free worker instead of raising `Overloaded` when all
+              workers are busy.
+
+        """
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        if self.full() and not block:
+            raise Overloaded("All %d inference workers are busy." % self.max_workers)
+
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = self._pool.submit(fn, *args)
+        # Free the slot when the work is really done, even if the caller left.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
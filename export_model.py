@@ -0,0 +1,102 @@
+# Import necessary libraries
+import argparse
+import os
+import torch
+from backends import INT8_FILE, ONNX_FILE, export_onnx, load_backend, load_fp32_model, quantize_model
+from model_loader import bundle_tokenizer, load_tokenizer
+from truncation import encode, load_truncation
+
+
+def convert(args):
+    # Convert the fp32 checkpoint and save the result next to it
+    model = load_fp32_model(args.model_path)
+    if args.command == "onnx":
+        output_path = os.path.join(args.model_path, ONNX_FILE)
+        export_onnx(model, output_path)
+    else:
+        output_path = os.path.join(args.model_path, INT8_FILE)
+        torch.save(quantize_model(model), output_path)
+    print("Saved `%s` backend to %s" % (args.command, output_path))
+
+
+def save_tokenizer(args):
+    # Bundle the tokenizer with the checkpoint for offline startup
+    bundle_tokenizer(args.model_path, args.tokenizer)
+    print("Saved tokenizer `%s` to %s" % (args.tokenizer, args.model_path))
+
+
+def verify(args):
+    r"""
+    Compare a backend against the fp32 baseline on the held-out split.
+
+    The inputs are made the way the server makes them: the tokenizer bundled
+    with the checkpoint, the normalized title and paragraph, cut to the
+    checkpoint's token budget with its truncation strategy and left-padded.
+    Probabilities are compared after each backend's calibration.
+
+    Fails when the share of matching labels is below `--min-agreement` or the
+    largest difference between softmax probabilities is above `--max-prob-diff`.
+
+    """
+
+    # Only verification reads the data; the Docker image, which runs the
+    # `tokenizer` command, does not install pandas
+    from calibration import load_calibration
+    from data import load_splits
+    from score import normalize_row
+
+    tokenizer = load_tokenizer(args.model_path, fallback=args.tokenizer)
+    truncation = load_truncation(args.model_path, tokenizer.model_max_length)
+
+    # Use the same held-out split as training
+    _, test_data = load_splits(args.data)
+    texts = [normalize_row(title, paragraph) for title, paragraph in zip(test_data['title'][:args.limit], test_data['paragraph'][:args.limit])]
+    texts = [text for text in texts if text is not None]
+
+    baseline = load_backend("eager", args.model_path, device=torch.device("cpu"))
+    candidate = load_backend(args.backend, args.model_path)
+    temperatures = [load_calibration(args.model_path, backend)['temperature'] for backend in (baseline, candidate)]
+
+    matches = 0
+    max_prob_diff = 0.0
+    for start in range(0, len(texts), args.batch_size):
+        ids = encode(tokenizer, texts[start:start + args.batch_size], truncation['budget'], truncation['strategy'])
+        inputs = tokenizer.pad({"input_ids": ids}, return_tensors="pt")
+        expected = torch.softmax(baseline.logits(inputs).float() / temperatures[0], dim=-1)
+        actual = torch.softmax(candidate.logits(inputs).float() / temperatures[1], dim=-1)
+        matches += (expected.argmax(dim=-1) == actual.argmax(dim=-1)).sum().item()
+        max_prob_diff = max(max_prob_diff, (expected - actual).abs().max().item())
+
+    agreement = matches / len(texts)
+    print("backend: %s - examples: %d - label agreement: %.5f - max prob diff: %.5f" % (args.backend, len(texts), agreement, max_prob_diff))
+    if agreement < args.min_agreement or max_prob_diff > args.max_prob_diff:
+        raise SystemExit("Backend `%s` does not match the fp32 baseline within tolerance." % args.backend)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the classifier for CPU serving and check it against fp32.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("onnx", "int8"):
+        sub = subparsers.add_parser(name, help="Convert the checkpoint to the `%s` backend." % name)
+        sub.add_argument("--model-path", default="weights/garr-epoch-0")
+        sub.set_defaults(func=convert)
+
+    sub = subparsers.add_parser("tokenizer", help="Save the tokenizer next to the checkpoint so serving works offline.")
+    sub.add_argument("--model-path", default="weights/garr-epoch-0")
+    sub.add_argument("--tokenizer", default="gpt2")
+    sub.set_defaults(func=save_tokenizer)
+
+    sub = subparsers.add_parser("verify", help="Compare a backend with the fp32 baseline on held-out data.")
+    sub.add_argument("--backend", required=True, choices=["int8", "onnx"])
+    sub.add_argument("--model-path", default="weights/garr-epoch-0")
+    sub.add_argument("--tokenizer", default="gpt2", help="Tokenizer used when none is bundled with the checkpoint.")
+    sub.add_argument("--data", default="query_resul.parquet")
+    sub.add_argument("--limit", type=int, default=200)
+    sub.add_argument("--batch-size", type=int, default=8)
+    sub.add_argument("--min-agreement", type=float, default=0.98)
+    sub.add_argument("--max-prob-diff", type=float, default=0.05)
+    sub.set_defaults(func=verify)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,244 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+
+
+def last_token_indices(input_ids, pad_token_id):
+    # Position of the last token that is not padding in every row, the one
+    # `GPT2ForSequenceClassification` classifies from
+    non_pad_mask = (input_ids != pad_token_id).int()
+    token_indices = torch.arange(input_ids.shape[-1], device=input_ids.device, dtype=torch.int32)
+    return (token_indices * non_pad_mask).argmax(-1)
+
+
+def last_token_features(model, input_ids, attention_mask):
+    r"""
+    Hidden states `GPT2ForSequenceClassification` classifies from.
+
+    The backbone runs once and the hidden state of the last token that is
+    not padding is picked, the same way the model picks its logits, so
+    `model.score(features)` gives the model's logits.
+
+    Arguments:
+
+      model (:obj:`transformers.GPT2ForSequenceClassification`):
+          Classifier whose backbone, `model.transformer`, is run.
+
+    Returns:
+      :obj:`torch.Tensor`: Features of shape `[batch, n_embd]`.
+
+    """
+
+    hidden = model.transformer(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).last_hidden_state
+    return hidden[torch.arange(input_ids.shape[0], device=hidden.device), last_token_indices(input_ids, model.config.pad_token_id)]
+
+
+def cache_features(model, dataset, collator, model_path, batch_size=16):
+    r"""
+    Run the frozen backbone over a tokenized split once and keep its features on disk.
+
+    The features are written straight into a memory-mapped file in the token
+    cache directory of the split, named after the checkpoint and the
+    truncation, so a split larger than memory can be cached and later runs
+    with other heads, class weights or label sets skip the backbone.
+
+    Returns:
+      :obj:`np.ndarray`: fp32 features of shape `[examples, n_embd]`, memory-mapped.
+
+    """
+
+    from cache import checkpoint_fingerprint
+    from samplers import BucketBatchSampler, dataset_lengths
+
+    fingerprint = checkpoint_fingerprint(model_path) if os.path.isdir(model_path) else model_path.replace('/', '_')
+    path = os.path.join(os.path.dirname(dataset.offsets.filename),
+                        'features-%s-%d-%s.npy' % (fingerprint, collator.max_sequence_len, collator.strategy))
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+
+    tmp_path = path + '.tmp.npy'
+    features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(dataset), model.config.n_embd))
+    # Length-sorted batches waste the least compute on padding.
+    sampler = BucketBatchSampler(dataset_lengths(dataset, collator.max_sequence_len), batch_size=batch_size, shuffle=False)
+    model.eval()
+    with torch.no_grad():
+        for indices in sampler:
+            batch = collator([dataset[i] for i in indices])
+            features[indices] = last_token_features(model, batch['input_ids'], batch['attention_mask']).float().numpy()
+
+    features.flush()
+    del features
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+def make_head(n_embd, n_labels, hidden_size=0, dropout=0.1):
+    r"""
+    Classification head trained on the cached features.
+
+    With `hidden_size` 0 it is a linear layer without bias, shaped like
+    `GPT2ForSequenceClassification.score` so it can replace it; otherwise a
+    one hidden layer MLP.
+
+    """
+
+    if not hidden_size:
+        return torch.nn.Linear(n_embd, n_labels, bias=False)
+    return torch.nn.Sequential(torch.nn.Dropout(dropout),
+                               torch.nn.Linear(n_embd, hidden_size),
+                               torch.nn.GELU(),
+                               torch.nn.Dropout(dropout),
+                               torch.nn.Linear(hidden_size, n_labels))
+
+
+def evaluate_head(head, features, labels, batch_size=4096):
+    # Predicted labels, macro-F1 and accuracy of the head
+    from sklearn.metrics import accuracy_score, f1_score
+
+    head.eval()
+    with torch.no_grad():
+        predictions = np.concatenate([head(torch.from_numpy(np.asarray(features[start:start + batch_size]))).argmax(-1).numpy()
+                                      for start in range(0, len(features), batch_size)])
+    return predictions, {'macro_f1': f1_score(labels, predictions, average='macro'), 'accuracy': accuracy_score(labels, predictions)}
+
+
+def train_head(head, train_features, train_labels, valid_features, valid_labels, class_weights=None,
+               epochs=50, batch_size=256, lr=1e-3, weight_decay=0.01, seed=123):
+    r"""
+    Train a head on cached features, keeping the weights of its best epoch.
+
+    Arguments:
+
+      head (:obj:`torch.nn.Module`):
+          Head made by `make_head`, or one initialized from a checkpoint.
+
+      train_features (:obj:`np.ndarray`):
+          Features of shape `[examples, n_embd]`, e.g. from `cache_features`.
+
+      class_weights (:obj:`torch.Tensor`, `optional`):
+          Weights of the cross entropy, as in fine-tuning.
+
+    Returns:
+      :obj:`List[Dict[str, float]]`: Loss and validation scores of every epoch.
+
+    """
+
+    generator = torch.Generator().manual_seed(seed)
+    features = torch.from_numpy(np.asarray(train_features, dtype=np.float32))
+    labels = torch.as_tensor(np.asarray(train_labels), dtype=torch.long)
+    loss_fn = torch.nn.CrossEntropyLoss(weight=class_weights)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+
+    history = []
+    best_f1, best_state = -1.0, None
+    for epoch in range(epochs):
+        head.train()
+        total_loss = 0.0
+        for indices in torch.randperm(len(labels), generator=generator).split(batch_size):
+            optimizer.zero_grad()
+            loss = loss_fn(head(features[indices]), labels[indices])
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(indices)
+        _, scores = evaluate_head(head, valid_features, valid_labels)
+        history.append(dict(epoch=epoch + 1, loss=total_loss / len(labels), **scores))
+        if scores['macro_f1'] > best_f1:
+            best_f1, best_state = scores['macro_f1'], {k: v.clone() for k, v in head.state_dict().items()}
+
+    head.load_state_dict(best_state)
+    return history
+
+
+def load_backbone(model_path, n_labels):
+    # A fine-tuned checkpoint is memory-mapped; a hub name gets a new head
+    from transformers import GPT2ForSequenceClassification
+    from model_loader import load_mmap_model
+
+    if os.path.isdir(model_path):
+        model = load_mmap_model(model_path)
+    else:
+        model = GPT2ForSequenceClassification.from_pretrained(model_path, num_labels=n_labels)
+    model.config.pad_token_id = model.config.eos_token_id if model.config.pad_token_id is None else model.config.pad_token_id
+    return model.eval()
+
+
+def main(args):
+    from sklearn.utils.class_weight import compute_class_weight
+    from calibration import calibrate
+    from dataset_cache import bucket_dataloader, load_tokenized_splits
+    from tokenization import load_gpt2_tokenizer
+
+    torch.manual_seed(args.seed)
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    # Truncate the way the backbone was fine-tuned, unless told otherwise
+    splits = load_tokenized_splits(args.data, tokenizer, args.cache_dir, args.model_path, args.max_length, args.truncation, args.limit)
+    train_dataset, valid_dataset, collator, classes = splits['train'], splits['valid'], splits['collator'], splits['classes']
+
+    model = load_backbone(args.model_path, len(classes))
+    start = time.perf_counter()
+    train_features = cache_features(model, train_dataset, collator, args.model_path, args.batch_size)
+    valid_features = cache_features(model, valid_dataset, collator, args.model_path, args.batch_size)
+    print('Features of %d + %d examples ready in %.1fs' % (len(train_features), len(valid_features), time.perf_counter() - start))
+
+    class_weights = None
+    if args.class_weights == 'balanced':
+        class_weights = torch.tensor(compute_class_weight('balanced', classes=np.arange(len(classes)), y=np.asarray(train_dataset.labels)),
+                                     dtype=torch.float)
+
+    head = make_head(model.config.n_embd, len(classes), args.hidden_size, args.dropout)
+    if not args.hidden_size and not args.reinit and model.config.num_labels == len(classes):
+        # Start from the fine-tuned head
+        head.weight.data.copy_(model.score.weight.data)
+    start = time.perf_counter()
+    history = train_head(head, train_features, train_dataset.labels, valid_features, valid_dataset.labels, class_weights,
+                         epochs=args.epochs, batch_size=args.head_batch_size, lr=args.lr, seed=args.seed)
+    print('Trained the head in %.1fs' % (time.perf_counter() - start))
+    for row in history[::max(1, len(history) // 10)] + history[-1:]:
+        print("epoch %3d - loss: %.5f - val_macro_f1: %.5f - val_acc: %.5f" % (row['epoch'], row['loss'], row['macro_f1'], row['accuracy']))
+    _, scores = evaluate_head(head, valid_features, valid_dataset.labels)
+    print("best - val_macro_f1: %.5f - val_acc: %.5f" % (scores['macro_f1'], scores['accuracy']))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if not args.hidden_size:
+        # A linear head replaces the model's
+        model.score = head
+        model.config.num_labels = len(classes)
+        model.config.id2label = dict(enumerate(classes))
+        model.config.label2id = {label: i for i, label in enumerate(classes)}
+        model.config.token_budget = collator.max_sequence_len
+        model.config.truncation_strategy = collator.strategy
+        model.save_pretrained(args.output_dir)
+        tokenizer.save_pretrained(args.output_dir)
+        calibrate(model, bucket_dataloader(valid_dataset, collator, args.batch_size), torch.device('cpu'), args.output_dir, classes)
+    else:
+        torch.save(head.state_dict(), os.path.join(args.output_dir, 'head.pt'))
+    with open(os.path.join(args.output_dir, 'head_report.json'), 'w') as f:
+        json.dump({'scores': scores, 'history': history, 'labels': classes, 'settings': vars(args)}, f, indent=2)
+    print("Saved to %s" % args.output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache the frozen GPT-2 features of the dataset once and train only a classification head on them.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0", help="Fine-tuned checkpoint or hub name of the backbone.")
+    parser.add_argument("--output-dir", default="weights/head")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--max-length", type=int, default=None, help="Token budget, the checkpoint's by default.")
+    parser.add_argument("--truncation", default=None, help="Truncation strategy, the checkpoint's by default.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size of the backbone.")
+    parser.add_argument("--hidden-size", type=int, default=0, help="Hidden units of an MLP head, 0 for a linear head that replaces the model's.")
+    parser.add_argument("--dropout", type=float, default=0.1)
+    parser.add_argument("--reinit", action="store_true", help="Train the linear head from scratch instead of the checkpoint's.")
+    parser.add_argument("--class-weights", default="balanced", choices=["balanced", "none"])
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--head-batch-size", type=int, default=256)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N examples of each split.")
+    main(parser.parse_args())
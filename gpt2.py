@@ -53,9 +53,17 @@ from transformers import (set_seed,
                           AdamW,
                           get_linear_schedule_with_warmup,
                           GPT2ForSequenceClassification)
+from data import drop_duplicate_rows, split_frame
+from dataset_cache import build_token_cache, TokenizedDataset, TokenizedCollator
+from samplers import BucketBatchSampler, dataset_lengths, padding_ratio
+import training
+from checkpointing import Checkpointer
+from calibration import calibrate
+from tokenization import load_gpt2_tokenizer
 
 # Load the data from the parquet file
-data = pd.read_parquet("/content/drive/MyDrive/openai/query_resul.parquet")
+data_path = "/content/drive/MyDrive/openai/query_resul.parquet"
+data = pd.read_parquet(data_path)
 
 # Display the first few rows of the dataset
 # print(data.head())
@@ -73,32 +81,16 @@ print(data['news_list'].value_counts())
 duplicates = data.duplicated()
 num_duplicates = duplicates.sum()
 # print("Number of duplicates:", num_duplicates)
-data = data.drop_duplicates()
+data = drop_duplicate_rows(data)
 class_distribution = data['news_list'].value_counts()
 print(class_distribution)
 
-# Splitting dataset in test and train
-train_data, test_data = train_test_split(data, test_size=0.3, random_state=42, stratify=data['news_list'])
-
-# Drop the 'event_timestamp' column as it is not useful
-train_data = train_data.drop(columns=['event_timestamp'])
-test_data = test_data.drop(columns=['event_timestamp'])
-
-# Function to preprocess text
-def preprocess_text(text):
-    text = text.lower()  # Convert to lowercase
-    text = re.sub(r'[^\w\s]', '', text)  # Remove special characters
-    return text
-
-# Apply text preprocessing to 'title' and 'paragraph' on train_data
-train_data['title'] = train_data['title'].apply(preprocess_text)
-train_data['paragraph'] = train_data['paragraph'].apply(preprocess_text)
-train_data['news_list'] = train_data['news_list'].apply(preprocess_text)
-
-# Apply text preprocessing to 'title' and 'paragraph' on test_data
-test_data['title'] = test_data['title'].apply(preprocess_text)
-test_data['paragraph'] = test_data['paragraph'].apply(preprocess_text)
-test_data['news_list'] = test_data['news_list'].apply(preprocess_text)
+# Split stratified on 'news_list', drop the 'event_timestamp' column as it is
+# not useful, and lowercase and remove special characters from 'title',
+# 'paragraph' and 'news_list' a whole column at a time (see data.py).
+# Exports too big for memory are split with `python data.py <file> <dir>`
+# and loaded with `load_splits(<dir>)` instead.
+train_data, test_data = split_frame(data, test_size=0.3, random_state=42)
 
 """#**To balanced the dataset we use class weighting technique**
 Many classifiers allow you to assign higher weights to minority classes during training, which can help the model pay more attention to the underrepresented classes.
@@ -126,10 +118,32 @@ epochs = 4
 # For small sequence length can try batch of 32 or higher.
 batch_size = 2
 
+# Batches of similar token lengths waste less compute on padding.
+# Set `max_tokens` to fill batches up to a token budget instead of `batch_size`.
+max_tokens = None
+
+# Add up the gradients of several small batches before each optimizer step,
+# so optimizer steps see `effective_batch_size` examples while memory only
+# holds `batch_size` at a time. Equal to `batch_size` it is off, e.g. 16 for
+# steps of 8 batches of 2.
+effective_batch_size = batch_size
+gradient_accumulation_steps = max(1, effective_batch_size // batch_size)
+
+# Run forward passes under bfloat16 autocast (faster on CPUs with bf16 support).
+use_bf16 = False
+
+# Recompute GPT2 block activations in the backward pass to save memory.
+gradient_checkpointing = False
+
 # Pad or truncate text sequences to a specific length
 # if `None` it will use maximum sequence of word piece tokens allowed by model.
 max_length = None
 
+# Which tokens of a longer text are kept: `head`, `tail`, `head+tail` or
+# `title+lead` (see truncation.py). Saved in the model config so the server
+# truncates the same way.
+truncation_strategy = 'head'
+
 # Look for gpu to use. Will use `cpu` by default if no gpu found.
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
@@ -148,6 +162,15 @@ print(n_labels)
 
 output_dir = "/content/drive/MyDrive/openai"
 
+# Checkpoints are written here in the background, only the last few are kept.
+# `checkpoint_every` also saves every that many optimizer steps within an epoch.
+checkpoint_dir = os.path.join(output_dir, "checkpoints")
+keep_checkpoints = 3
+checkpoint_every = 500
+
+# Tokenized datasets are cached here so later runs skip tokenization.
+token_cache_dir = os.path.join(output_dir, "token_cache")
+
 # Preprocess the training data
 train_data['text'] = train_data['title'] + ' ' + train_data['paragraph']
 # train_texts = list(train_data['text'])
@@ -351,7 +374,7 @@ class Gpt2ClassificationCollator(object):
         return inputs
 
 
-def train(dataloader, optimizer_, scheduler_, device_):
+def train(dataloader, optimizer_, scheduler_, device_, start_batch=0, on_update=None):
   r"""
   Train pytorch model on a single pass through the data loader.
 
@@ -376,6 +399,12 @@ def train(dataloader, optimizer_, scheduler_, device_):
       device_ (:obj:`torch.device`):
           Device used to load tensors before feeding to model.
 
+      start_batch (:obj:`int`):
+          Batches to skip when resuming an epoch from a checkpoint.
+
+      on_update (:obj:`callable`, `optional`):
+          Called after every optimizer step, used for step-based checkpoints.
+
   Returns:
 
       :obj:`List[List[int], List[int], float]`: List of [True Labels, Predicted
@@ -385,74 +414,13 @@ def train(dataloader, optimizer_, scheduler_, device_):
   # Use global variable for model.
   global model
 
-  # Tracking variables.
-  predictions_labels = []
-  true_labels = []
-  # Total loss for this epoch.
-  total_loss = 0
   # Define the loss function with class weights.
   loss_fn = torch.nn.CrossEntropyLoss(weight=class_weights) #me
 
-  # Put the model into training mode.
-  model.train()
-
-  # For each batch of training data...
-  for batch in tqdm(dataloader, total=len(dataloader)):
-
-    # Add original labels - use later for evaluation.
-    true_labels += batch['labels'].numpy().flatten().tolist()
-
-    # move batch to device
-    batch = {k:v.type(torch.long).to(device_) for k,v in batch.items()}
-
-    # Always clear any previously calculated gradients before performing a
-    # backward pass.
-    model.zero_grad()
-
-    # Perform a forward pass (evaluate the model on this training batch).
-    # This will return the loss (rather than the model output) because we
-    # have provided the `labels`.
-    outputs = model(**batch)
-
-    # The call to `model` always returns a tuple, so we need to pull the
-    # loss value out of the tuple along with the logits. We will use logits
-    # later to calculate training accuracy.
-    loss, logits = outputs[:2]
-    loss = loss_fn(logits, batch['labels']) #me
-
-    # Accumulate the training loss over all of the batches so that we can
-    # calculate the average loss at the end. `loss` is a Tensor containing a
-    # single value; the `.item()` function just returns the Python value
-    # from the tensor.
-    total_loss += loss.item()
-
-    # Perform a backward pass to calculate the gradients.
-    loss.backward()
-
-    # Clip the norm of the gradients to 1.0.
-    # This is to help prevent the "exploding gradients" problem.
-    torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-
-    # Update parameters and take a step using the computed gradient.
-    # The optimizer dictates the "update rule"--how the parameters are
-    # modified based on their gradients, the learning rate, etc.
-    optimizer_.step()
-
-    # Update the learning rate.
-    scheduler_.step()
-
-    # Move logits and labels to CPU
-    logits = logits.detach().cpu().numpy()
-
-    # Convert these logits to list of predicted labels values.
-    predictions_labels += logits.argmax(axis=-1).flatten().tolist()
-
-  # Calculate the average loss over the training data.
-  avg_epoch_loss = total_loss / len(dataloader)
-
-  # Return all true labels and prediction for future evaluations.
-  return true_labels, predictions_labels, avg_epoch_loss
-
+  # The training loop itself lives in `training.py` so scripts can reuse it.
+  return training.train(model, dataloader, optimizer_, scheduler_, device_, loss_fn,
+                        accumulation_steps=gradient_accumulation_steps, bf16=use_bf16,
+                        start_batch=start_batch, on_update=on_update)
 
 
 def validation(dataloader, device_):
@@ -483,61 +451,8 @@ def validation(dataloader, device_):
   # Use global variable for model.
   global model
 
-  # Tracking variables
-  predictions_labels = []
-  true_labels = []
-  #total loss for this epoch.
-  total_loss = 0
-
-  # Put the model in evaluation mode--the dropout layers behave differently
-  # during evaluation.
-  model.eval()
-
-  # Evaluate data for one epoch
-  for batch in tqdm(dataloader, total=len(dataloader)):
-
-    # add original labels
-    true_labels += batch['labels'].numpy().flatten().tolist()
-
-    # move batch to device
-    batch = {k:v.type(torch.long).to(device_) for k,v in batch.items()}
-
-    # Telling the model not to compute or store gradients, saving memory and
-    # speeding up validation
-    with torch.no_grad():
-
-        # Forward pass, calculate logit predictions.
-        # This will return the logits rather than the loss because we have
-        # not provided labels.
-        # token_type_ids is the same as the "segment ids", which
-        # differentiates sentence 1 and 2 in 2-sentence tasks.
-        outputs = model(**batch)
-
-        # The call to `model` always returns a tuple, so we need to pull the
-        # loss value out of the tuple along with the logits. We will use logits
-        # later to to calculate training accuracy.
-        loss, logits = outputs[:2]
-
-        # Move logits and labels to CPU
-        logits = logits.detach().cpu().numpy()
-
-        # Accumulate the training loss over all of the batches so that we can
-        # calculate the average loss at the end. `loss` is a Tensor containing a
-        # single value; the `.item()` function just returns the Python value
-        # from the tensor.
-        total_loss += loss.item()
-
-        # get predicitons to list
-        predict_content = logits.argmax(axis=-1).flatten().tolist()
-
-        # update list
-        predictions_labels += predict_content
-
-  # Calculate the average loss over the training data.
-  avg_epoch_loss = total_loss / len(dataloader)
-
-  # Return all true labels and prediciton for future evaluations.
-  return true_labels, predictions_labels, avg_epoch_loss
+  # The validation loop itself lives in `training.py` so scripts can reuse it.
+  return training.validation(model, dataloader, device_, bf16=use_bf16)
 
 """## **Load Model and Tokenizer**
 
@@ -563,11 +478,8 @@ print(model_config)
 
 # Get model's tokenizer.
 print('Loading tokenizer...')
-tokenizer = GPT2Tokenizer.from_pretrained(pretrained_model_name_or_path=model_name_or_path)
-# default to left padding
-tokenizer.padding_side = "left"
-# Define PAD Token = EOS Token = 50256
-tokenizer.pad_token = tokenizer.eos_token
+# The Rust-backed tokenizer, left padding and PAD Token = EOS Token = 50256.
+tokenizer = load_gpt2_tokenizer(model_name_or_path)
 
 
 # Get the actual model.
@@ -581,6 +493,14 @@ model.resize_token_embeddings(len(tokenizer))
 # fix model padding token id
 model.config.pad_token_id = model.config.eos_token_id
 
+# keep the token budget with the weights
+model.config.token_budget = tokenizer.model_max_length if max_length is None else max_length
+model.config.truncation_strategy = truncation_strategy
+
+# Trade compute for memory if asked to.
+if gradient_checkpointing:
+  training.enable_gradient_checkpointing(model)
+
 # Load model to defined device.
 model.to(device)
 print('Model loaded to `%s`'%device)
@@ -594,43 +514,62 @@ This is where I use the **ReviewDataset** class to create the PyTorch Dataset th
 Since we need to input numbers to our model we need to convert the texts and labels to numbers. This is the purpose of a collator! It takes data outputted by the PyTorch Dataset and passed through the Data Collator function to output the sequence for our model.
 
 The data collator is used to format the PyTorch Dataset outputs to match the inputs needed for GPT2.
+
+Tokenizing is done only once: **build_token_cache** writes the token ids and encoded labels of each split to memory-mapped files keyed by the tokenizer and the source file, and **TokenizedDataset** reads them back without copying. Every epoch, and every later run on the same data, skips tokenization. **TokenizedCollator** only truncates and left-pads the cached ids.
 """
 
-# Create data collator to encode text and labels into numbers.
-gpt2_classificaiton_collator = Gpt2ClassificationCollator(use_tokenizer=tokenizer,
-                                                          labels_encoder=labels_ids,
-                                                          max_sequence_len=max_length)
+# Create data collator to pad cached token ids into batches.
+gpt2_classificaiton_collator = TokenizedCollator(pad_token_id=tokenizer.pad_token_id,
+                                                 max_sequence_len=tokenizer.model_max_length if max_length is None else max_length,
+                                                 strategy=truncation_strategy)
 
 
 print('Dealing with Train...')
-# Create pytorch dataset.
-train_dataset = ReviewDataset(train_data,
-                               use_tokenizer=tokenizer)
+# Tokenize once into the cache and create pytorch dataset from it.
+train_cache = build_token_cache(train_data, tokenizer, token_cache_dir, source_path=data_path, split='train')
+train_dataset = TokenizedDataset(train_cache)
 print('Created `train_dataset` with %d examples!'%len(train_dataset))
 # Compute the class weights.
 class_weights = compute_class_weight('balanced', classes=class_names, y=true_labels)
 class_weights = torch.tensor(class_weights, dtype=torch.float).to(device)
 
+# Group examples of similar length into batches, reshuffled every epoch.
+train_lengths = dataset_lengths(train_dataset, gpt2_classificaiton_collator.max_sequence_len)
+train_sampler = BucketBatchSampler(train_lengths, batch_size=batch_size, max_tokens=max_tokens, shuffle=True, seed=123)
+
 # Move pytorch dataset into dataloader.
-train_dataloader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, collate_fn=gpt2_classificaiton_collator)
+train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=gpt2_classificaiton_collator)
 print('Created `train_dataloader` with %d batches!'%len(train_dataloader))
 
+# Compare padding against plain shuffled batches of the same size.
+shuffled = torch.randperm(len(train_dataset)).tolist()
+plain_batches = [shuffled[i:i + batch_size] for i in range(0, len(shuffled), batch_size)]
+print('Train padding ratio: %.3f shuffled -> %.3f bucketed'%(padding_ratio(plain_batches, train_lengths), padding_ratio(train_sampler, train_lengths)))
+
 print()
 
 print('Dealing with Validation...')
-# Create pytorch dataset.
-valid_dataset =  ReviewDataset(test_data,
-                               use_tokenizer=tokenizer)
+# Tokenize once into the cache and create pytorch dataset from it.
+valid_cache = build_token_cache(test_data, tokenizer, token_cache_dir, source_path=data_path, split='valid',
+                                classes=train_dataset.classes)
+valid_dataset = TokenizedDataset(valid_cache)
 print('Created `valid_dataset` with %d examples!'%len(valid_dataset))
 
+# Validation batches are simply sorted by length.
+valid_lengths = dataset_lengths(valid_dataset, gpt2_classificaiton_collator.max_sequence_len)
+valid_sampler = BucketBatchSampler(valid_lengths, batch_size=batch_size, max_tokens=max_tokens, shuffle=False)
+
 # Move pytorch dataset into dataloader.
-valid_dataloader = DataLoader(valid_dataset, batch_size=batch_size, shuffle=False, collate_fn=gpt2_classificaiton_collator)
+valid_dataloader = DataLoader(valid_dataset, batch_sampler=valid_sampler, collate_fn=gpt2_classificaiton_collator)
 print('Created `eval_dataloader` with %d batches!'%len(valid_dataloader))
 
+sequential_batches = [list(range(i, min(i + batch_size, len(valid_dataset)))) for i in range(0, len(valid_dataset), batch_size)]
+print('Validation padding ratio: %.3f sequential -> %.3f bucketed'%(padding_ratio(sequential_batches, valid_lengths), padding_ratio(valid_sampler, valid_lengths)))
+
 # Printing dataset to check whether data is correctly loaded or not
 for index in range(len(valid_dataset)):
     example = train_dataset[index]
-    text = example['text']
+    text = tokenizer.decode(example['input_ids'])
     label = example['label']
     print(f"Example {index + 1}: Text: {text}\nLabel: {label}\n")
 
@@ -654,10 +593,11 @@ optimizer = AdamW(model.parameters(),
                   eps = 1e-8 # default is 1e-8.
                   )
 
-# Total number of training steps is number of batches * number of epochs.
+# Total number of training steps is number of optimizer steps * number of epochs.
 # `train_dataloader` contains batched data so `len(train_dataloader)` gives
-# us the number of batches.
-total_steps = len(train_dataloader) * epochs
+# us the number of batches, and there is one optimizer step for every
+# `gradient_accumulation_steps` batches.
+total_steps = -(-len(train_dataloader) // gradient_accumulation_steps) * epochs
 
 # Create the learning rate scheduler.
 scheduler = get_linear_schedule_with_warmup(optimizer,
@@ -668,13 +608,31 @@ scheduler = get_linear_schedule_with_warmup(optimizer,
 all_loss = {'train_loss':[], 'val_loss':[]}
 all_acc = {'train_acc':[], 'val_acc':[]}
 
+# Resume from the last checkpoint if a previous run was interrupted.
+checkpointer = Checkpointer(checkpoint_dir, keep_last=keep_checkpoints)
+start_epoch, start_batch = 0, 0
+if checkpointer.latest() is not None:
+  _, position = checkpointer.restore(checkpointer.latest(), model, optimizer, scheduler)
+  start_epoch, start_batch = position['epoch'], position['batch']
+  print('Resuming from %s at epoch %d, batch %d'%(checkpointer.latest(), start_epoch + 1, start_batch))
+
 # Loop through each epoch.
 print('Epoch')
-for epoch in tqdm(range(epochs)):
+for epoch in tqdm(range(start_epoch, epochs)):
   print()
+  # New length buckets and batch order for this epoch.
+  train_sampler.set_epoch(epoch)
+
+  # Save a mid-epoch checkpoint every `checkpoint_every` optimizer steps.
+  def save_step_checkpoint(batches_done):
+    if scheduler.last_epoch % checkpoint_every == 0:
+      checkpointer.save(scheduler.last_epoch, model, optimizer, scheduler, {'epoch': epoch, 'batch': batches_done})
+
   print('Training on batches...')
   # Perform one full pass over the training set.
-  train_labels, train_predict, train_loss = train(train_dataloader, optimizer, scheduler, device)
+  train_labels, train_predict, train_loss = train(train_dataloader, optimizer, scheduler, device,
+                                                  start_batch=start_batch if epoch == start_epoch else 0,
+                                                  on_update=save_step_checkpoint)
   train_acc = accuracy_score(train_labels, train_predict)
 
   # Get prediction form model on validation data.
@@ -691,8 +649,16 @@ for epoch in tqdm(range(epochs)):
   all_loss['val_loss'].append(val_loss)
   all_acc['train_acc'].append(train_acc)
   all_acc['val_acc'].append(val_acc)
-  model_checkpoint = os.path.join(output_dir, f"epoch_{epoch+1}.pt")
-  torch.save(model.state_dict(), model_checkpoint)
+
+  # Checkpoint the end of the epoch without waiting for the write.
+  checkpointer.save(scheduler.last_epoch, model, optimizer, scheduler, {'epoch': epoch + 1, 'batch': 0})
+
+# Make sure the last checkpoint is on disk.
+checkpointer.close()
+
+# Fit temperature scaling on the validation set so the served probabilities
+# match how often the model is right, and save it with the last checkpoint.
+calibrate(model, valid_dataloader, device, checkpointer.latest(), train_dataset.classes)
 
 # Plot loss curves.
 plot_dict(all_loss, use_xlabel='Epochs', use_ylabel='Value', use_linestyles=['-', '--'])
@@ -736,8 +702,7 @@ for file in files:
 # Loading the saved weights
 model_path = "/content/drive/MyDrive/openai/weights/garr-epoch-0"
 model = GPT2ForSequenceClassification.from_pretrained(model_path)
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-tokenizer.pad_token = tokenizer.eos_token
+tokenizer = load_gpt2_tokenizer("gpt2")
 
 # Assuming `new_data` is a DataFrame containing the new text data.
 new_texts = "5 more suspected omicron cases in tn among the five is a woman passenger who flew from the republic of congo in africa the other four are the relatives of the person who has already tested positive"
@@ -1,50 +1,578 @@
 # Import necessary libraries
-from fastapi import FastAPI
-import torch
-from transformers import GPT2Tokenizer, GPT2ForSequenceClassification
-
-# Create FastAPI app
-app = FastAPI()
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from contextlib import asynccontextmanager, nullcontext
+import uvicorn
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from batching import MicroBatcher
+from cache import PredictionCache
+from executor import BoundedExecutor, Overloaded
+from metrics import LATENCY_BUCKETS, Counter, Histogram, SamplingProfiler, process_memory_mb, render_prometheus
+from registry import ModelRegistry, ServedModel, ShadowScorer
+from streaming import BodyStreamingResponse, iter_chunks, iter_texts
+from truncation import STRATEGIES, TitledText, encode, normalize_item
 
 # Define the path to the saved model directory
-model_path = "weights/garr-epoch-0"
+model_path = os.environ.get("MODEL_PATH", "weights/garr-epoch-0")
+
+# Model registry settings: checkpoints kept in memory for quick swaps, and the
+# directory `/models` may load checkpoints from
+max_resident_models = int(os.environ.get("MAX_RESIDENT_MODELS", "2"))
+model_root = os.environ.get("MODEL_ROOT", os.path.dirname(os.path.abspath(model_path)))
+
+# Shadow scoring: a candidate checkpoint scoring this share of the texts the
+# active model runs, off the latency path, to compare their labels
+shadow_model_path = os.environ.get("SHADOW_MODEL_PATH")
+shadow_fraction = float(os.environ.get("SHADOW_FRACTION", "0.1"))
+
+# Micro-batching settings: largest batch and how long to wait to fill it
+max_batch_size = int(os.environ.get("MAX_BATCH_SIZE", "8"))
+max_wait_ms = float(os.environ.get("MAX_WAIT_MS", "5"))
+max_queue_size = int(os.environ.get("MAX_QUEUE_SIZE", "256"))
+
+# Inference pool settings: parallel forward passes and torch threads for each
+inference_workers = int(os.environ.get("INFERENCE_WORKERS", "1"))
+inference_threads = os.environ.get("INFERENCE_THREADS")
+
+# Number of texts tokenized and run together by /predict_batch
+batch_chunk_size = int(os.environ.get("BATCH_CHUNK_SIZE", "32"))
+
+# Inference backend: `eager` (fp32 PyTorch), `int8` (dynamic quantization) or `onnx`
+model_backend = os.environ.get("MODEL_BACKEND", "eager")
+
+# Prediction cache settings: number of entries (0 disables) and optional expiry
+cache_size = int(os.environ.get("CACHE_SIZE", "10000"))
+cache_ttl = float(os.environ.get("CACHE_TTL_S", "0")) or None
+
+# Cascade settings: answer confident texts with the linear model saved by
+# `cascade.py` and run GPT-2 on the rest; the threshold defaults to the saved one
+use_cascade = os.environ.get("CASCADE", "0") == "1"
+cascade_threshold = os.environ.get("CASCADE_THRESHOLD")
+
+# Number of texts whose token ids are kept in an LRU cache (0 disables)
+token_cache_size = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+
+# Token budget and truncation strategy (`head`, `tail`, `head+tail` or
+# `title+lead`); both default to what the checkpoint was trained with
+token_budget = os.environ.get("TOKEN_BUDGET")
+truncation_strategy = os.environ.get("TRUNCATION")
+if truncation_strategy and truncation_strategy not in STRATEGIES:
+    raise ValueError("TRUNCATION must be one of %s." % ", ".join(STRATEGIES))
+
+# Profiler settings: trace one out of every N requests (0 disables) into this directory
+profile_every_n = int(os.environ.get("PROFILE_EVERY_N", "0"))
+profile_dir = os.environ.get("PROFILE_DIR", "profiles")
+
+# The model is loaded on startup by `load_model` and `model_ready` turns
+# true once a warm-up forward pass has run
+model_ready = False
+model_error = None
+
+
+def load_checkpoint(path):
+    # Import here so the server starts listening while torch and transformers load
+    from backends import load_backend
+    from calibration import load_calibration
+    from model_loader import load_tokenizer
+    from tokenization import TokenCache
+    from truncation import load_truncation
+
+    # Load the fine-tuned GPT-2 model (memory-mapped) and the fast tokenizer bundled with it
+    tokenizer = load_tokenizer(path)
+    backend = load_backend(model_backend, path)
+    calibration = load_calibration(path, backend)
+    truncation = load_truncation(path, tokenizer.model_max_length)
+
+    cascade = None
+    if use_cascade:
+        from cascade import LinearCascade
+        cascade = LinearCascade.load(path, float(cascade_threshold) if cascade_threshold else None)
+
+    return ServedModel(path, backend, tokenizer,
+                       TokenCache(tokenizer, max_entries=token_cache_size),
+                       temperature=calibration["temperature"],
+                       label_names=calibration["labels"],
+                       token_budget=int(token_budget) if token_budget else truncation["budget"],
+                       truncation_strategy=truncation_strategy or truncation["strategy"],
+                       cascade=cascade)
+
+
+def warm_up_model(model):
+    # Run one forward pass so the first request does not pay for lazy initialization
+    run_model(model, ["warm-up"], record=False)
+
+
+def load_weights():
+    # `serve.py` loads the weights before forking the workers, which warm up;
+    # the weights are loaded again if MODEL_PATH changed since
+    return registry.activate(model_path, warm_up=False)
+
+
+def load_model():
+    warm_up_model(load_weights())
+    if shadow_model_path:
+        registry.set_candidate(shadow_model_path)
+
+
+# Time spent in each stage of the inference path, and the tokens it handled
+STAGES = ("cascade", "tokenize", "transfer", "forward", "probabilities", "serialize")
+stage_seconds = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+request_seconds = {endpoint: Histogram(LATENCY_BUCKETS) for endpoint in ("predict", "predict_batch", "embed")}
+tokens_per_text = Histogram([8, 16, 32, 64, 128, 256, 512, 1024])
+padded_tokens_per_batch = Histogram([64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768])
+texts_classified = Counter()
+texts_embedded = Counter()
+answered_by = {stage: Counter() for stage in ("linear", "gpt2")}
+
+# Trace a sample of the batches to find where tail latency comes from
+profiler = SamplingProfiler(every=profile_every_n, output_dir=profile_dir)
+
+
+def classify_requests(requests):
+    # Batches of the micro-batcher hold `(model, text)` requests, so each
+    # text is answered by the model active when it arrived, even across a swap
+    predictions = [None] * len(requests)
+    for model in {id(model): model for model, _ in requests}.values():
+        indices = [i for i, (request_model, _) in enumerate(requests) if request_model is model]
+        for i, prediction in zip(indices, classify_batch([requests[i][1] for i in indices], model)):
+            predictions[i] = prediction
+    return predictions
+
+
+def classify_batch(texts, model, record=True):
+    predictions = classify_texts(texts, model, record)
+    if record:
+        # Compare with the candidate on a sample of the texts
+        shadow.submit(model, registry.candidate, texts, predictions)
+    return predictions
+
+
+def classify_texts(texts, model, record=True):
+    if model.cascade is None:
+        return run_model(model, texts, record)
+
+    # The linear model ranks the whole batch, its confident answers are kept
+    start = time.perf_counter()
+    label_ids, probabilities = model.cascade.rank(texts)
+    predictions = [(ids.tolist(), probs.tolist()) if probs[0] >= model.cascade.threshold else None
+                   for ids, probs in zip(label_ids, probabilities)]
+
+    # GPT-2 only runs on the texts the linear model is unsure about
+    remaining = [i for i, prediction in enumerate(predictions) if prediction is None]
+    if record:
+        stage_seconds["cascade"].observe(time.perf_counter() - start)
+        answered_by["linear"].inc(len(texts) - len(remaining))
+        answered_by["gpt2"].inc(len(remaining))
+    if remaining:
+        for i, prediction in zip(remaining, run_model(model, [texts[i] for i in remaining], record)):
+            predictions[i] = prediction
+    return predictions
+
+
+def run_model(model, texts, record=True):
+    # With `record` false, e.g. for the warm-up and shadow passes, the
+    # metrics and profiler only see the traffic that is answered
+    with profiler.profile(len(texts)) if record else nullcontext():
+        start = time.perf_counter()
+
+        # Fit every text into the token budget the way training did, then
+        # left-pad the batch to its longest text
+        ids = encode(model.tokenizer, texts, model.token_budget, model.truncation_strategy, cache=model.token_cache)
+        inputs = model.tokenizer.pad({"input_ids": ids}, return_tensors="pt")
+        tokenized = time.perf_counter()
+
+        # Move the inputs to where the backend runs
+        prepared = model.backend.prepare(inputs)
+        transferred = time.perf_counter()
+
+        # Run a single forward pass for the whole batch on the selected backend
+        logits = model.backend.run(prepared)
+        forwarded = time.perf_counter()
+
+        # Calibrated probabilities for the whole batch at once, each row sorted
+        # from the most to the least likely label, so the first one is the argmax
+        probabilities = (logits.float() / model.temperature).softmax(dim=-1)
+        probabilities, label_ids = probabilities.sort(dim=-1, descending=True, stable=True)
+        predictions = list(zip(label_ids.tolist(), probabilities.tolist()))
+        done = time.perf_counter()
+
+    if not record:
+        return predictions
+    stage_seconds["tokenize"].observe(tokenized - start)
+    stage_seconds["transfer"].observe(transferred - tokenized)
+    stage_seconds["forward"].observe(forwarded - transferred)
+    stage_seconds["probabilities"].observe(done - forwarded)
+    for n_tokens in inputs["attention_mask"].sum(dim=1).tolist():
+        tokens_per_text.observe(n_tokens)
+    padded_tokens_per_batch.observe(inputs["input_ids"].numel())
+    texts_classified.inc(len(texts))
+    return predictions
+
+
+def embed_texts(texts, model):
+    # Last-token hidden states of the backbone, the features the head
+    # classifies from, truncated the same way as for classification
+    ids = encode(model.tokenizer, texts, model.token_budget, model.truncation_strategy, cache=model.token_cache)
+    features = model.backend.features(model.tokenizer.pad({"input_ids": ids}, return_tensors="pt"))
+    texts_embedded.inc(len(texts))
+    return [[round(value, 6) for value in row] for row in features.tolist()]
+
+
+def format_prediction(prediction, model, top_k=0):
+    # Response of one text: the predicted label id, and the `top_k` most likely
+    # labels with their names and calibrated probabilities when asked for
+    label_ids, probabilities = prediction
+    response = {"predicted_label": label_ids[0]}
+    if top_k:
+        response["top_k"] = [{"label": model.label(label_id),
+                              "label_id": label_id,
+                              "probability": round(probability, 6)}
+                             for label_id, probability in zip(label_ids[:top_k], probabilities[:top_k])]
+    return response
 
-# Load the fine-tuned GPT-2 model and tokenizer from the saved directory
-model = GPT2ForSequenceClassification.from_pretrained(model_path)
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
 
-# Set the padding token to be the EOS token
-tokenizer.pad_token = tokenizer.eos_token
+def failed_chunk_lines(index, count, error):
+    # NDJSON error lines for the `count` texts of a chunk, starting at `index`,
+    # whose inference failed after the streamed response had started
+    logging.exception("Inference on texts %d to %d failed.", index, index + count - 1)
+    line = {"error": "Inference failed: %r" % error}
+    return "".join(json.dumps(dict(index=i, **line)) + "\n" for i in range(index, index + count))
 
-# Check if CUDA (GPU) is available, otherwise use CPU
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Move the model to the appropriate device (GPU or CPU)
-model.to(device)
+# Run inference on a bounded pool so the event loop is never blocked
+executor = BoundedExecutor(max_workers=inference_workers,
+                           threads_per_worker=int(inference_threads) if inference_threads else None)
+
+# Checkpoints in memory, and the candidate scored in the shadow
+registry = ModelRegistry(load_checkpoint, warm_up_model, max_resident=max_resident_models)
+shadow = ShadowScorer(lambda model, texts: classify_texts(texts, model, record=False), fraction=shadow_fraction)
+
+# Gather concurrent requests into batches run by a background task
+batcher = MicroBatcher(classify_requests, executor,
+                       max_batch_size=max_batch_size,
+                       max_wait_ms=max_wait_ms,
+                       max_queue_size=max_queue_size)
+
+
+# Reuse predictions for repeated texts from the same checkpoint; entries of
+# every resident checkpoint are kept apart by `item_key`, which keys them with
+# the fingerprint of the loaded model, so nothing here reads MODEL_PATH before
+# the model loads and a missing checkpoint is reported by /ready
+cache = PredictionCache("unloaded:" + model_backend, max_entries=cache_size, ttl=cache_ttl)
+
+
+async def read_chunks(request):
+    r"""
+    Normalized texts of a streamed request body, in chunks of `batch_chunk_size`.
+
+    The first chunk is read before the response starts, so a body whose
+    first item is malformed or empty is answered with a 422. Later errors
+    are raised while streaming and reported in-band.
+
+    """
+
+    async def items():
+        async for text in iter_texts(request.stream()):
+            yield normalize_item(text)
+
+    chunks = iter_chunks(items(), batch_chunk_size)
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+
+    async def all_chunks():
+        if first is None:
+            return
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return all_chunks()
+
+
+def item_key(text, model):
+    # A titled text never shares an entry with the same words sent untitled,
+    # and a swap back to a checkpoint finds its predictions still cached
+    checkpoint_id = model.fingerprint + ":" + model_backend
+    if isinstance(text, TitledText):
+        return cache.key(text.heading + "\0" + text.paragraph, checkpoint_id)
+    return cache.key(text, checkpoint_id)
+
+
+async def warm_up():
+    global model_ready, model_error
+    # Load on an inference worker so its torch thread settings apply
+    try:
+        await executor.run(load_model, block=True)
+    except Exception as error:
+        # Stay not ready, so the orchestrator restarts the container
+        logging.exception("Loading the model from %s failed.", model_path)
+        model_error = repr(error)
+        return
+    model_ready = True
+
+
+def require_model():
+    # Answer 503 until the warm-up pass is done, then the model to answer with
+    if not model_ready:
+        raise HTTPException(status_code=503, detail=model_error or "The model is still loading.")
+    return registry.active
+
+
+def checkpoint_path(path):
+    # Only checkpoint directories under `model_root` can be loaded
+    root = os.path.realpath(model_root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(os.path.join(resolved, "config.json")):
+        raise HTTPException(status_code=404, detail="No checkpoint %s under the model root." % path)
+    return resolved
+
+
+async def swap_model(fn, path):
+    # Load a checkpoint in the background while the active model keeps serving
+    try:
+        return await registry.run(fn, path)
+    except Exception as error:
+        logging.exception("Loading the model from %s failed.", path)
+        raise HTTPException(status_code=500, detail="Loading %s failed: %r" % (path, error))
+
+
+async def reload_model():
+    # SIGHUP reloads MODEL_PATH, e.g. after repointing a symlink to a new epoch
+    try:
+        await registry.run(registry.activate, model_path)
+    except Exception:
+        logging.exception("Reloading the model from %s failed.", model_path)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start the batcher with the server and stop it on shutdown
+    await batcher.start()
+    # Load the model in the background, /ready tells when it is done
+    loading = asyncio.create_task(warm_up())
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: model_ready and asyncio.ensure_future(reload_model()))
+    except (NotImplementedError, RuntimeError, AttributeError):
+        # Not on the main thread, or no SIGHUP on this platform
+        pass
+    yield
+    await loading
+    await batcher.stop()
+    executor.shutdown()
+    shadow.shutdown()
+
+
+# Create FastAPI app
+app = FastAPI(lifespan=lifespan)
 
 # Define the /predict endpoint for text classification
 @app.get("/predict")
-async def predict(text: str):
-    # Tokenize the input text and convert it into a PyTorch tensor
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-
-    # Move the tensor to the appropriate device (GPU or CPU)
-    inputs = inputs.to(device)
+async def predict(text: str, title: str = "", top_k: int = Query(0, ge=0)):
+    model = require_model()
+    start = time.perf_counter()
 
-    # Disable gradient computation during prediction
-    with torch.no_grad():
-        # Use the model to make predictions on the input text
-        outputs = model(**inputs)
-    
-    # Extract the predicted label from the model's output
-    predicted_labels = torch.argmax(outputs.logits, dim=-1)
+    # With a title, `text` is the paragraph it belongs to
+    try:
+        text = normalize_item(TitledText(title, text) if title else text)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
 
-    # Convert the predicted label from a tensor to an integer
-    predicted_label = predicted_labels.item()
+    # Wait for the batch holding this text to be run, unless it is cached
+    try:
+        prediction = await cache.get_or_compute(item_key(text, model), lambda: batcher.submit((model, text)))
+    except Overloaded as error:
+        # Shed load instead of piling up latency
+        raise HTTPException(status_code=503, detail=str(error))
 
     # Return the predicted label as a JSON response
-    return {"predicted_label": predicted_label}
+    serialize_start = time.perf_counter()
+    response = JSONResponse(format_prediction(prediction, model, top_k))
+    done = time.perf_counter()
+    stage_seconds["serialize"].observe(done - serialize_start)
+    request_seconds["predict"].observe(done - start)
+    return response
+
+# Define the /predict_batch endpoint for classifying many texts at once
+@app.post("/predict_batch")
+async def predict_batch(request: Request, top_k: int = Query(0, ge=0)):
+    # The whole stream is answered by the model active when it started
+    model = require_model()
+
+    # Refuse new bulk work while every inference worker is busy
+    if executor.full():
+        raise HTTPException(status_code=503, detail="All inference workers are busy.")
+
+    # Parse the body as it arrives and run it in fixed-size chunks
+    chunks = await read_chunks(request)
+
+    async def results():
+        index = 0
+        start = time.perf_counter()
+        try:
+            async for chunk in chunks:
+                keys = [item_key(text, model) for text in chunk]
+                predictions = [cache.lookup(key) for key in keys]
+                # Only run the texts that are not cached yet
+                missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+                if missing:
+                    # Once streaming, wait for a worker rather than failing halfway
+                    try:
+                        computed = await executor.run(classify_batch, [chunk[i] for i in missing], model, block=True)
+                    except Exception as error:
+                        # Answer every text of the failed chunk with an error and go on with the next one
+                        yield failed_chunk_lines(index, len(chunk), error)
+                        index += len(chunk)
+                        continue
+                    for i, prediction in zip(missing, computed):
+                        cache.put(keys[i], prediction)
+                        predictions[i] = prediction
+                # Stream one NDJSON line per input as soon as its chunk is done
+                serialize_start = time.perf_counter()
+                lines = []
+                for prediction in predictions:
+                    lines.append(json.dumps(dict(index=index, **format_prediction(prediction, model, top_k))) + "\n")
+                    index += 1
+                stage_seconds["serialize"].observe(time.perf_counter() - serialize_start)
+                yield "".join(lines)
+        except ValueError as error:
+            # The response has already started, so report bad input in-band
+            yield json.dumps({"index": index, "error": str(error)}) + "\n"
+        request_seconds["predict_batch"].observe(time.perf_counter() - start)
+
+    return BodyStreamingResponse(results())
+
+# Define the /embed endpoint serving the backbone features of many texts
+@app.post("/embed")
+async def embed(request: Request):
+    model = require_model()
+    if not model.backend.serves_features:
+        raise HTTPException(status_code=409, detail="The loaded model has no features output, "
+                                                    "export it again with `python export_model.py onnx`.")
+
+    # Refuse new bulk work while every inference worker is busy
+    if executor.full():
+        raise HTTPException(status_code=503, detail="All inference workers are busy.")
+
+    # Same body formats and chunking as /predict_batch
+    chunks = await read_chunks(request)
+
+    async def results():
+        index = 0
+        start = time.perf_counter()
+        try:
+            async for chunk in chunks:
+                try:
+                    embeddings = await executor.run(embed_texts, chunk, model, block=True)
+                except Exception as error:
+                    yield failed_chunk_lines(index, len(chunk), error)
+                    index += len(chunk)
+                    continue
+                lines = []
+                for embedding in embeddings:
+                    lines.append(json.dumps({"index": index, "embedding": embedding}) + "\n")
+                    index += 1
+                yield "".join(lines)
+        except ValueError as error:
+            # The response has already started, so report bad input in-band
+            yield json.dumps({"index": index, "error": str(error)}) + "\n"
+        request_seconds["embed"].observe(time.perf_counter() - start)
+
+    return BodyStreamingResponse(results())
+
+# Readiness probe: 200 once the model is loaded and warmed up, 503 before
+@app.get("/ready")
+async def ready():
+    model = require_model()
+    return dict(ready=True, backend=model_backend, **model.describe())
+
+# List the resident checkpoints, the active one and the shadow comparison
+@app.get("/models")
+async def models():
+    return {"backend": model_backend, "model_root": model_root, **registry.stats(), "shadow": shadow.stats()}
+
+# Load a checkpoint under MODEL_ROOT, warm it up and swap it in; requests
+# already running finish on the previous model
+@app.post("/models/activate")
+async def activate_model(path: str):
+    require_model()
+    model = await swap_model(registry.activate, checkpoint_path(path))
+    return dict(active=True, **model.describe())
+
+# Score a sample of the traffic with a candidate checkpoint in the shadow
+@app.post("/models/shadow")
+async def start_shadow(path: str, fraction: float = Query(None, gt=0, le=1)):
+    require_model()
+    model = await swap_model(registry.set_candidate, checkpoint_path(path))
+    if fraction is not None:
+        shadow.fraction = fraction
+    shadow.reset()
+    return dict(candidate=True, fraction=shadow.fraction, **model.describe())
+
+# Stop shadow scoring, the candidate may then be evicted
+@app.delete("/models/shadow")
+async def stop_shadow():
+    registry.set_candidate(None)
+    return {"candidate": False, "shadow": shadow.stats()}
+
+# Expose batcher histograms, cache counters and memory use to tune the server
+@app.get("/stats")
+async def stats():
+    model = registry.active
+    return {"batcher": batcher.stats(), "cache": cache.stats(),
+            "token_cache": model.token_cache.stats() if model is not None else None,
+            "models": registry.stats(), "shadow": shadow.stats(),
+            "backend": model.backend.stats() if model is not None and hasattr(model.backend, "stats") else None,
+            "memory": process_memory_mb()}
+
+# Prometheus scrape endpoint, the metrics are those of the worker answering
+@app.get("/metrics")
+async def metrics():
+    families = [
+        ("classifier_request_seconds", "Time to answer a request, by endpoint.",
+         [({"endpoint": endpoint}, histogram) for endpoint, histogram in request_seconds.items()]),
+        ("classifier_stage_seconds", "Time spent in each stage of the inference path.",
+         [({"stage": stage}, histogram) for stage, histogram in stage_seconds.items()]),
+        ("classifier_queue_wait_seconds", "Time requests waited in the batcher queue.",
+         [({}, batcher.queue_wait_histogram)]),
+        ("classifier_batch_size", "Requests per batch run by the batcher.", [({}, batcher.batch_size_histogram)]),
+        ("classifier_queue_depth", "Requests waiting in the batcher queue.", [({}, batcher.queue_depth)]),
+        ("classifier_tokens_per_text", "Tokens of each classified text after truncation.", [({}, tokens_per_text)]),
+        ("classifier_padded_tokens_per_batch", "Token positions of each batch including padding.", [({}, padded_tokens_per_batch)]),
+        ("classifier_texts_total", "Texts run through the model.", [({}, texts_classified)]),
+        ("classifier_embedded_texts_total", "Texts whose features were served by /embed.", [({}, texts_embedded)]),
+        ("classifier_cascade_answers_total", "Texts answered by each cascade stage.",
+         [({"stage": stage}, counter) for stage, counter in answered_by.items()]),
+        ("classifier_cache_requests_total", "Prediction cache lookups by outcome.",
+         [({"result": "hit"}, cache.hits), ({"result": "miss"}, cache.misses), ({"result": "coalesced"}, cache.coalesced)]),
+        ("classifier_cache_entries", "Predictions held in the cache.", [({}, cache.size)]),
+    ]
+    model = registry.active
+    if model is not None:
+        families.append(("classifier_token_cache_requests_total", "Token id cache lookups of the active model by outcome.",
+                         [({"result": "hit"}, model.token_cache.hits), ({"result": "miss"}, model.token_cache.misses)]))
+    if model is not None and hasattr(model.backend, "layers_run"):
+        families.append(("classifier_early_exit_layers_total", "GPT-2 blocks run by the early-exit backend, summed over texts.",
+                         [({}, model.backend.layers_run)]))
+    families += [
+        ("classifier_model_swaps_total", "Times a checkpoint was swapped in.", [({}, registry.swaps)]),
+        ("classifier_resident_models", "Checkpoints held in memory.", [({}, registry.resident)]),
+        ("classifier_shadow_texts_total", "Texts sampled for the shadow candidate by outcome.",
+         [({"result": "agree"}, shadow.agreed), ({"result": "disagree"}, shadow.disagreed),
+          ({"result": "dropped"}, shadow.dropped), ({"result": "error"}, shadow.errors)]),
+        ("classifier_profiler_traces_total", "Profiler traces written.", [({}, profiler.traces)]),
+    ]
+    return PlainTextResponse(render_prometheus(families), media_type="text/plain; version=0.0.4")
 
-# Run the FastAPI app using uvicorn server
+# Run the FastAPI app using uvicorn server, as a single process; `serve.py`
+# runs several workers sharing one model
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,205 @@
+# Import necessary libraries
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# Bucket upper bounds in seconds for latency histograms
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Histogram(object):
+    r"""
+    Histogram with fixed bucket upper bounds.
+
+    Arguments:
+
+      buckets (:obj:`list`):
+          Sorted upper bounds of the buckets. Observations larger than the last
+          bound are counted in the implicit `+Inf` bucket.
+
+    """
+
+    def __init__(self, buckets):
+
+        # Upper bounds of the buckets, the last slot is the `+Inf` bucket.
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+        return
+
+    def observe(self, value):
+        # Find the first bucket whose upper bound holds the value.
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        # Return the bucket counts keyed by their upper bound.
+        with self._lock:
+            buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+            buckets["+Inf"] = self.counts[-1]
+            return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+class Gauge(object):
+    r"""
+    Single value that can go up and down.
+
+    """
+
+    def __init__(self):
+
+        self.value = 0
+
+        return
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Counter(object):
+    r"""
+    Value that only goes up.
+
+    """
+
+    def __init__(self):
+
+        self.value = 0
+        self._lock = threading.Lock()
+
+        return
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+def process_memory_mb():
+    r"""
+    Resident memory of this process in MB, from `/proc/self/smaps_rollup`.
+
+    `Pss` splits shared pages between the processes using them, so summing it
+    over the workers of `serve.py` gives their real memory use, unlike `Rss`.
+    Returns an empty dictionary where the file does not exist.
+
+    """
+
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return {}
+    fields = dict(line.split(":", 1) for line in lines)
+    return {name.lower(): int(fields[name].split()[0]) / 1024 for name in ("Rss", "Pss", "Anonymous")
+            if name in fields}
+
+
+def render_prometheus(families):
+    r"""
+    Render metrics in the Prometheus text exposition format.
+
+    Arguments:
+
+      families (:obj:`List[Tuple[str, str, List[Tuple[dict, object]]]]`):
+          Name, help text and samples of each metric family. A sample is a
+          dictionary of label values and a `Histogram`, `Counter` or `Gauge`;
+          all samples of a family have the same type. Counter names should end
+          in `_total`.
+
+    Returns:
+      :obj:`str`: Text served at `/metrics`.
+
+    """
+
+    lines = []
+    for name, help_text, samples in families:
+        kind = {Histogram: "histogram", Counter: "counter", Gauge: "gauge"}[type(samples[0][1])]
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, metric in samples:
+            if kind != "histogram":
+                lines.append("%s%s %s" % (name, _labels(labels), metric.snapshot()))
+                continue
+            # Prometheus buckets count everything up to their bound.
+            snapshot = metric.snapshot()
+            total = 0
+            for bound, count in snapshot["buckets"].items():
+                total += count
+                lines.append("%s_bucket%s %d" % (name, _labels(dict(labels, le=bound)), total))
+            lines.append("%s_sum%s %r" % (name, _labels(labels), snapshot["sum"]))
+            lines.append("%s_count%s %d" % (name, _labels(labels), snapshot["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, value) for key, value in labels.items())
+
+
+class SamplingProfiler(object):
+    r"""
+    Record a torch profiler trace for one out of every `every` requests.
+
+    Requests are counted as they go through `profile`; the batch holding every
+    `every`-th request runs under `torch.profiler` and its trace is written to
+    `output_dir` as a Chrome trace (open in `chrome://tracing` or Perfetto).
+    Tracing slows that one batch down, so keep `every` large in production.
+
+    Arguments:
+
+      every (:obj:`int`):
+          Sampling interval in requests, `0` disables profiling.
+
+      output_dir (:obj:`str`):
+          Directory the traces are written to.
+
+    """
+
+    def __init__(self, every=0, output_dir="profiles"):
+
+        self.every = every
+        self.output_dir = output_dir
+        self.traces = Counter()
+        self._seen = 0
+        self._lock = threading.Lock()
+
+        return
+
+    def _sample(self, n_requests):
+        # Count the requests and tell if one of them is an `every`-th request.
+        if self.every <= 0:
+            return False
+        with self._lock:
+            before = self._seen
+            self._seen += n_requests
+            return before // self.every != self._seen // self.every
+
+    @contextlib.contextmanager
+    def profile(self, n_requests):
+        # Run the block under the profiler when it is this batch's turn.
+        if not self._sample(n_requests):
+            yield
+            return
+
+        import torch
+
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as profiler:
+            yield
+        os.makedirs(self.output_dir, exist_ok=True)
+        profiler.export_chrome_trace(os.path.join(self.output_dir, "trace-%d-%d.json" % (os.getpid(), time.time_ns())))
+        self.traces.inc()
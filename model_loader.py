@@ -0,0 +1,122 @@
+# Import necessary libraries
+import json
+import os
+import struct
+import numpy as np
+
+# Weights file written by `save_pretrained`
+WEIGHTS_FILE = "model.safetensors"
+
+# Files `save_pretrained` writes for the GPT-2 tokenizer: `tokenizer.json`, or
+# the vocabulary and merges with older versions of transformers
+TOKENIZER_FILES = (("tokenizer.json",), ("vocab.json", "merges.txt"))
+
+# safetensors dtype names and the numpy dtype holding their bytes
+_dtypes = {"F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.int16,
+           "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8,
+           "U8": np.uint8, "BOOL": np.bool_}
+
+
+def read_safetensors(path):
+    r"""
+    Map the tensors of a safetensors file without reading them into memory.
+
+    The file is a little-endian header length, a JSON header with the dtype,
+    shape and byte range of each tensor, and the raw tensor data. The data is
+    mapped copy-on-write, so the tensors are views on the page cache: loading
+    is nearly free, pages are only read when first used, and processes
+    mapping the same file share the memory.
+
+    Arguments:
+
+      path (:obj:`str`):
+          Path of a `.safetensors` file.
+
+    Returns:
+      :obj:`Dict[str, torch.Tensor]`: Tensors by name.
+
+    """
+
+    import torch
+
+    with open(path, "rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_size)
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        array = data[start:end].view(_dtypes[info["dtype"]]).reshape(info["shape"])
+        tensor = torch.from_numpy(array)
+        if info["dtype"] == "BF16":
+            tensor = tensor.view(torch.bfloat16)
+        tensors[name] = tensor
+    return tensors
+
+
+def load_mmap_model(model_path):
+    r"""
+    Build the classifier on the meta device and attach memory-mapped weights.
+
+    Creating the model on the meta device skips allocating and randomly
+    initializing weights that are overwritten right away, and `assign=True`
+    makes the parameters the mapped tensors instead of copying into them.
+    Falls back to `from_pretrained` for checkpoints without safetensors weights.
+
+    Arguments:
+
+      model_path (:obj:`str`):
+          Directory written by `save_pretrained`.
+
+    Returns:
+      :obj:`transformers.GPT2ForSequenceClassification`: Model in eval mode.
+
+    """
+
+    import torch
+    from transformers import GPT2Config, GPT2ForSequenceClassification
+
+    weights_path = os.path.join(model_path, WEIGHTS_FILE)
+    if not os.path.exists(weights_path):
+        return GPT2ForSequenceClassification.from_pretrained(model_path).eval()
+
+    config = GPT2Config.from_pretrained(model_path)
+    with torch.device("meta"):
+        model = GPT2ForSequenceClassification(config)
+    model.load_state_dict(read_safetensors(weights_path), strict=True, assign=True)
+
+    # Buffers that are not saved in the checkpoint would still be on meta.
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise ValueError("Checkpoint %s has no values for: %s." % (weights_path, ", ".join(missing)))
+    return model.eval()
+
+
+def has_tokenizer(model_path):
+    # Whether the tokenizer files were bundled with the checkpoint
+    return any(all(os.path.exists(os.path.join(model_path, name)) for name in names) for names in TOKENIZER_FILES)
+
+
+def bundle_tokenizer(model_path, tokenizer_name="gpt2"):
+    # Save the tokenizer next to the weights so serving never needs the hub
+    from tokenization import load_gpt2_tokenizer
+
+    load_gpt2_tokenizer(tokenizer_name).save_pretrained(model_path)
+
+
+def load_tokenizer(model_path, fallback="gpt2"):
+    r"""
+    Load the GPT-2 tokenizer set up for classification.
+
+    Uses the files bundled with the checkpoint, without touching the network,
+    and `fallback` when there are none.
+
+    """
+
+    from tokenization import load_gpt2_tokenizer
+
+    if has_tokenizer(model_path):
+        return load_gpt2_tokenizer(model_path, local_files_only=True)
+    return load_gpt2_tokenizer(fallback)
@@ -0,0 +1,271 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import numpy as np
+import torch
+from transformers import GPT2Config, GPT2ForSequenceClassification
+
+
+def importance_scores(model, dataloader, loss_fn, device_):
+    r"""
+    Score every MLP neuron and block by how much the loss depends on it
+    (Michel et al., 2019).
+
+    A gate of value 1 multiplies each MLP neuron and each block's change to
+    the residual stream. Attention heads are not scored, since
+    `pruned_model` does not remove them. The model is unchanged, but the
+    gradient of the loss with respect to a gate tells how much the loss would
+    move if that part were removed. Absolute gradients are summed over the
+    batches.
+
+    Arguments:
+
+      loss_fn (:obj:`torch.nn.Module`):
+          Loss of the logits and labels, e.g. the class weighted cross entropy
+          of fine-tuning.
+
+    Returns:
+      :obj:`Dict[str, np.ndarray]`: `neurons` of shape `[layers, inner]` and
+      `layers` of shape `[layers]`.
+
+    """
+
+    config = model.config
+    n_inner = config.n_inner or 4 * config.n_embd
+    gates = {'neurons': torch.ones(config.n_layer, n_inner, requires_grad=True),
+             'layers': torch.ones(config.n_layer, requires_grad=True)}
+    scores = {name: torch.zeros_like(gate) for name, gate in gates.items()}
+
+    def gate_neurons(layer):
+        def hook(module, args):
+            return (args[0] * gates['neurons'][layer],)
+        return hook
+
+    def gate_layer(layer):
+        def hook(module, args, output):
+            hidden = output[0] if isinstance(output, tuple) else output
+            gated = args[0] + gates['layers'][layer] * (hidden - args[0])
+            return (gated,) + tuple(output[1:]) if isinstance(output, tuple) else gated
+        return hook
+
+    handles = []
+    for layer, block in enumerate(model.transformer.h):
+        handles.append(block.mlp.c_proj.register_forward_pre_hook(gate_neurons(layer)))
+        handles.append(block.register_forward_hook(gate_layer(layer)))
+
+    # Only the gates need gradients
+    requires_grad = [parameter.requires_grad for parameter in model.parameters()]
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    model.eval()
+    try:
+        for batch in dataloader:
+            labels = batch.pop('labels').to(device_)
+            batch = {k: v.type(torch.long).to(device_) for k, v in batch.items()}
+            loss = loss_fn(model(**batch).logits.float(), labels)
+            for name, grad in zip(gates, torch.autograd.grad(loss, list(gates.values()))):
+                scores[name] += grad.abs()
+    finally:
+        for handle in handles:
+            handle.remove()
+        for parameter, flag in zip(model.parameters(), requires_grad):
+            parameter.requires_grad_(flag)
+
+    return {name: score.numpy() for name, score in scores.items()}
+
+
+def pruned_model(model, scores, drop_layers=0, ffn_keep=1.0):
+    r"""
+    Build a smaller copy of the classifier with blocks and MLP neurons removed.
+
+    The `drop_layers` least important blocks are taken out, and every kept
+    block keeps its `ffn_keep` share of most important MLP neurons. Both only
+    change `n_layer` and `n_inner` of the config, so the result is a plain
+    `GPT2ForSequenceClassification` that `main.py` loads as is. Attention
+    heads are not removed: GPT-2 in transformers derives the head size from
+    `n_embd / n_head`, so a config can not hold fewer heads, not even the
+    same smaller number in every block.
+
+    Arguments:
+
+      scores (:obj:`Dict[str, np.ndarray]`):
+          Importance from `importance_scores`.
+
+      drop_layers (:obj:`int`):
+          Number of blocks removed.
+
+      ffn_keep (:obj:`float`):
+          Share of the MLP neurons kept in every block.
+
+    Returns:
+      :obj:`transformers.GPT2ForSequenceClassification`: The pruned model.
+
+    """
+
+    config = model.config.__class__.from_dict(model.config.to_dict())
+    n_inner = model.config.n_inner or 4 * model.config.n_embd
+    kept_layers = sorted(np.argsort(scores['layers'], kind='stable')[drop_layers:].tolist())
+    n_kept = max(1, int(round(n_inner * ffn_keep)))
+    config.n_layer = len(kept_layers)
+    config.n_inner = n_kept
+
+    state_dict = {}
+    for name, tensor in model.state_dict().items():
+        if name.startswith('transformer.h.'):
+            layer, rest = name[len('transformer.h.'):].split('.', 1)
+            if int(layer) not in kept_layers:
+                continue
+            # The most important neurons of this block, in their original order
+            neurons = torch.from_numpy(np.sort(np.argsort(-scores['neurons'][int(layer)], kind='stable')[:n_kept]))
+            # `Conv1D` weights are `[in, out]`
+            if rest in ('mlp.c_fc.weight', 'mlp.c_fc.bias'):
+                tensor = tensor.index_select(-1, neurons)
+            elif rest == 'mlp.c_proj.weight':
+                tensor = tensor.index_select(0, neurons)
+            name = 'transformer.h.%d.%s' % (kept_layers.index(int(layer)), rest)
+        state_dict[name] = tensor.clone()
+
+    pruned = GPT2ForSequenceClassification(config)
+    pruned.load_state_dict(state_dict)
+    return pruned.eval()
+
+
+def pruning_levels(drop_layers, ffn_keep, n_layer):
+    r"""
+    Pruning levels of the sweep, every number of removed blocks with every
+    share of kept MLP neurons.
+
+    Levels that would remove every block, and the unpruned `(0, 1.0)` which
+    is the original model's row, are left out.
+
+    Arguments:
+
+      drop_layers (:obj:`List[int]`):
+          Numbers of blocks removed.
+
+      ffn_keep (:obj:`List[float]`):
+          Shares of the MLP neurons kept in every block.
+
+      n_layer (:obj:`int`):
+          Number of blocks of the model.
+
+    Returns:
+      :obj:`List[Tuple[int, float]]`: `(drop_layers, ffn_keep)` of every level,
+      in the order of the table after the original model's row.
+
+    """
+
+    return [(drop, keep) for drop in drop_layers for keep in ffn_keep if drop < n_layer and (drop, keep) != (0, 1.0)]
+
+
+def level_name(row):
+    # e.g. "2 blocks off, 50% mlp"
+    return "%d blocks off, %d%% mlp%s" % (row['drop_layers'], round(100 * row['ffn_keep']), ", recovered" if row['recovered'] else "")
+
+
+def main(args):
+    # Score the checkpoint, evaluate every pruning level, then recover and save one
+    from sklearn.utils.class_weight import compute_class_weight
+    from transformers import set_seed, get_linear_schedule_with_warmup
+    from calibration import calibrate
+    from dataset_cache import bucket_dataloader, load_tokenized_splits
+    from distill import benchmark, evaluate
+    from model_loader import load_mmap_model
+    from tokenization import load_gpt2_tokenizer
+    from truncation import TitledText, encode
+    import training
+
+    set_seed(args.seed)
+    device = torch.device('cpu')
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    splits = load_tokenized_splits(args.data, tokenizer, args.cache_dir, args.model_path, limit=args.limit)
+    train_dataset, collator, test_data = splits['train'], splits['collator'], splits['test_data']
+    valid_dataloader = bucket_dataloader(splits['valid'], collator, args.batch_size)
+
+    model = load_mmap_model(args.model_path)
+    model.config.pad_token_id = model.config.eos_token_id if model.config.pad_token_id is None else model.config.pad_token_id
+    class_weights = torch.tensor(compute_class_weight('balanced', classes=np.arange(len(train_dataset.classes)),
+                                                      y=np.asarray(train_dataset.labels)), dtype=torch.float)
+    loss_fn = torch.nn.CrossEntropyLoss(weight=class_weights)
+
+    print('Scoring neurons and blocks...')
+    scores = importance_scores(model, valid_dataloader, loss_fn, device)
+    for layer, (layer_score, neuron_scores) in enumerate(zip(scores['layers'], scores['neurons'])):
+        print("block %2d - importance %.4f - mlp neurons median %.4f" % (layer, layer_score, np.median(neuron_scores)))
+
+    # Latency of the same held-out texts for every level
+    texts = encode(tokenizer, [TitledText(title, paragraph) for title, paragraph in zip(test_data['title'][:8], test_data['paragraph'][:8])],
+                   collator.max_sequence_len, collator.strategy)
+    original = dict(drop_layers=0, ffn_keep=1.0, layers=model.config.n_layer, n_inner=model.config.n_inner or 4 * model.config.n_embd,
+                    recovered=False, **benchmark(model, tokenizer, texts), **evaluate(model, valid_dataloader, device))
+    rows = [original]
+    levels = pruning_levels(args.drop_layers, args.ffn_keep, model.config.n_layer)
+    for drop_layers, ffn_keep in levels:
+        candidate = pruned_model(model, scores, drop_layers, ffn_keep)
+        rows.append(dict(drop_layers=drop_layers, ffn_keep=ffn_keep, layers=candidate.config.n_layer,
+                         n_inner=candidate.config.n_inner, recovered=False,
+                         **benchmark(candidate, tokenizer, texts), **evaluate(candidate, valid_dataloader, device)))
+
+    # The smallest level within the allowed macro-F1 drop, unless one is given
+    if args.save_level is not None:
+        chosen = rows[args.save_level]
+    else:
+        chosen = min([row for row in rows if row['macro_f1'] >= original['macro_f1'] - args.max_f1_drop],
+                     key=lambda row: row['parameters'])
+    student = pruned_model(model, scores, chosen['drop_layers'], chosen['ffn_keep'])
+
+    if args.recovery_epochs:
+        # A short fine-tune of the pruned model, as in training
+        train_dataloader = bucket_dataloader(train_dataset, collator, args.batch_size, shuffle=True, seed=args.seed)
+        optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, eps=1e-8)
+        scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0,
+                                                    num_training_steps=len(train_dataloader) * args.recovery_epochs)
+        for epoch in range(args.recovery_epochs):
+            train_dataloader.batch_sampler.set_epoch(epoch)
+            _, _, train_loss = training.train(student, train_dataloader, optimizer, scheduler, device, loss_fn)
+            print("recovery epoch %d - train_loss: %.5f" % (epoch + 1, train_loss))
+        student.eval()
+        rows.append(dict(chosen, recovered=True, **benchmark(student, tokenizer, texts), **evaluate(student, valid_dataloader, device)))
+
+    columns = ['layers', 'n_inner', 'parameters', 'size_mb', 'latency_ms_batch_1', 'latency_ms_batch_8', 'macro_f1', 'accuracy']
+    print("%-26s" % "level" + "".join("%19s" % column for column in columns))
+    for row in rows:
+        print("%-26s" % level_name(row) + "".join("%19.4g" % row[column] for column in columns))
+
+    student.save_pretrained(args.output_dir)
+    tokenizer.save_pretrained(args.output_dir)
+    calibrate(student, valid_dataloader, device, args.output_dir, train_dataset.classes)
+    with open(os.path.join(args.output_dir, 'prune_report.json'), 'w') as f:
+        json.dump({'levels': rows, 'saved': {'drop_layers': chosen['drop_layers'], 'ffn_keep': chosen['ffn_keep']},
+                   'importance': {'layers': scores['layers'].tolist()},
+                   'settings': vars(args)}, f, indent=2)
+    print("Saved %s to %s" % (level_name(chosen), args.output_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune GPT-2 blocks and MLP neurons by importance and report macro-F1 against CPU latency.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--output-dir", default="weights/pruned")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--drop-layers", type=lambda s: [int(v) for v in s.split(",")], default=[0, 2, 4, 6],
+                        help="Numbers of blocks removed, one level each with every --ffn-keep.")
+    parser.add_argument("--ffn-keep", type=lambda s: [float(v) for v in s.split(",")], default=[1.0, 0.75, 0.5],
+                        help="Shares of the MLP neurons kept in every block.")
+    parser.add_argument("--max-f1-drop", type=float, default=0.01, help="Macro-F1 the saved level may lose before recovery.")
+    parser.add_argument("--save-level", type=int, default=None, help="Row of the table to save instead, 0 being the original model.")
+    parser.add_argument("--recovery-epochs", type=int, default=1, help="Fine-tuning epochs of the saved level, 0 to skip.")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=2e-5)
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N examples of each split.")
+    args = parser.parse_args()
+    if args.save_level is not None:
+        # Checked before hours of scoring, against the rows the sweep will have
+        n_rows = 1 + len(pruning_levels(args.drop_layers, args.ffn_keep, GPT2Config.from_pretrained(args.model_path).n_layer))
+        if not 0 <= args.save_level < n_rows:
+            parser.error("--save-level must be between 0 and %d, the table has %d rows." % (n_rows - 1, n_rows))
+    main(args)
@@ -0,0 +1,315 @@
+# Import necessary libraries
+import asyncio
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import checkpoint_fingerprint
+from metrics import Counter, Gauge
+
+
+class ServedModel(object):
+    r"""
+    One loaded checkpoint with everything needed to serve it.
+
+    Requests read the active model once and use it until they are done, so a
+    swap never mixes the tokenizer, weights or calibration of two checkpoints.
+
+    Arguments:
+
+      path (:obj:`str`):
+          Checkpoint directory the model was loaded from.
+
+      backend (:obj:`backends.EagerBackend`):
+          Inference backend running the weights.
+
+      tokenizer (:obj:`transformers.PreTrainedTokenizerBase`):
+          Tokenizer bundled with the checkpoint.
+
+      token_cache (:obj:`tokenization.TokenCache`):
+          Token ids of recent texts, kept with the model so it stays warm
+          while the model is resident.
+
+      temperature (:obj:`float`):
+          Temperature fitted by `calibration.py`.
+
+      label_names (:obj:`List[str]`):
+          Label names by label id.
+
+      token_budget (:obj:`int`):
+          Largest number of tokens of a text the model reads.
+
+      truncation_strategy (:obj:`str`):
+          One of `truncation.STRATEGIES`.
+
+      cascade (:obj:`cascade.LinearCascade`, `optional`):
+          Linear first stage, when the cascade is on.
+
+    """
+
+    def __init__(self, path, backend, tokenizer, token_cache, temperature, label_names,
+                 token_budget, truncation_strategy, cascade=None):
+
+        self.path = path
+        self.fingerprint = checkpoint_fingerprint(path)
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.token_cache = token_cache
+        self.temperature = temperature
+        self.label_names = label_names
+        self.token_budget = token_budget
+        self.truncation_strategy = truncation_strategy
+        self.cascade = cascade
+
+        return
+
+    def label(self, label_id):
+        # Name of a label id, the id itself when the checkpoint has no names
+        return self.label_names[label_id] if label_id < len(self.label_names) else str(label_id)
+
+    def describe(self):
+        return {"model_path": self.path, "fingerprint": self.fingerprint,
+                "token_budget": self.token_budget, "truncation": self.truncation_strategy}
+
+
+class ModelRegistry(object):
+    r"""
+    Checkpoints kept in memory, one of which answers the requests.
+
+    A checkpoint is loaded and warmed up on a background thread while the
+    active model keeps serving, then swapped in with a single assignment.
+    Batches already running hold a reference to the model they started with
+    and finish on it. At most `max_resident` models are kept; the least
+    recently used one that is neither active nor the shadow candidate is
+    dropped first, and its memory is freed once its last batch is done.
+    Entries are keyed by `checkpoint_fingerprint`, so loading a path whose
+    files changed loads them again.
+
+    Arguments:
+
+      load_fn (:obj:`callable`):
+          Function that takes a checkpoint directory and returns a
+          `ServedModel`.
+
+      warm_up_fn (:obj:`callable`, `optional`):
+          Function run on a newly loaded model before it can be used, e.g.
+          one forward pass.
+
+      max_resident (:obj:`int`):
+          Largest number of models kept in memory.
+
+    """
+
+    def __init__(self, load_fn, warm_up_fn=None, max_resident=2):
+
+        self.load_fn = load_fn
+        self.warm_up_fn = warm_up_fn
+        self.max_resident = max(1, max_resident)
+        # The model answering requests, and the one scored in the shadow.
+        self.active = None
+        self.candidate = None
+        # Fingerprint -> model, least recently used first.
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # Only one checkpoint is loaded at a time.
+        self._loading = None
+        # Counters exported with the server stats.
+        self.loads = Counter()
+        self.swaps = Counter()
+        self.evictions = Counter()
+        self.resident = Gauge()
+
+        return
+
+    def get(self, path, warm_up=True):
+        r"""
+        Return the model of `path`, loading it when it is not resident.
+
+        This blocks while loading, so the server calls it off the event loop.
+        With `warm_up` false the new model is returned without running
+        `warm_up_fn`, e.g. to load it before forking workers.
+
+        """
+
+        fingerprint = checkpoint_fingerprint(path)
+        with self._lock:
+            model = self._models.get(fingerprint)
+            if model is not None:
+                self._models.move_to_end(fingerprint)
+                return model
+
+        model = self.load_fn(path)
+        if warm_up and self.warm_up_fn is not None:
+            self.warm_up_fn(model)
+        self.loads.inc()
+        with self._lock:
+            self._models[fingerprint] = model
+            self._models.move_to_end(fingerprint)
+        return model
+
+    def activate(self, path, warm_up=True):
+        # Make the model of `path` answer the requests, loading it if needed
+        model = self.get(path, warm_up)
+        if model is not self.active:
+            if self.active is not None:
+                self.swaps.inc()
+            self.active = model
+        self._evict()
+        return model
+
+    def set_candidate(self, path):
+        # Score the shadow traffic with the model of `path`, `None` stops it
+        self.candidate = self.get(path) if path else None
+        self._evict()
+        return self.candidate
+
+    async def run(self, fn, path):
+        r"""
+        Run `activate` or `set_candidate` on a background thread.
+
+        Concurrent calls wait for each other, so two checkpoints are never
+        loaded at the same time.
+
+        """
+
+        if self._loading is None:
+            self._loading = asyncio.Lock()
+        async with self._loading:
+            return await asyncio.get_running_loop().run_in_executor(None, fn, path)
+
+    def _evict(self):
+        # Drop the least recently used models beyond `max_resident`
+        with self._lock:
+            in_use = {id(self.active), id(self.candidate)}
+            for fingerprint in list(self._models):
+                if len(self._models) <= self.max_resident:
+                    break
+                if id(self._models[fingerprint]) not in in_use:
+                    del self._models[fingerprint]
+                    self.evictions.inc()
+            self.resident.set(len(self._models))
+
+    def stats(self):
+        with self._lock:
+            resident = [model.describe() for model in self._models.values()]
+        return {"active": self.active.describe() if self.active is not None else None,
+                "candidate": self.candidate.describe() if self.candidate is not None else None,
+                "resident": resident,
+                "max_resident": self.max_resident,
+                "loads": self.loads.snapshot(),
+                "swaps": self.swaps.snapshot(),
+                "evictions": self.evictions.snapshot()}
+
+
+class ShadowScorer(object):
+    r"""
+    Score a sample of the traffic with a candidate model, off the latency path.
+
+    After a batch is answered by the active model, each of its texts is
+    picked with probability `fraction`. The picked texts are scored by the
+    candidate on a separate thread, with a single torch thread so it takes
+    little from the inference workers, and the top labels of both models are
+    compared by name, so the candidate may order its labels differently.
+    When `max_pending` batches are already waiting the sample is dropped
+    rather than queued, so the shadow never holds back requests.
+
+    Arguments:
+
+      score_fn (:obj:`callable`):
+          Function that takes a model and a list of texts and returns their
+          `(label_ids, probabilities)` predictions, most likely label first.
+
+      fraction (:obj:`float`):
+          Share of the texts scored by the candidate.
+
+      max_pending (:obj:`int`):
+          Largest number of sampled batches waiting for the candidate.
+
+    """
+
+    def __init__(self, score_fn, fraction=0.1, max_pending=4):
+
+        self.score_fn = score_fn
+        self.fraction = fraction
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow", initializer=self._set_threads)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.reset()
+
+        return
+
+    @staticmethod
+    def _set_threads():
+        import torch
+
+        torch.set_num_threads(1)
+
+    def reset(self):
+        # Start counting again, e.g. for a new candidate
+        with self._lock:
+            self.compared = Counter()
+            self.agreed = Counter()
+            self.disagreed = Counter()
+            self.dropped = Counter()
+            self.errors = Counter()
+            self._probability_diff = 0.0
+            # "active label -> candidate label" -> count
+            self._changes = {}
+
+    def submit(self, active, candidate, texts, predictions):
+        r"""
+        Sample `texts` answered by `active` with `predictions` and queue them
+        for `candidate`. Returns right away.
+
+        """
+
+        if candidate is None or candidate is active or self.fraction <= 0:
+            return
+        picked = [i for i in range(len(texts)) if random.random() < self.fraction]
+        if not picked:
+            return
+        if not self._pending.acquire(blocking=False):
+            self.dropped.inc(len(picked))
+            return
+        self._pool.submit(self._score, active, candidate, [texts[i] for i in picked], [predictions[i] for i in picked])
+
+    def _score(self, active, candidate, texts, predictions):
+        try:
+            shadow_predictions = self.score_fn(candidate, texts)
+        except Exception:
+            self.errors.inc(len(texts))
+            return
+        finally:
+            self._pending.release()
+
+        with self._lock:
+            for (label_ids, probabilities), (shadow_ids, shadow_probabilities) in zip(predictions, shadow_predictions):
+                label = active.label(label_ids[0])
+                shadow = {candidate.label(label_id): probability for label_id, probability in zip(shadow_ids, shadow_probabilities)}
+                self.compared.inc()
+                if candidate.label(shadow_ids[0]) == label:
+                    self.agreed.inc()
+                else:
+                    self.disagreed.inc()
+                    change = "%s -> %s" % (label, candidate.label(shadow_ids[0]))
+                    self._changes[change] = self._changes.get(change, 0) + 1
+                # Gap between the probabilities both models give the active model's label
+                self._probability_diff += abs(probabilities[0] - shadow.get(label, 0.0))
+
+    def stats(self):
+        with self._lock:
+            compared = self.compared.snapshot()
+            return {"fraction": self.fraction,
+                    "compared": compared,
+                    "agreed": self.agreed.snapshot(),
+                    "disagreed": self.disagreed.snapshot(),
+                    "agreement": self.agreed.snapshot() / compared if compared else None,
+                    "mean_probability_diff": self._probability_diff / compared if compared else None,
+                    "label_changes": dict(sorted(self._changes.items(), key=lambda item: -item[1])),
+                    "dropped": self.dropped.snapshot(),
+                    "errors": self.errors.snapshot()}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -1,17 +1,267 @@
-# Import the requests library to send HTTP requests
-import requests
+# Import necessary libraries
+import argparse
+import asyncio
+import json
+import random
+import time
+import httpx
+import numpy as np
 
 # Define the input text that you want to predict the label for
 text = "5 more suspected omicron cases in tn among the five is a woman passenger who flew from the republic of congo in africa the other four are the relatives of the person who has already tested positive"
 
-# Send a GET request to the FastAPI server running at http://localhost:8000/predict
-response = requests.get(f"http://localhost:8000/predict/?text={text}")
+# Latency percentiles reported for every run
+PERCENTILES = (50, 90, 95, 99)
 
-# Parse the response JSON data returned by the server
-data = response.json()
 
-# Extract the predicted label from the response data
-predicted_label = data["predicted_label"]
+def predict(args):
+    # Send a single GET request to the FastAPI server and print the predicted label
+    response = httpx.get(args.url + "/predict", params={"text": args.text}, timeout=args.timeout)
 
-# Print the predicted label
-print(f"Predicted label: {predicted_label}")
+    # Parse the response JSON data returned by the server
+    data = response.json()
+
+    # Extract the predicted label from the response data
+    predicted_label = data["predicted_label"]
+
+    # Print the predicted label
+    print(f"Predicted label: {predicted_label}")
+
+
+def load_corpus(path, size, seed):
+    # Sample held-out texts, built the same way as for training, so lengths match real traffic
+    from data import load_splits
+
+    _, test_data = load_splits(path)
+    texts = test_data["text"]
+    texts = texts[texts.str.strip().str.len() > 0]
+    return texts.sample(n=min(size, len(texts)), random_state=seed).tolist()
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    r"""
+    Reduce the outcome of one run to throughput, error rates and percentiles.
+
+    Arguments:
+
+      latencies (:obj:`List[float]`):
+          Seconds of every successful request.
+
+      statuses (:obj:`Dict[int, int]`):
+          Number of responses by HTTP status.
+
+      errors (:obj:`int`):
+          Requests that got no response, e.g. timeouts or refused connections.
+
+      elapsed (:obj:`float`):
+          Length of the measured window in seconds.
+
+    Returns:
+      :obj:`Dict[str, float]`: Results of the run.
+
+    """
+
+    total = sum(statuses.values()) + errors
+    ok = statuses.get(200, 0)
+    result = {"requests": total,
+              "ok": ok,
+              "throughput": ok / elapsed if elapsed else 0.0,
+              "error_rate": (total - ok) / total if total else 0.0,
+              "rejected_rate": statuses.get(503, 0) / total if total else 0.0,
+              "statuses": {str(status): count for status, count in sorted(statuses.items())},
+              "connection_errors": errors}
+    if latencies:
+        latencies_ms = np.asarray(latencies) * 1000
+        result["latency_ms"] = {"mean": float(latencies_ms.mean()), "max": float(latencies_ms.max())}
+        result["latency_ms"].update({"p%d" % p: float(np.percentile(latencies_ms, p)) for p in PERCENTILES})
+    return result
+
+
+async def run_level(client, texts, duration, warmup, concurrency=None, rate=None, max_in_flight=1024, seed=0):
+    r"""
+    Load the server for `warmup + duration` seconds and measure the last `duration`.
+
+    With `concurrency` a fixed number of clients each send their next request
+    as soon as the previous one returns (closed loop, finds saturation
+    throughput). With `rate` requests are started at Poisson arrival times
+    regardless of how fast the server answers (open loop), and latency is
+    counted from the planned start, so a slow server cannot hide its queueing
+    by slowing down the client.
+
+    """
+
+    rng = random.Random(seed)
+    latencies = []
+    statuses = {}
+    errors = 0
+    last_done = 0.0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    async def send(planned):
+        nonlocal errors, last_done
+        try:
+            response = await client.get("/predict", params={"text": rng.choice(texts)})
+        except httpx.HTTPError:
+            if planned >= measure_from:
+                errors += 1
+            return
+        if planned >= measure_from:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            last_done = loop.time()
+            if response.status_code == 200:
+                latencies.append(last_done - planned)
+
+    if concurrency is not None:
+        async def user():
+            while loop.time() < stop_at:
+                await send(loop.time())
+
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+    else:
+        in_flight = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+        planned = start
+        while planned < stop_at:
+            planned += rng.expovariate(rate)
+            await asyncio.sleep(max(0.0, planned - loop.time()))
+            # Beyond `max_in_flight` the client itself would be the bottleneck
+            await in_flight.acquire()
+            task = asyncio.create_task(send(planned))
+            task.add_done_callback(lambda _: in_flight.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    # An overloaded server still finishes the measured requests after the window
+    return summarize(latencies, statuses, errors, max(duration, last_done - measure_from))
+
+
+async def bench_async(args, texts):
+    # One pooled keep-alive connection per concurrent request
+    connections = max(args.concurrency or [args.max_in_flight])
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        levels = [{"concurrency": c} for c in args.concurrency] if args.concurrency else [{"rate": r} for r in args.rate]
+        results = []
+        for level in levels:
+            result = await run_level(client, texts, args.duration, args.warmup,
+                                     max_in_flight=args.max_in_flight, seed=args.seed, **level)
+            result.update(level)
+            results.append(result)
+            print(format_row(result), flush=True)
+
+        # Server side view of the run, when the server exposes it
+        try:
+            stats = (await client.get("/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            stats = None
+    return results, stats
+
+
+def format_row(result):
+    level = "c=%d" % result["concurrency"] if "concurrency" in result else "rate=%g/s" % result["rate"]
+    latency = result.get("latency_ms", {})
+    return "%-12s %8d req %9.1f req/s  err %5.1f%%  p50 %7.1f  p95 %7.1f  p99 %7.1f ms" % (
+        level, result["requests"], result["throughput"], 100 * result["error_rate"],
+        latency.get("p50", float("nan")), latency.get("p95", float("nan")), latency.get("p99", float("nan")))
+
+
+def bench(args):
+    r"""
+    Sweep concurrency or request rate against `/predict` and save the results.
+
+    """
+
+    texts = load_corpus(args.data, args.corpus_size, args.seed) if args.data else [args.text]
+    if not args.concurrency and not args.rate:
+        args.concurrency = [1, 2, 4, 8, 16]
+
+    results, stats = asyncio.run(bench_async(args, texts))
+
+    if args.output:
+        report = {"label": args.label,
+                  "url": args.url,
+                  "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "settings": {"duration": args.duration, "warmup": args.warmup, "corpus_size": len(texts), "seed": args.seed},
+                  "results": results,
+                  "server_stats": stats}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved results to %s" % args.output)
+
+
+def compare(args):
+    r"""
+    Compare two saved runs level by level and fail on regressions.
+
+    A level regresses when its throughput drops or its p99 latency grows by
+    more than `--tolerance`, or its error rate grows by more than
+    `--error-tolerance`.
+
+    """
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    def level_key(result):
+        return ("concurrency", result["concurrency"]) if "concurrency" in result else ("rate", result["rate"])
+
+    baseline_levels = {level_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print("%-18s %22s %22s %16s" % ("level", "throughput (req/s)", "p99 (ms)", "error rate"))
+    for result in candidate["results"]:
+        old = baseline_levels.get(level_key(result))
+        if old is None:
+            continue
+        old_p99 = old.get("latency_ms", {}).get("p99", float("inf"))
+        new_p99 = result.get("latency_ms", {}).get("p99", float("inf"))
+        worse = (result["throughput"] < old["throughput"] * (1 - args.tolerance)
+                 or new_p99 > old_p99 * (1 + args.tolerance)
+                 or result["error_rate"] > old["error_rate"] + args.error_tolerance)
+        regressions += worse
+        print("%-18s %10.1f -> %9.1f %10.1f -> %9.1f %7.3f -> %6.3f %s" % (
+            "%s=%g" % level_key(result), old["throughput"], result["throughput"], old_p99, new_p99,
+            old["error_rate"], result["error_rate"], "REGRESSION" if worse else ""))
+
+    if regressions:
+        raise SystemExit("%d of the levels regressed from %s to %s." % (regressions, baseline.get("label"), candidate.get("label")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the classification API, or load test it. Without a command a single prediction is made.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--text", default=text)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.set_defaults(func=predict)
+    subparsers = parser.add_subparsers(dest="command")
+
+    sub = subparsers.add_parser("bench", help="Measure latency percentiles, throughput and errors under load.")
+    sweep = sub.add_mutually_exclusive_group()
+    sweep.add_argument("--concurrency", type=lambda s: [int(v) for v in s.split(",")], default=None,
+                       help="Comma separated concurrent clients to sweep, e.g. 1,4,16 (default).")
+    sweep.add_argument("--rate", type=lambda s: [float(v) for v in s.split(",")], default=None,
+                       help="Comma separated request rates per second to sweep (open loop).")
+    sub.add_argument("--duration", type=float, default=20.0, help="Measured seconds per level.")
+    sub.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before each level.")
+    sub.add_argument("--max-in-flight", type=int, default=256, help="Open loop limit of outstanding requests.")
+    sub.add_argument("--data", default="query_resul.parquet", help="Parquet file to sample texts from, empty for `--text` only.")
+    sub.add_argument("--corpus-size", type=int, default=1000)
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--label", default="", help="Name of the serving configuration, stored in the results.")
+    sub.add_argument("--output", default=None, help="Save the results as JSON.")
+    sub.set_defaults(func=bench)
+
+    sub = subparsers.add_parser("compare", help="Compare two saved bench results and fail on regressions.")
+    sub.add_argument("baseline")
+    sub.add_argument("candidate")
+    sub.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative throughput drop and p99 increase.")
+    sub.add_argument("--error-tolerance", type=float, default=0.01, help="Allowed absolute error rate increase.")
+    sub.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,143 @@
+# Import necessary libraries
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def dataset_lengths(dataset, max_sequence_len):
+    # Token length of every example after truncation, read from the cache offsets
+    return np.minimum(np.diff(np.asarray(dataset.offsets)), max_sequence_len)
+
+
+def padding_ratio(batches, lengths):
+    r"""
+    Share of the positions in padded batches that hold padding.
+
+    Arguments:
+
+      batches (:obj:`Iterable[List[int]]`):
+          Lists of example indices, e.g. a batch sampler.
+
+      lengths (:obj:`np.ndarray`):
+          Token length of every example.
+
+    Returns:
+      :obj:`float`: Padding positions divided by all positions.
+
+    """
+
+    real = 0
+    padded = 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        real += int(batch_lengths.sum())
+        padded += int(batch_lengths.max()) * len(batch)
+    return 1.0 - real / padded if padded else 0.0
+
+
+class BucketBatchSampler(Sampler):
+    r"""
+    Batch sampler grouping examples of similar token length.
+
+    Each epoch the indices are shuffled and cut into pools of
+    `batch_size * bucket_size_multiplier` examples. Each pool is sorted by
+    length and cut into batches, and the batches are shuffled again, so
+    batches hold similar lengths while their content and order change every
+    epoch. With `max_tokens` the batches are packed up to a token budget
+    (batch size times longest example) instead of a fixed size.
+
+    Arguments:
+
+      lengths (:obj:`np.ndarray`):
+          Token length of every example.
+
+      batch_size (:obj:`int`, `optional`):
+          Number of examples per batch. Ignored when `max_tokens` is passed.
+
+      max_tokens (:obj:`int`, `optional`):
+          Largest number of padded tokens per batch.
+
+      shuffle (:obj:`bool`):
+          Shuffle for training. Without it examples are sorted by length once,
+          which is what validation wants.
+
+      bucket_size_multiplier (:obj:`int`):
+          Pool size in batches; bigger pools give less padding but less
+          randomness.
+
+      seed (:obj:`int`):
+          Seed of the shuffling, combined with the epoch from `set_epoch`.
+          Like `DistributedSampler`, call `set_epoch` before every epoch to
+          get a new shuffle.
+
+    """
+
+    def __init__(self, lengths, batch_size=None, max_tokens=None, shuffle=True, bucket_size_multiplier=50, seed=0):
+
+        if batch_size is None and max_tokens is None:
+            raise ValueError("Pass either `batch_size` or `max_tokens`.")
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.bucket_size_multiplier = bucket_size_multiplier
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+        return
+
+    def set_epoch(self, epoch):
+        # Change the shuffling for a new epoch.
+        self.epoch = epoch
+        self._batches = None
+
+    def _split(self, indices):
+        # Cut length-sorted indices into batches.
+        if self.max_tokens is None:
+            return [indices[i:i + self.batch_size].tolist() for i in range(0, len(indices), self.batch_size)]
+
+        batches = []
+        batch = []
+        longest = 0
+        for index in indices.tolist():
+            length = max(longest, int(self.lengths[index]))
+            # Start a new batch when this example would exceed the budget.
+            if batch and length * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                length = int(self.lengths[index])
+            batch.append(index)
+            longest = length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def batches(self):
+        # Build the batches of the current epoch once.
+        if self._batches is not None:
+            return self._batches
+
+        if not self.shuffle:
+            self._batches = self._split(np.argsort(self.lengths, kind='stable'))
+            return self._batches
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths))
+        # Pools hold about `bucket_size_multiplier` batches.
+        if self.max_tokens is None:
+            pool_size = self.batch_size * self.bucket_size_multiplier
+        else:
+            pool_size = max(1, self.max_tokens // max(1, int(self.lengths.mean()))) * self.bucket_size_multiplier
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = indices[start:start + pool_size]
+            batches += self._split(pool[np.argsort(self.lengths[pool], kind='stable')])
+        # Shuffle batch order so lengths are not visited short to long.
+        self._batches = [batches[i] for i in rng.permutation(len(batches))]
+        return self._batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
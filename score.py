@@ -0,0 +1,119 @@
+# Import necessary libraries
+import argparse
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from backends import BACKENDS, load_backend
+from calibration import load_calibration
+from model_loader import load_tokenizer
+from truncation import TitledText, encode, load_truncation, normalize_item
+
+
+def score_texts(texts, tokenizer, backend, batch_size, temperature=1.0, budget=None, strategy="head"):
+    r"""
+    Classify a window of texts, batching texts of similar token length.
+
+    The probabilities are divided by the `temperature` fitted by
+    `calibration.py` before the softmax, and each text is cut to `budget`
+    tokens with `strategy`, the same way the server does.
+
+    Returns:
+      :obj:`Tuple[List[int], List[List[float]]]`: Predicted labels and class
+      probabilities, in the order of `texts`.
+
+    """
+
+    # Tokenize once without padding to know each text's length
+    encodings = encode(tokenizer, texts, budget or tokenizer.model_max_length, strategy)
+    order = sorted(range(len(texts)), key=lambda i: len(encodings[i]))
+
+    labels = [None] * len(texts)
+    probabilities = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        # Left-pad the batch to its longest text, which is close to its shortest
+        inputs = tokenizer.pad({'input_ids': [encodings[i] for i in rows]}, return_tensors="pt")
+        probs = torch.softmax(backend.logits(inputs).float() / temperature, dim=-1)
+        for row, label, prob in zip(rows, probs.argmax(dim=-1).tolist(), probs.tolist()):
+            labels[row] = label
+            probabilities[row] = prob
+
+    return labels, probabilities
+
+
+def normalize_row(title, paragraph):
+    # The same cleaning as the server's, a null field counting as empty; a
+    # row with no text at all is not scored
+    try:
+        return normalize_item(TitledText(title or "", paragraph or ""))
+    except ValueError:
+        return None
+
+
+def score(args):
+    # The tokenizer bundled with the checkpoint, as the server loads it
+    tokenizer = load_tokenizer(args.model_path, fallback=args.tokenizer)
+    backend = load_backend(args.backend, args.model_path)
+    temperature = load_calibration(args.model_path, backend)['temperature']
+    truncation = load_truncation(args.model_path, tokenizer.model_max_length)
+
+    source = pq.ParquetFile(args.input)
+    os.makedirs(args.output, exist_ok=True)
+    columns = ['title', 'paragraph'] + args.keep_columns
+
+    first_row = 0
+    for group in range(source.num_row_groups):
+        n_rows = source.metadata.row_group(group).num_rows
+        part_path = os.path.join(args.output, "part-%05d.parquet" % group)
+
+        # Row groups written by an earlier run are done, skip them
+        if os.path.exists(part_path):
+            print("Row group %d already scored, skipping." % group)
+            first_row += n_rows
+            continue
+
+        # Write to a temporary file and rename once the row group is complete
+        tmp_path = part_path + ".tmp"
+        writer = None
+        for batch in source.iter_batches(batch_size=args.window, row_groups=[group], columns=columns):
+            window = batch.to_pydict()
+            texts = [normalize_row(title, paragraph) for title, paragraph in zip(window['title'], window['paragraph'])]
+            scored = [i for i, text in enumerate(texts) if text is not None]
+            labels = [None] * len(texts)
+            probabilities = [None] * len(texts)
+            if scored:
+                scores = score_texts([texts[i] for i in scored], tokenizer, backend, args.batch_size, temperature,
+                                     truncation['budget'], truncation['strategy'])
+                for i, label, prob in zip(scored, *scores):
+                    labels[i] = label
+                    probabilities[i] = prob
+
+            result = {'row': list(range(first_row, first_row + len(texts))),
+                      'predicted_label': labels,
+                      'probabilities': probabilities}
+            result.update({column: window[column] for column in args.keep_columns})
+            table = pa.table(result)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            first_row += len(texts)
+
+        if writer is not None:
+            writer.close()
+            os.replace(tmp_path, part_path)
+        print("Scored row group %d/%d (%d rows)." % (group + 1, source.num_row_groups, n_rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify a parquet file of news in bounded memory.")
+    parser.add_argument("input", help="Parquet file with `title` and `paragraph` columns, e.g. query_resul.parquet.")
+    parser.add_argument("output", help="Directory the predictions are written to, one parquet part per input row group.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--tokenizer", default="gpt2", help="Tokenizer used when none is bundled with the checkpoint.")
+    parser.add_argument("--backend", default="eager", choices=list(BACKENDS))
+    parser.add_argument("--window", type=int, default=1024, help="Rows read, sorted and scored together.")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--keep-columns", nargs="*", default=[], help="Input columns copied to the output.")
+    args = parser.parse_args()
+    score(args)
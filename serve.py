@@ -0,0 +1,145 @@
+# Import necessary libraries
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import uvicorn
+
+
+def core_slices(workers):
+    r"""
+    Split the cores this process may run on into one slice per worker.
+
+    Workers get disjoint slices of `cores // workers` cores. With more workers
+    than cores, workers share single cores round robin.
+
+    """
+
+    cores = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cores) // workers)
+    return [cores[(i * size) % len(cores):(i * size) % len(cores) + size] for i in range(workers)]
+
+
+def bind_socket(host, port):
+    # One listening socket created before forking, every worker accepts on it
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, cores, args):
+    # Runs in the forked child: pin it to its cores, then serve until stopped
+    import torch
+    import main as app_module
+
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+        # Split this worker's cores between its inference threads
+        if app_module.inference_threads is None:
+            app_module.executor.threads_per_worker = max(1, len(cores) // app_module.executor.max_workers)
+
+    config = uvicorn.Config(app_module.app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(args):
+    r"""
+    Load the model once, then fork the workers that serve it.
+
+    Loading in the parent means the workers share the weight pages: the
+    memory-mapped fp32 weights through the page cache, and in-memory weights
+    (the `int8` backend) copy-on-write, since inference never writes them.
+    `gc.freeze` moves everything allocated so far out of the garbage
+    collector's reach, so collections in the workers do not write to those
+    objects and unshare their pages. Each worker runs its own event loop and
+    GIL on its own slice of the cores, and workers that die are forked again
+    from the loaded parent.
+
+    """
+
+    import main as app_module
+
+    # onnxruntime sessions start threads that do not survive a fork, so each
+    # worker creates its own session instead.
+    if app_module.model_backend != "onnx":
+        app_module.load_weights()
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    slices = core_slices(args.workers) if args.pin else [None] * args.workers
+
+    workers = {}
+
+    def fork_worker(index):
+        pid = os.fork()
+        if pid == 0:
+            # Leave signal handling to uvicorn in the child
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # Until the server's own handler reloads the model on SIGHUP
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            try:
+                run_worker(sock, slices[index], args)
+            finally:
+                os._exit(0)
+        workers[pid] = index
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(signum, frame):
+        # Every worker loads MODEL_PATH again and swaps it in
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+
+    for index in range(args.workers):
+        fork_worker(index)
+    print("Serving on %s:%d with %d workers, cores: %s" % (args.host, args.port, args.workers, slices), flush=True)
+
+    # Wait for the workers, replacing any that exit before shutdown
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is not None and not stopping:
+            print("Worker %d (pid %d) exited with status %d, restarting." % (index, pid, status), file=sys.stderr, flush=True)
+            fork_worker(index)
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the classifier from several forked workers sharing one model.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVE_WORKERS", "1")))
+    parser.add_argument("--no-pin", dest="pin", action="store_false", help="Do not pin workers to cores.")
+    parser.add_argument("--keep-alive", type=int, default=5, help="Seconds idle connections are kept open.")
+    parser.add_argument("--log-level", default="info")
+    main(parser.parse_args())
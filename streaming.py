@@ -0,0 +1,155 @@
+# Import necessary libraries
+import codecs
+import json
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from truncation import TitledText
+
+# Used to decode one JSON value at a time from a growing buffer
+_decoder = json.JSONDecoder()
+_whitespace = " \t\r\n"
+
+
+def _to_text(item):
+    # Items are either plain strings or objects with a `text` field, and
+    # optionally the `title` of that text
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict) and isinstance(item.get("text"), str):
+        title = item.get("title")
+        if title is None or title == "":
+            return item["text"]
+        if not isinstance(title, str):
+            raise ValueError("The `title` of an item must be a string.")
+        return TitledText(title, item["text"])
+    raise ValueError("Each item must be a string or an object with a `text` string.")
+
+
+async def _iter_decoded(chunks):
+    # Decode the body bytes as UTF-8 without splitting multi-byte characters
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def _iter_json_array(pieces, buffer):
+    # Skip the opening bracket, then decode one element at a time
+    buffer = buffer.lstrip(_whitespace)[1:]
+    exhausted = False
+    while True:
+        buffer = buffer.lstrip(_whitespace + ",")
+        if buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                item, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise ValueError("Request body is not a valid JSON array.")
+            else:
+                yield _to_text(item)
+                buffer = buffer[end:]
+                continue
+        elif exhausted:
+            raise ValueError("JSON array is missing its closing bracket.")
+
+        # Read more of the body to complete the current element
+        try:
+            buffer += await pieces.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+
+
+async def _iter_ndjson(pieces, buffer):
+    # Decode one JSON value per non-empty line
+    while True:
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                yield _to_text(json.loads(line))
+        try:
+            buffer += await pieces.__anext__()
+        except StopAsyncIteration:
+            break
+    if buffer.strip():
+        yield _to_text(json.loads(buffer))
+
+
+async def iter_texts(chunks):
+    r"""
+    Parse texts from a request body as it arrives.
+
+    The body is either a JSON array or NDJSON (one value per line). Each value
+    is a string or an object with a `text` field. Only the element being
+    parsed is kept in memory, so memory does not grow with the body size.
+
+    Arguments:
+
+      chunks (:obj:`AsyncIterator[bytes]`):
+          Raw body chunks, e.g. `request.stream()`.
+
+    Returns:
+      :obj:`AsyncIterator[str]`: Texts in the order they appear in the body.
+
+    """
+
+    pieces = _iter_decoded(chunks)
+    buffer = ""
+
+    # Read until the first character tells us which format is used
+    async for piece in pieces:
+        buffer += piece
+        if buffer.strip(_whitespace):
+            break
+
+    if not buffer.strip(_whitespace):
+        return
+    parse = _iter_json_array if buffer.lstrip(_whitespace).startswith("[") else _iter_ndjson
+    async for text in parse(pieces, buffer):
+        yield text
+
+
+async def iter_chunks(texts, chunk_size):
+    # Group an async stream of texts into lists of at most `chunk_size`. When
+    # an item is malformed, the texts parsed before it are still yielded, so
+    # the error is reported at its own index
+    chunk = []
+    try:
+        async for text in texts:
+            chunk.append(text)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    except ValueError:
+        if chunk:
+            yield chunk
+        raise
+    if chunk:
+        yield chunk
+
+
+class BodyStreamingResponse(StreamingResponse):
+    r"""
+    Streaming response whose generator is still reading the request body.
+
+    `StreamingResponse` normally listens for a client disconnect while it
+    streams, and that listener consumes the request body messages the
+    generator is waiting for. This response only streams; a disconnect shows
+    up as a failed send instead.
+
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
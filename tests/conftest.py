@@ -0,0 +1,31 @@
+# Import necessary libraries
+import os
+import sys
+import pytest
+
+# The modules are at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# GPT-2's vocabulary and merges, see `test_tokenization.py`
+GPT2_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gpt2")
+
+
+@pytest.fixture(scope="session")
+def checkpoint(tmp_path_factory):
+    # A tiny randomly initialized classifier saved with GPT-2's tokenizer, in
+    # the layout `gpt2.py` writes, with a token budget its positions fit
+    import torch
+    from transformers import GPT2Config, GPT2ForSequenceClassification
+    from tokenization import load_gpt2_tokenizer
+
+    path = str(tmp_path_factory.mktemp("checkpoint"))
+    torch.manual_seed(0)
+    config = GPT2Config(n_embd=16, n_layer=2, n_head=2, n_positions=64, num_labels=3,
+                        id2label={0: "business", 1: "politics", 2: "sports"},
+                        label2id={"business": 0, "politics": 1, "sports": 2})
+    config.pad_token_id = config.eos_token_id
+    config.token_budget = 32
+    config.truncation_strategy = "head"
+    GPT2ForSequenceClassification(config).save_pretrained(path)
+    load_gpt2_tokenizer(GPT2_DIR).save_pretrained(path)
+    return path
@@ -0,0 +1,126 @@
+# Import necessary libraries
+import asyncio
+import threading
+import pytest
+from batching import MicroBatcher
+from executor import BoundedExecutor, Overloaded
+
+
+class Recorder(object):
+    # Predict function that remembers the batches it was called with.
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.release = release
+
+    def __call__(self, texts):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batches.append(list(texts))
+        return [text.upper() for text in texts]
+
+
+async def with_batcher(predict_fn, body, **kwargs):
+    executor = BoundedExecutor(max_workers=kwargs.pop("max_workers", 1))
+    batcher = MicroBatcher(predict_fn, executor, **kwargs)
+    await batcher.start()
+    try:
+        return await body(batcher)
+    finally:
+        await batcher.stop()
+        executor.shutdown()
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    predict = Recorder()
+
+    async def body(batcher):
+        return await asyncio.gather(*[batcher.submit(text) for text in ["a", "b", "c"]])
+
+    results = asyncio.run(with_batcher(predict, body, max_batch_size=8, max_wait_ms=50))
+    # Every caller gets its own result back
+    assert results == ["A", "B", "C"]
+    assert predict.batches == [["a", "b", "c"]]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    predict = Recorder()
+
+    async def body(batcher):
+        results = await asyncio.gather(*[batcher.submit(str(i)) for i in range(5)])
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(with_batcher(predict, body, max_batch_size=2, max_wait_ms=50))
+    assert results == ["0", "1", "2", "3", "4"]
+    assert [len(batch) for batch in predict.batches] == [2, 2, 1]
+    assert stats["batch_size_histogram"]["count"] == 3
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    predict = Recorder()
+
+    async def body(batcher):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await batcher.submit("a")
+        return result, loop.time() - start
+
+    result, elapsed = asyncio.run(with_batcher(predict, body, max_batch_size=8, max_wait_ms=20))
+    assert result == "A"
+    assert elapsed < 1.0
+    assert predict.batches == [["a"]]
+
+
+def test_full_queue_raises_overloaded():
+    release = threading.Event()
+    predict = Recorder(release)
+
+    async def body(batcher):
+        # The first request holds the only worker, the next two fill the queue
+        first = asyncio.ensure_future(batcher.submit("a"))
+        while not batcher.executor.full():
+            await asyncio.sleep(0.01)
+        queued = [asyncio.ensure_future(batcher.submit(text)) for text in ["b", "c"]]
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            await batcher.submit("d")
+        release.set()
+        return await asyncio.gather(first, *queued)
+
+    results = asyncio.run(with_batcher(predict, body, max_batch_size=1, max_wait_ms=1, max_queue_size=2))
+    assert results == ["A", "B", "C"]
+    assert ["d"] not in predict.batches
+
+
+def test_errors_reach_every_caller_in_the_batch():
+
+    def predict(texts):
+        raise RuntimeError("model failed")
+
+    async def body(batcher):
+        return await asyncio.gather(*[batcher.submit(text) for text in ["a", "b"]], return_exceptions=True)
+
+    results = asyncio.run(with_batcher(predict, body, max_batch_size=8, max_wait_ms=50))
+    assert [str(result) for result in results] == ["model failed", "model failed"]
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_requests_are_not_run():
+    release = threading.Event()
+    predict = Recorder(release)
+
+    async def body(batcher):
+        first = asyncio.ensure_future(batcher.submit("a"))
+        while not batcher.executor.full():
+            await asyncio.sleep(0.01)
+        # These wait behind the busy worker, one caller goes away meanwhile
+        gone = asyncio.ensure_future(batcher.submit("b"))
+        kept = asyncio.ensure_future(batcher.submit("c"))
+        await asyncio.sleep(0.01)
+        gone.cancel()
+        release.set()
+        return await asyncio.gather(first, kept)
+
+    results = asyncio.run(with_batcher(predict, body, max_batch_size=8, max_wait_ms=1))
+    assert results == ["A", "C"]
+    assert predict.batches == [["a"], ["c"]]
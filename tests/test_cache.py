@@ -0,0 +1,133 @@
+# Import necessary libraries
+import asyncio
+import os
+import pytest
+import cache
+from cache import PredictionCache, checkpoint_fingerprint
+
+
+class Clock(object):
+    # Stand-in for `time.monotonic` that only moves when told to.
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_normalize_text_and_separate_checkpoints():
+    predictions = PredictionCache("a")
+    assert predictions.key("Oil  prices\n rise ") == predictions.key("Oil prices rise")
+    # Composed and decomposed accents are the same text
+    assert predictions.key("Cafe\u0301") == predictions.key("Caf\u00e9")
+    # Case is kept, and another checkpoint never shares an entry
+    assert predictions.key("oil prices rise") != predictions.key("Oil prices rise")
+    assert predictions.key("Oil prices rise", "b") != predictions.key("Oil prices rise")
+
+
+def test_least_recently_used_entries_are_evicted():
+    predictions = PredictionCache("a", max_entries=2)
+    predictions.put("x", 1)
+    predictions.put("y", 2)
+    assert predictions.get("x") == 1
+    predictions.put("z", 3)
+    # `y` was used least recently
+    assert predictions.get("y") is None
+    assert (predictions.get("x"), predictions.get("z")) == (1, 3)
+    assert predictions.stats()["size"] == 2
+
+    disabled = PredictionCache("a", max_entries=0)
+    disabled.put("x", 1)
+    assert disabled.get("x") is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    predictions = PredictionCache("a", ttl=10)
+    predictions.put("x", 1)
+    clock.now += 9.9
+    assert predictions.lookup("x") == 1
+    clock.now += 0.1
+    assert predictions.lookup("x") is None
+    assert predictions.stats() == {"hits": 1, "misses": 1, "coalesced": 0, "size": 0}
+
+    # Without a ttl entries stay until evicted
+    forever = PredictionCache("a")
+    forever.put("x", 1)
+    clock.now += 1e9
+    assert forever.get("x") == 1
+
+
+def test_identical_requests_share_one_computation():
+    predictions = PredictionCache("a")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "label"
+
+    async def run():
+        key = predictions.key("Oil prices rise")
+        results = await asyncio.gather(*[predictions.get_or_compute(key, compute) for _ in range(5)])
+        # Once done, the value comes from the cache
+        results.append(await predictions.get_or_compute(key, compute))
+        return results
+
+    assert asyncio.run(run()) == ["label"] * 6
+    assert len(calls) == 1
+    assert predictions.stats() == {"hits": 1, "misses": 1, "coalesced": 4, "size": 1}
+
+
+def test_a_caller_leaving_does_not_cancel_the_others():
+    predictions = PredictionCache("a")
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "label"
+
+    async def run():
+        first = asyncio.ensure_future(predictions.get_or_compute("x", compute))
+        second = asyncio.ensure_future(predictions.get_or_compute("x", compute))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "label"
+    assert predictions.get("x") == "label"
+
+
+def test_failures_are_not_cached():
+    predictions = PredictionCache("a")
+    outcomes = [RuntimeError("model failed"), "label"]
+
+    async def compute():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await predictions.get_or_compute("x", compute)
+        return await predictions.get_or_compute("x", compute)
+
+    assert asyncio.run(run()) == "label"
+    assert predictions.stats()["misses"] == 2
+
+
+def test_fingerprint_changes_with_the_checkpoint_files(tmp_path):
+    with open(tmp_path / "model.safetensors", "wb") as f:
+        f.write(b"weights")
+    fingerprint = checkpoint_fingerprint(str(tmp_path))
+    assert checkpoint_fingerprint(str(tmp_path)) == fingerprint
+
+    # New weights written in place give a new fingerprint
+    stat = os.stat(tmp_path / "model.safetensors")
+    with open(tmp_path / "model.safetensors", "wb") as f:
+        f.write(b"WEIGHTS")
+    os.utime(tmp_path / "model.safetensors", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert checkpoint_fingerprint(str(tmp_path)) != fingerprint
+    assert len(fingerprint) == 16
@@ -0,0 +1,101 @@
+# Import necessary libraries
+import os
+import pytest
+import torch
+from transformers import GPT2Config, GPT2ForSequenceClassification, get_linear_schedule_with_warmup
+import checkpointing
+from checkpointing import Checkpointer
+
+
+def training_state(seed=0):
+    torch.manual_seed(seed)
+    config = GPT2Config(n_embd=16, n_layer=2, n_head=2, n_positions=32, vocab_size=64, num_labels=3, pad_token_id=0)
+    model = GPT2ForSequenceClassification(config)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-2)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=2, num_training_steps=10)
+    return model, optimizer, scheduler
+
+
+def train_steps(model, optimizer, scheduler, count):
+    # Steps drawing their data and dropout from the global generators
+    losses = []
+    model.train()
+    for _ in range(count):
+        input_ids = torch.randint(1, 64, (4, 12))
+        labels = torch.randint(0, 3, (4,))
+        loss = model(input_ids=input_ids, labels=labels).loss
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad()
+        losses.append(loss.item())
+    return losses
+
+
+def test_resumed_training_matches_uninterrupted_training(tmp_path):
+    model, optimizer, scheduler = training_state()
+    checkpointer = Checkpointer(str(tmp_path))
+    train_steps(model, optimizer, scheduler, 3)
+    checkpointer.save(3, model, optimizer, scheduler, {'epoch': 0, 'batch': 3})
+    saved_lr = scheduler.get_last_lr()
+    # Training goes on while the checkpoint is written
+    expected = train_steps(model, optimizer, scheduler, 3)
+    checkpointer.close()
+
+    # A fresh process with other weights and random state
+    resumed, resumed_optimizer, resumed_scheduler = training_state(seed=1)
+    step, position = Checkpointer(str(tmp_path)).restore(checkpointer.latest(), resumed, resumed_optimizer, resumed_scheduler)
+    assert (step, position) == (3, {'epoch': 0, 'batch': 3})
+    assert resumed_scheduler.get_last_lr() == saved_lr
+    assert train_steps(resumed, resumed_optimizer, resumed_scheduler, 3) == pytest.approx(expected, abs=1e-6)
+    for name, tensor in model.state_dict().items():
+        torch.testing.assert_close(resumed.state_dict()[name], tensor)
+
+
+def test_checkpoints_are_servable_and_only_the_last_are_kept(tmp_path):
+    model, optimizer, scheduler = training_state()
+    checkpointer = Checkpointer(str(tmp_path), keep_last=2)
+    for step in range(1, 5):
+        train_steps(model, optimizer, scheduler, 1)
+        checkpointer.save(step, model, optimizer, scheduler, {'epoch': 0, 'batch': step})
+    checkpointer.close()
+
+    assert [os.path.basename(path) for path in checkpointer.checkpoints()] == ["checkpoint-3", "checkpoint-4"]
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint-3", "checkpoint-4"]
+    # The model files load without the trainer
+    loaded = GPT2ForSequenceClassification.from_pretrained(checkpointer.latest())
+    for name, tensor in model.state_dict().items():
+        torch.testing.assert_close(loaded.state_dict()[name], tensor)
+
+
+def test_a_failed_write_leaves_the_previous_checkpoint(tmp_path, monkeypatch):
+    model, optimizer, scheduler = training_state()
+    checkpointer = Checkpointer(str(tmp_path))
+    train_steps(model, optimizer, scheduler, 1)
+    checkpointer.save(1, model, optimizer, scheduler, {'epoch': 0, 'batch': 1})
+    checkpointer.wait()
+    before = sorted(os.listdir(os.path.join(tmp_path, "checkpoint-1")))
+
+    # Crash halfway through writing the next checkpoint
+    save_file = checkpointing.save_file
+
+    def crash(tensors, path, metadata=None):
+        if os.path.basename(path) == "optimizer.safetensors":
+            raise OSError("No space left on device")
+        save_file(tensors, path, metadata=metadata)
+
+    monkeypatch.setattr(checkpointing, "save_file", crash)
+    checkpointer.save(2, model, optimizer, scheduler, {'epoch': 0, 'batch': 2})
+    with pytest.raises(OSError):
+        checkpointer.wait()
+
+    # The partial write is never picked up for resuming
+    assert os.path.isdir(os.path.join(tmp_path, "checkpoint-2.tmp"))
+    assert checkpointer.latest() == os.path.join(str(tmp_path), "checkpoint-1")
+    assert sorted(os.listdir(checkpointer.latest())) == before
+
+    # The next save starts over and replaces the partial write
+    monkeypatch.undo()
+    checkpointer.save(2, model, optimizer, scheduler, {'epoch': 0, 'batch': 2})
+    checkpointer.close()
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint-1", "checkpoint-2"]
@@ -0,0 +1,97 @@
+# Import necessary libraries
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from data import (SPLITS_META_FILE, drop_duplicate_rows, encode_labels, load_splits, prepare_splits,
+                  preprocess_column, preprocess_text, repair_texts)
+
+LABELS = ["business", "politics", "sports"]
+
+
+def news(count=600, seed=0):
+    # Rows with exact duplicates, some spread over several read batches
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({"title": ["Title %d: News!" % i for i in range(count)],
+                          "paragraph": ["Paragraph %d, more – text é" % i for i in range(count)],
+                          "news_list": [LABELS[i] for i in rng.integers(0, 3, size=count)],
+                          "event_timestamp": pd.Timestamp("2022-01-01") + pd.to_timedelta(np.arange(count), unit="s")})
+    duplicates = frame.iloc[rng.integers(0, count, size=60)]
+    return pd.concat([frame, duplicates], ignore_index=True)
+
+
+def test_columns_are_cleaned_like_row_by_row():
+    values = pd.Series(["Oil Prices RISE!", "naïve Café, 東京", "", "tabs\tand\nnew lines", "x_y-z"], index=[5, 3, 9, 1, 0])
+    cleaned = preprocess_column(values)
+    assert cleaned.index.tolist() == [5, 3, 9, 1, 0]
+    assert cleaned.tolist() == [preprocess_text(value) for value in values]
+
+
+def test_duplicate_rows_are_dropped_in_order():
+    frame = news()
+    assert drop_duplicate_rows(frame).equals(frame.drop_duplicates())
+
+
+def test_unknown_labels_are_an_error():
+    assert encode_labels(LABELS, pd.Series(["sports", "business"])).tolist() == [2, 0]
+    with pytest.raises(ValueError, match="1 labels are not among the 3 training labels: weather"):
+        encode_labels(LABELS, pd.Series(["sports", "weather"]))
+
+
+def test_prepared_splits_are_deduplicated_and_stratified(tmp_path):
+    frame = news()
+    # Rows without a label are dropped, not given a label of their own
+    frame.loc[[7, 8], "news_list"] = None
+    source = str(tmp_path / "news.parquet")
+    frame.to_parquet(source, index=False)
+
+    meta = prepare_splits(source, str(tmp_path / "splits"), test_size=0.3, batch_size=64)
+    train_data, test_data = load_splits(str(tmp_path / "splits"))
+    unique = frame.drop_duplicates().dropna(subset=["news_list"])
+
+    assert meta["rows"] == len(frame)
+    assert meta["unlabeled"] == 2
+    assert meta["duplicates"] == len(frame) - len(frame.drop_duplicates())
+    assert (meta["train"], meta["test"]) == (len(train_data), len(test_data))
+    assert len(train_data) + len(test_data) == len(unique)
+    # No row is in both splits, or twice in one
+    texts = pd.concat([train_data["text"], test_data["text"]])
+    assert texts.is_unique
+    # Every label is split at the test size
+    counts = unique["news_list"].value_counts()
+    for label in LABELS:
+        assert meta["test_by_label"][label] == round(counts[label] * 0.3)
+        assert (test_data["news_list"] == label).sum() == meta["test_by_label"][label]
+
+    # Same preprocessing as `load_splits` of a parquet file
+    assert list(train_data.columns) == ["title", "paragraph", "news_list", "text"]
+    row = train_data.iloc[0]
+    assert row["title"] == preprocess_text(row["title"]) and row["title"].startswith("title ")
+    assert row["text"] == row["title"] + " " + row["paragraph"]
+    with open(os.path.join(tmp_path, "splits", SPLITS_META_FILE)) as f:
+        assert json.load(f) == meta
+
+
+def test_split_does_not_depend_on_row_order_or_batch_size(tmp_path):
+    frame = news()
+    frame.to_parquet(tmp_path / "a.parquet", index=False)
+    frame.sample(frac=1.0, random_state=1).to_parquet(tmp_path / "b.parquet", index=False)
+    prepare_splits(str(tmp_path / "a.parquet"), str(tmp_path / "a"), batch_size=50)
+    prepare_splits(str(tmp_path / "b.parquet"), str(tmp_path / "b"), batch_size=1000)
+
+    _, first = load_splits(str(tmp_path / "a"))
+    _, second = load_splits(str(tmp_path / "b"))
+    assert sorted(first["text"]) == sorted(second["text"])
+
+    # Another seed picks other test rows
+    prepare_splits(str(tmp_path / "a.parquet"), str(tmp_path / "c"), random_state=7)
+    _, other = load_splits(str(tmp_path / "c"))
+    assert sorted(first["text"]) != sorted(other["text"])
+
+
+def test_texts_are_repaired_in_order_across_processes():
+    texts = ["The Mona Lisa doesnÃ¢â‚¬â„¢t have eyebrows. %d" % i for i in range(50)]
+    repaired = repair_texts(texts, workers=2, chunk_size=10)
+    assert repaired == repair_texts(texts, workers=1)
+    assert repaired[3] == "The Mona Lisa doesn't have eyebrows. 3"
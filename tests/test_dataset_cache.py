@@ -0,0 +1,63 @@
+# Import necessary libraries
+import os
+import pytest
+from data import load_splits
+from dataset_cache import bucket_dataloader, load_tokenized_splits
+from tokenization import load_gpt2_tokenizer
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "query_resul.parquet")
+
+
+@pytest.fixture(scope="module")
+def tokenizer(checkpoint):
+    return load_gpt2_tokenizer(checkpoint)
+
+
+def test_splits_match_load_splits(tokenizer, checkpoint, tmp_path):
+    splits = load_tokenized_splits(DATA, tokenizer, str(tmp_path), checkpoint, limit=40)
+    train_data, test_data = load_splits(DATA)
+
+    assert splits['train_data']['text'].tolist() == train_data['text'][:40].tolist()
+    assert splits['test_data']['text'].tolist() == test_data['text'][:40].tolist()
+    # Both splits use the label ids of the training split
+    assert splits['classes'] == sorted(train_data['news_list'][:40].unique())
+    assert splits['train'].classes == splits['valid'].classes == splits['classes']
+    assert len(splits['train']) == len(splits['valid']) == 40
+    first = splits['valid'][0]
+    assert list(first['input_ids']) == tokenizer(test_data['text'].iloc[0])['input_ids']
+    assert splits['classes'][first['label']] == test_data['news_list'].iloc[0]
+
+
+def test_collator_follows_the_checkpoint_unless_overridden(tokenizer, checkpoint, tmp_path):
+    # The fixture checkpoint was trained with a budget of 32 and `head`
+    collator = load_tokenized_splits(DATA, tokenizer, str(tmp_path), checkpoint, limit=10, splits=())['collator']
+    assert (collator.max_sequence_len, collator.strategy) == (32, "head")
+
+    collator = load_tokenized_splits(DATA, tokenizer, str(tmp_path), checkpoint, max_length=16, strategy="tail",
+                                     limit=10, splits=())['collator']
+    assert (collator.max_sequence_len, collator.strategy) == (16, "tail")
+
+    # A hub name has no saved truncation
+    collator = load_tokenized_splits(DATA, tokenizer, str(tmp_path), "gpt2", limit=10, splits=())['collator']
+    assert (collator.max_sequence_len, collator.strategy) == (tokenizer.model_max_length, "head")
+
+
+def test_only_the_requested_splits_are_tokenized(tokenizer, checkpoint, tmp_path):
+    splits = load_tokenized_splits(DATA, tokenizer, str(tmp_path), checkpoint, limit=10, splits=('valid',))
+    assert 'train' not in splits and 'valid' in splits
+    assert [name.split('-')[0] for name in os.listdir(tmp_path)] == ['valid']
+
+    assert 'valid' not in load_tokenized_splits(DATA, tokenizer, None, checkpoint, limit=10, splits=())
+
+
+def test_bucket_dataloader_covers_every_example_once(tokenizer, checkpoint, tmp_path):
+    splits = load_tokenized_splits(DATA, tokenizer, str(tmp_path), checkpoint, limit=40, splits=('train',))
+    dataloader = bucket_dataloader(splits['train'], splits['collator'], batch_size=8, shuffle=True, seed=1)
+
+    for epoch in range(2):
+        dataloader.batch_sampler.set_epoch(epoch)
+        indices = sorted(i for batch in dataloader.batch_sampler for i in batch)
+        assert indices == list(range(40))
+    for batch in dataloader:
+        assert batch['input_ids'].shape[1] <= 32
+        assert batch['input_ids'].shape == batch['attention_mask'].shape
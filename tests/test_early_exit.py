@@ -0,0 +1,38 @@
+# Import necessary libraries
+import json
+import os
+import shutil
+import torch
+from backends import EagerBackend, EarlyExitBackend, load_backend
+from calibration import CALIBRATION_FILE, load_calibration
+from early_exit import EarlyExitClassifier
+from tokenization import load_gpt2_tokenizer
+
+TEXTS = ["Oil prices rise as OPEC agrees to cut output", "The team won the final", "Votes are counted"]
+
+
+def test_exit_logits_are_served_at_temperature_one(checkpoint, tmp_path):
+    # The full model's fitted temperature, and different ones for the exits
+    path = str(tmp_path / "checkpoint")
+    shutil.copytree(checkpoint, path)
+    with open(os.path.join(path, CALIBRATION_FILE), "w") as f:
+        json.dump({"temperature": 2.0, "labels": ["business", "politics", "sports"]}, f)
+    early_exit = EarlyExitClassifier(EagerBackend(path).model, [1])
+    early_exit.temperatures.copy_(torch.tensor([3.0, 2.0]))
+    # No exit is ever confident enough, so every text runs all blocks
+    early_exit.threshold = 1.01
+    early_exit.save(path)
+
+    tokenizer = load_gpt2_tokenizer(path)
+    inputs = tokenizer(TEXTS, padding=True, return_tensors="pt")
+    eager = load_backend("eager", path)
+    backend = load_backend("early-exit", path)
+
+    assert backend.calibrated and not eager.calibrated
+    assert load_calibration(path, backend)["temperature"] == 1.0
+    assert load_calibration(path, eager)["temperature"] == 2.0
+    # The served probabilities are the same either way
+    expected = (eager.logits(inputs) / 2.0).softmax(dim=-1)
+    actual = (backend.logits(inputs) / load_calibration(path, backend)["temperature"]).softmax(dim=-1)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+    assert backend.stats()["average_layers"] == 2
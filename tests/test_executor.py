@@ -0,0 +1,99 @@
+# Import necessary libraries
+import asyncio
+import threading
+from types import SimpleNamespace
+import httpx
+import pytest
+import main
+from executor import BoundedExecutor, Overloaded
+
+
+def test_event_loop_keeps_running_during_inference():
+    release = threading.Event()
+    executor = BoundedExecutor(max_workers=1)
+
+    async def run():
+        work = asyncio.ensure_future(executor.run(release.wait, 5))
+        # The loop still answers while the worker is blocked
+        ticks = 0
+        while ticks < 5:
+            await asyncio.sleep(0.001)
+            ticks += 1
+        release.set()
+        return await work, ticks
+
+    assert asyncio.run(run()) == (True, 5)
+    executor.shutdown()
+
+
+def test_busy_workers_raise_overloaded_unless_blocking():
+    release = threading.Event()
+    executor = BoundedExecutor(max_workers=2)
+
+    async def run():
+        assert not executor.full()
+        busy = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)]
+        while not executor.full():
+            await asyncio.sleep(0.001)
+        with pytest.raises(Overloaded):
+            await executor.run(sum, [1, 2])
+        # A blocking call waits for a free worker instead
+        waiting = asyncio.ensure_future(executor.run(sum, [1, 2], block=True))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        release.set()
+        return await asyncio.gather(*busy, waiting)
+
+    assert asyncio.run(run()) == [True, True, 3]
+    assert not executor.full()
+    executor.shutdown()
+
+
+def test_slot_is_freed_when_the_caller_goes_away():
+    release = threading.Event()
+    finished = threading.Event()
+    executor = BoundedExecutor(max_workers=1)
+
+    def work():
+        release.wait(5)
+        finished.set()
+
+    async def run():
+        caller = asyncio.ensure_future(executor.run(work))
+        while not executor.full():
+            await asyncio.sleep(0.001)
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        # The thread is still running, so the slot is still taken
+        assert executor.full()
+        release.set()
+        while executor.full():
+            await asyncio.sleep(0.001)
+        return await executor.run(sum, [1, 2])
+
+    assert asyncio.run(run()) == 3
+    assert finished.is_set()
+    executor.shutdown()
+
+
+def test_endpoints_answer_503_when_overloaded(monkeypatch):
+    monkeypatch.setattr(main, "model_ready", True)
+    monkeypatch.setattr(main.registry, "active", SimpleNamespace(fingerprint="0" * 16))
+
+    async def overloaded(request):
+        raise Overloaded("256 requests are already waiting.")
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # No more room in the micro-batcher queue
+            monkeypatch.setattr(main.batcher, "submit", overloaded)
+            single = await client.get("/predict", params={"text": "Votes are counted"})
+            # Every worker busy, bulk work is refused before reading the body
+            monkeypatch.setattr(main.executor, "full", lambda: True)
+            bulk = await client.post("/predict_batch", content=b'"Votes are counted"\n')
+            return single, bulk
+
+    single, bulk = asyncio.run(run())
+    assert single.status_code == 503 and single.json()["detail"] == "256 requests are already waiting."
+    assert bulk.status_code == 503 and bulk.json()["detail"] == "All inference workers are busy."
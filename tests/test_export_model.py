@@ -0,0 +1,42 @@
+# Import necessary libraries
+import argparse
+import os
+import shutil
+import pytest
+import export_model
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "query_resul.parquet")
+
+
+@pytest.fixture(scope="module")
+def converted(checkpoint, tmp_path_factory):
+    # The fixture checkpoint with its ONNX graph and int8 model saved next to it
+    path = str(tmp_path_factory.mktemp("converted") / "checkpoint")
+    shutil.copytree(checkpoint, path)
+    for command in ("onnx", "int8"):
+        export_model.convert(argparse.Namespace(command=command, model_path=path))
+    return path
+
+
+def verify_args(path, backend):
+    return argparse.Namespace(backend=backend, model_path=path, tokenizer=path, data=DATA, limit=24, batch_size=8,
+                              min_agreement=0.9, max_prob_diff=0.05)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "int8"])
+def test_verify_feeds_served_inputs(converted, backend, capsys, monkeypatch):
+    # Every batch is cut to the checkpoint's budget of 32 tokens; whole texts
+    # would not even fit the 64 positions of the fixture model
+    lengths = []
+    encode = export_model.encode
+
+    def recording_encode(*args, **kwargs):
+        ids = encode(*args, **kwargs)
+        lengths.extend(len(row) for row in ids)
+        return ids
+
+    monkeypatch.setattr(export_model, "encode", recording_encode)
+    export_model.verify(verify_args(converted, backend))
+
+    assert len(lengths) == 24 and max(lengths) == 32
+    assert "backend: %s - examples: 24" % backend in capsys.readouterr().out
@@ -0,0 +1,50 @@
+# Import necessary libraries
+import numpy as np
+import torch
+from transformers import GPT2ForSequenceClassification
+from model_loader import load_mmap_model
+from prune import importance_scores, pruned_model, pruning_levels
+
+
+def batches(n_batches=3, batch_size=4, length=10, n_labels=3, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [{'input_ids': torch.randint(0, 1000, (batch_size, length), generator=generator),
+             'attention_mask': torch.ones(batch_size, length, dtype=torch.long),
+             'labels': torch.randint(0, n_labels, (batch_size,), generator=generator)} for _ in range(n_batches)]
+
+
+def test_importance_scores_cover_neurons_and_blocks_only(checkpoint):
+    model = load_mmap_model(checkpoint)
+    before = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+    scores = importance_scores(model, batches(), torch.nn.CrossEntropyLoss(), torch.device('cpu'))
+
+    assert set(scores) == {'neurons', 'layers'}
+    assert scores['neurons'].shape == (2, 4 * 16) and scores['layers'].shape == (2,)
+    assert (scores['layers'] > 0).all()
+    # Scoring leaves the weights as they were
+    assert all(torch.equal(before[name], tensor) for name, tensor in model.state_dict().items())
+
+
+def test_pruned_model_keeps_the_most_important_parts(checkpoint, tmp_path):
+    model = load_mmap_model(checkpoint)
+    scores = {'layers': np.array([0.5, 0.1]), 'neurons': np.tile(np.arange(64, dtype=float), (2, 1))}
+    pruned = pruned_model(model, scores, drop_layers=1, ffn_keep=0.25)
+
+    assert (pruned.config.n_layer, pruned.config.n_inner, pruned.config.n_head) == (1, 16, 2)
+    # Block 0 is kept, with its 16 highest scoring neurons in their order
+    kept = pruned.transformer.h[0].mlp
+    torch.testing.assert_close(kept.c_fc.weight, model.transformer.h[0].mlp.c_fc.weight[:, 48:])
+    torch.testing.assert_close(kept.c_proj.weight, model.transformer.h[0].mlp.c_proj.weight[48:])
+    torch.testing.assert_close(pruned.transformer.h[0].attn.c_attn.weight, model.transformer.h[0].attn.c_attn.weight)
+
+    # A plain checkpoint: it loads back and gives the same logits
+    pruned.save_pretrained(str(tmp_path))
+    batch = batches(n_batches=1)[0]
+    with torch.no_grad():
+        expected = pruned(input_ids=batch['input_ids'], attention_mask=batch['attention_mask']).logits
+        loaded = GPT2ForSequenceClassification.from_pretrained(str(tmp_path)).eval()
+        torch.testing.assert_close(loaded(input_ids=batch['input_ids'], attention_mask=batch['attention_mask']).logits, expected)
+
+
+def test_pruning_levels():
+    assert pruning_levels([0, 1, 2], [1.0, 0.5], n_layer=2) == [(0, 0.5), (1, 1.0), (1, 0.5)]
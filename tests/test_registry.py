@@ -0,0 +1,197 @@
+# Import necessary libraries
+import asyncio
+import os
+import threading
+import time
+import pytest
+from cache import checkpoint_fingerprint
+from registry import ModelRegistry, ShadowScorer
+
+
+class FakeModel(object):
+    # What the registry and the shadow need from a `ServedModel`.
+
+    def __init__(self, path, label_names=("business", "politics", "sports")):
+        self.path = path
+        self.fingerprint = checkpoint_fingerprint(path)
+        self.label_names = list(label_names)
+        self.warm = False
+
+    def label(self, label_id):
+        return self.label_names[label_id]
+
+    def describe(self):
+        return {"model_path": self.path, "fingerprint": self.fingerprint}
+
+
+def make_checkpoints(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / ("epoch-%d" % i)
+        path.mkdir()
+        (path / "config.json").write_text("{}")
+        paths.append(str(path))
+    return paths
+
+
+def make_registry(max_resident=2):
+    loaded = []
+
+    def load(path):
+        loaded.append(path)
+        return FakeModel(path)
+
+    def warm_up(model):
+        model.warm = True
+
+    return ModelRegistry(load, warm_up, max_resident=max_resident), loaded
+
+
+def test_swaps_reuse_resident_models(tmp_path):
+    first, second = make_checkpoints(tmp_path, 2)
+    registry, loaded = make_registry()
+
+    old = registry.activate(first)
+    assert old.warm and registry.active is old
+    new = registry.activate(second)
+    # Swapping back finds the first model still in memory
+    assert registry.activate(first) is old
+    assert loaded == [first, second]
+    assert registry.active is old and new is not old
+    stats = registry.stats()
+    assert (stats["loads"], stats["swaps"], stats["evictions"]) == (2, 2, 0)
+    assert [model["model_path"] for model in stats["resident"]] == [second, first]
+
+
+def test_changed_files_are_loaded_again(tmp_path):
+    path, = make_checkpoints(tmp_path, 1)
+    registry, loaded = make_registry()
+    model = registry.activate(path)
+
+    # New weights under the same path, e.g. a symlink repointed to another epoch
+    time.sleep(0.01)
+    with open(os.path.join(path, "model.safetensors"), "wb") as f:
+        f.write(b"weights")
+    assert registry.activate(path) is not model
+    assert loaded == [path, path]
+
+
+def test_least_recently_used_models_are_evicted_but_never_active_or_candidate(tmp_path):
+    paths = make_checkpoints(tmp_path, 4)
+    registry, loaded = make_registry(max_resident=2)
+
+    registry.activate(paths[0])
+    registry.set_candidate(paths[1])
+    registry.get(paths[2])
+    assert len(registry.stats()["resident"]) == 3
+
+    # The next swap drops the oldest models that are not in use
+    registry.activate(paths[3])
+    resident = [model["model_path"] for model in registry.stats()["resident"]]
+    assert resident == [paths[1], paths[3]]
+    # Stopping the shadow lets the candidate go
+    registry.set_candidate(None)
+    registry.activate(paths[0])
+    assert [model["model_path"] for model in registry.stats()["resident"]] == [paths[3], paths[0]]
+    assert registry.stats()["evictions"] == registry.loads.snapshot() - 2
+
+
+def test_loads_run_one_at_a_time_off_the_event_loop(tmp_path):
+    paths = make_checkpoints(tmp_path, 2)
+    running = []
+    overlapped = threading.Event()
+
+    def load(path):
+        running.append(path)
+        if len(running) > 1:
+            overlapped.set()
+        time.sleep(0.05)
+        running.remove(path)
+        return FakeModel(path)
+
+    registry = ModelRegistry(load)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        models = await asyncio.gather(registry.run(registry.activate, paths[0]),
+                                      registry.run(registry.set_candidate, paths[1]))
+        ticker.cancel()
+        return models, ticks
+
+    (active, candidate), ticks = asyncio.run(run())
+    assert not overlapped.is_set()
+    # The loop kept running while the checkpoints loaded
+    assert ticks > 5
+    assert registry.active is active and registry.candidate is candidate
+
+
+def wait_for(scorer, compared):
+    deadline = time.monotonic() + 5
+    while scorer.stats()["compared"] + scorer.stats()["errors"] < compared and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_shadow_compares_labels_by_name(tmp_path):
+    first, second = make_checkpoints(tmp_path, 2)
+    active = FakeModel(first)
+    # The candidate orders its labels differently
+    candidate = FakeModel(second, label_names=("sports", "business", "politics"))
+
+    def score(model, texts):
+        assert model is candidate
+        return [([0, 1, 2], [0.5, 0.3, 0.2]) if text == "goal" else ([2, 0, 1], [0.7, 0.2, 0.1]) for text in texts]
+
+    scorer = ShadowScorer(score, fraction=1.0)
+    predictions = [([2, 0, 1], [0.9, 0.05, 0.05]), ([0, 1, 2], [0.6, 0.3, 0.1]), ([0, 1, 2], [0.6, 0.3, 0.1])]
+    scorer.submit(active, candidate, ["goal", "vote", "stocks"], predictions)
+    wait_for(scorer, 3)
+    stats = scorer.stats()
+    scorer.shutdown()
+
+    # "goal" is sports for both, "vote" and "stocks" become politics
+    assert (stats["compared"], stats["agreed"], stats["disagreed"]) == (3, 1, 2)
+    assert stats["agreement"] == pytest.approx(1 / 3)
+    assert stats["label_changes"] == {"business -> politics": 2}
+    # Both models' probabilities of the active label: 0.9 and 0.5, then twice 0.6 and 0.1
+    assert stats["mean_probability_diff"] == pytest.approx((0.4 + 0.5 + 0.5) / 3)
+
+
+def test_shadow_never_holds_back_requests(tmp_path):
+    first, second = make_checkpoints(tmp_path, 2)
+    active, candidate = FakeModel(first), FakeModel(second)
+    release = threading.Event()
+
+    def slow(model, texts):
+        release.wait(5)
+        return [([0, 1, 2], [0.6, 0.3, 0.1]) for _ in texts]
+
+    scorer = ShadowScorer(slow, fraction=1.0, max_pending=1)
+    prediction = [([0, 1, 2], [0.6, 0.3, 0.1])]
+    start = time.monotonic()
+    scorer.submit(active, candidate, ["a"], prediction)
+    # The candidate is still busy, so this sample is dropped
+    scorer.submit(active, candidate, ["b"], prediction)
+    assert time.monotonic() - start < 1
+    # Nothing is scored without a candidate, or against the active model itself
+    scorer.submit(active, None, ["c"], prediction)
+    scorer.submit(active, active, ["d"], prediction)
+    release.set()
+    wait_for(scorer, 1)
+    stats = scorer.stats()
+    assert (stats["compared"], stats["dropped"]) == (1, 1)
+
+    # A failing candidate is counted, not raised
+    scorer.score_fn = lambda model, texts: 1 / 0
+    scorer.reset()
+    scorer.submit(active, candidate, ["e", "f"], prediction * 2)
+    wait_for(scorer, 2)
+    assert scorer.stats()["errors"] == 2
+    scorer.shutdown()
@@ -0,0 +1,65 @@
+# Import necessary libraries
+import argparse
+import json
+import pytest
+import request
+
+
+def level(throughput, p99, error_rate=0.0, **key):
+    return dict(key or {"concurrency": 4}, throughput=throughput, error_rate=error_rate, latency_ms={"p99": p99})
+
+
+def run_compare(tmp_path, baseline, candidate, tolerance=0.1, error_tolerance=0.01):
+    paths = []
+    for name, results in (("baseline", baseline), ("candidate", candidate)):
+        paths.append(str(tmp_path / ("%s.json" % name)))
+        with open(paths[-1], "w") as f:
+            json.dump({"label": name, "results": results}, f)
+    request.compare(argparse.Namespace(baseline=paths[0], candidate=paths[1],
+                                       tolerance=tolerance, error_tolerance=error_tolerance))
+
+
+def test_summary_counts_rejections_and_percentiles():
+    latencies = [i / 1000 for i in range(1, 101)]
+    result = request.summarize(latencies, {200: 100, 503: 20, 500: 5}, errors=5, elapsed=10.0)
+    assert result["requests"] == 130
+    assert result["throughput"] == 10.0
+    assert result["error_rate"] == pytest.approx(30 / 130)
+    assert result["rejected_rate"] == pytest.approx(20 / 130)
+    assert result["statuses"] == {"200": 100, "500": 5, "503": 20}
+    assert result["latency_ms"]["p50"] == pytest.approx(50.5)
+    assert result["latency_ms"]["p99"] == pytest.approx(99.01)
+    assert result["latency_ms"]["max"] == pytest.approx(100.0)
+
+    # A run where nothing succeeded has no latencies to report
+    empty = request.summarize([], {503: 3}, errors=0, elapsed=1.0)
+    assert empty["error_rate"] == 1.0 and "latency_ms" not in empty
+
+
+def test_changes_within_tolerance_pass(tmp_path, capsys):
+    baseline = [level(100.0, 50.0, concurrency=1), level(400.0, 80.0, concurrency=4)]
+    candidate = [level(91.0, 54.9, 0.005, concurrency=1), level(500.0, 40.0, concurrency=4)]
+    run_compare(tmp_path, baseline, candidate)
+    assert "REGRESSION" not in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("candidate", [level(89.0, 50.0), level(100.0, 55.1), level(100.0, 50.0, 0.02),
+                                       {"concurrency": 4, "throughput": 100.0, "error_rate": 0.0}])
+def test_each_kind_of_regression_fails(tmp_path, capsys, candidate):
+    # Lower throughput, higher p99, more errors, or no successful request at all
+    with pytest.raises(SystemExit) as error:
+        run_compare(tmp_path, [level(100.0, 50.0)], [candidate])
+    assert str(error.value) == "1 of the levels regressed from baseline to candidate."
+    assert "REGRESSION" in capsys.readouterr().out
+
+
+def test_levels_are_matched_by_concurrency_or_rate(tmp_path, capsys):
+    baseline = [level(100.0, 50.0, concurrency=4), level(100.0, 50.0, rate=50.0)]
+    # The rate level regressed, a concurrency of 8 has nothing to compare to
+    candidate = [level(100.0, 50.0, concurrency=4), level(50.0, 50.0, rate=50.0), level(1.0, 900.0, concurrency=8)]
+    with pytest.raises(SystemExit, match="^1 of the levels"):
+        run_compare(tmp_path, baseline, candidate)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert lines[1].startswith("concurrency=4") and "REGRESSION" not in lines[1]
+    assert lines[2].startswith("rate=50") and lines[2].endswith("REGRESSION")
@@ -0,0 +1,85 @@
+# Import necessary libraries
+import numpy as np
+import pytest
+from samplers import BucketBatchSampler, dataset_lengths, padding_ratio
+
+
+def random_lengths(count=1000, seed=0):
+    return np.random.default_rng(seed).integers(1, 300, size=count)
+
+
+def flatten(batches):
+    return sorted(index for batch in batches for index in batch)
+
+
+def test_every_example_is_used_once_per_epoch():
+    lengths = random_lengths()
+    sampler = BucketBatchSampler(lengths, batch_size=16)
+    for epoch in range(3):
+        sampler.set_epoch(epoch)
+        batches = list(sampler)
+        assert flatten(batches) == list(range(len(lengths)))
+        assert all(len(batch) <= 16 for batch in batches)
+        assert len(sampler) == len(batches) == 63
+
+
+def test_buckets_pad_less_than_random_batches():
+    lengths = random_lengths()
+    bucketed = padding_ratio(BucketBatchSampler(lengths, batch_size=16, bucket_size_multiplier=10), lengths)
+    order = np.random.default_rng(1).permutation(len(lengths))
+    shuffled = padding_ratio([order[i:i + 16] for i in range(0, len(order), 16)], lengths)
+    assert bucketed < shuffled / 4
+
+
+def test_shuffling_changes_with_the_epoch_only():
+    lengths = random_lengths()
+    first = BucketBatchSampler(lengths, batch_size=16, seed=3)
+    again = BucketBatchSampler(lengths, batch_size=16, seed=3)
+    assert list(first) == list(again)
+
+    first.set_epoch(1)
+    assert list(first) != list(again)
+    again.set_epoch(1)
+    assert list(first) == list(again)
+
+
+def test_validation_batches_are_sorted_by_length():
+    lengths = random_lengths()
+    batches = list(BucketBatchSampler(lengths, batch_size=16, shuffle=False))
+    ordered = [index for batch in batches for index in batch]
+    assert ordered == np.argsort(lengths, kind="stable").tolist()
+    assert [len(batch) for batch in batches] == [16] * 62 + [8]
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_token_budget_bounds_padded_batch_size(shuffle):
+    lengths = random_lengths()
+    sampler = BucketBatchSampler(lengths, max_tokens=1024, shuffle=shuffle)
+    batches = list(sampler)
+    assert flatten(batches) == list(range(len(lengths)))
+    for batch in batches:
+        assert int(lengths[batch].max()) * len(batch) <= 1024
+    # Short examples are packed into bigger batches than long ones
+    sizes = {len(batch): int(lengths[batch].max()) for batch in batches}
+    assert sizes[max(sizes)] < sizes[min(sizes)]
+
+
+def test_an_example_longer_than_the_budget_gets_its_own_batch():
+    lengths = np.array([10, 500, 10, 10])
+    batches = list(BucketBatchSampler(lengths, max_tokens=100, shuffle=False))
+    assert batches == [[0, 2, 3], [1]]
+
+
+def test_a_batch_size_or_token_budget_is_required():
+    with pytest.raises(ValueError):
+        BucketBatchSampler([1, 2, 3])
+
+
+def test_lengths_come_from_cache_offsets():
+
+    class Cached(object):
+        offsets = [0, 5, 5, 400, 420]
+
+    assert dataset_lengths(Cached(), 128).tolist() == [5, 0, 128, 20]
+    assert padding_ratio([[0, 3]], np.array([5, 0, 128, 20])) == pytest.approx(1 - 25 / 40)
+    assert padding_ratio([], np.array([])) == 0.0
@@ -0,0 +1,51 @@
+# Import necessary libraries
+import argparse
+import os
+import pandas as pd
+import score
+from truncation import TitledText, normalize_item
+
+
+def test_rows_are_normalized_like_the_server():
+    # Case and punctuation are kept, as `/predict` keeps them
+    text = score.normalize_row("Oil  Prices\tRise!", " OPEC cuts output. ")
+    assert text == normalize_item(TitledText("Oil  Prices\tRise!", " OPEC cuts output. "))
+    assert text == "Oil Prices Rise! OPEC cuts output."
+    assert text.heading == "Oil Prices Rise!"
+
+    # A null title is an untitled text, and a row without text is skipped
+    assert score.normalize_row(None, "Markets fall") == "Markets fall"
+    assert not isinstance(score.normalize_row(None, "Markets fall"), TitledText)
+    assert score.normalize_row("Markets fall", None) == "Markets fall"
+    assert score.normalize_row(None, None) is None
+    assert score.normalize_row(" ", "\n") is None
+
+
+def test_score_writes_every_row_and_resumes(checkpoint, tmp_path):
+    rows = pd.DataFrame({"title": ["Oil prices rise", None, None, "Stocks", "Election day"],
+                         "paragraph": ["OPEC agrees to cut output", "The team won", None, "  ", "Votes are counted"],
+                         "id": [10, 11, 12, 13, 14]})
+    source = str(tmp_path / "input.parquet")
+    rows.to_parquet(source, row_group_size=2)
+    args = argparse.Namespace(input=source, output=str(tmp_path / "predictions"), model_path=checkpoint, tokenizer=checkpoint,
+                              backend="eager", window=2, batch_size=2, keep_columns=["id"])
+
+    score.score(args)
+    parts = sorted(os.listdir(args.output))
+    assert parts == ["part-00000.parquet", "part-00001.parquet", "part-00002.parquet"]
+    predictions = pd.read_parquet(args.output).sort_values("row")
+    assert predictions["row"].tolist() == [0, 1, 2, 3, 4]
+    assert predictions["id"].tolist() == [10, 11, 12, 13, 14]
+    # Only the row with neither a title nor a paragraph has no prediction
+    assert predictions["predicted_label"].isna().tolist() == [False, False, True, False, False]
+    for probabilities in predictions["probabilities"].drop(index=2):
+        assert len(probabilities) == 3 and abs(sum(probabilities) - 1) < 1e-5
+
+    # A rerun keeps the finished parts and scores the missing one again
+    os.remove(os.path.join(args.output, parts[1]))
+    finished = os.path.getmtime(os.path.join(args.output, parts[0]))
+    score.score(args)
+    assert sorted(os.listdir(args.output)) == parts
+    assert os.path.getmtime(os.path.join(args.output, parts[0])) == finished
+    assert pd.read_parquet(args.output).sort_values("row")["predicted_label"].fillna(-1).tolist() == \
+        predictions["predicted_label"].fillna(-1).tolist()
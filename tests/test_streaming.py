@@ -0,0 +1,100 @@
+# Import necessary libraries
+import asyncio
+import json
+import pytest
+from streaming import iter_chunks, iter_texts
+from truncation import TitledText
+
+
+async def as_stream(body, size):
+    # Feed the body in chunks of `size` bytes, the way `request.stream()` does
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def parse(body, size=3):
+    return asyncio.run(collect(iter_texts(as_stream(body, size))))
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_ndjson_and_array_bodies_give_the_same_texts(size):
+    items = ["Oil prices rise", {"text": "Votes are counted"}, "Café, naïve — 東京", "with\nnewline"]
+    ndjson = "\n".join(json.dumps(item, ensure_ascii=False) for item in items).encode("utf-8")
+    array = json.dumps(items, ensure_ascii=False, indent=1).encode("utf-8")
+
+    expected = ["Oil prices rise", "Votes are counted", "Café, naïve — 東京", "with\nnewline"]
+    # Multi-byte characters split across chunks are decoded whole
+    assert parse(ndjson, size) == expected
+    assert parse(array, size) == expected
+
+
+def test_blank_lines_and_empty_bodies():
+    assert parse(b'\n"a"\n\n  \r\n"b"\n') == ["a", "b"]
+    assert parse(b'"a"') == ["a"]
+    assert parse(b"") == []
+    assert parse(b" \n ") == []
+    assert parse(b"[]") == []
+    assert parse(b" [ ] ") == []
+
+
+def test_titles_are_kept():
+    body = b'{"title": "Elections", "text": "Votes are counted"}\n{"title": "", "text": "Untitled"}\n' \
+           b'{"title": null, "text": "Also untitled"}'
+    texts = parse(body)
+    assert texts == ["Elections Votes are counted", "Untitled", "Also untitled"]
+    assert isinstance(texts[0], TitledText) and texts[0].heading == "Elections"
+    assert not isinstance(texts[1], TitledText) and not isinstance(texts[2], TitledText)
+
+
+@pytest.mark.parametrize("body", [b'"a"\n5\n"c"', b'["a", {"txt": "b"}]', b'"a"\n{"title": 1, "text": "b"}'])
+def test_malformed_items_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse(body)
+
+
+@pytest.mark.parametrize("body", [b'["a", "b"', b'["a", "b', b'"a"\n{"text": '])
+def test_truncated_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse(body)
+
+
+def test_only_the_current_element_is_buffered():
+    # A long body is parsed while it is still arriving
+    seen = []
+
+    async def body():
+        yield b"["
+        for i in range(1000):
+            seen.append(i)
+            yield json.dumps("text %d" % i).encode() + b","
+        yield b"]"
+
+    async def first_two():
+        texts = iter_texts(body())
+        first = [await texts.__anext__(), await texts.__anext__()]
+        await texts.aclose()
+        return first
+
+    assert asyncio.run(first_two()) == ["text 0", "text 1"]
+    assert len(seen) < 5
+
+
+def test_chunks_keep_texts_before_a_malformed_item():
+    texts = [json.dumps("text %d" % i) for i in range(5)]
+    chunks = asyncio.run(collect(iter_chunks(iter_texts(as_stream("\n".join(texts).encode(), 4)), 2)))
+    assert chunks == [["text 0", "text 1"], ["text 2", "text 3"], ["text 4"]]
+
+    # The texts parsed before the bad item come out before the error
+    received = []
+
+    async def run():
+        async for chunk in iter_chunks(iter_texts(as_stream(b'"a"\n"b"\n"c"\n7\n"e"', 4)), 2):
+            received.append(chunk)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+    assert received == [["a", "b"], ["c"]]
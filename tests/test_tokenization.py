@@ -0,0 +1,186 @@
+# Import necessary libraries
+import hashlib
+import json
+import os
+import pytest
+import regex
+from tokenization import TokenCache, load_corpus, load_gpt2_tokenizer
+
+# GPT-2's own vocabulary and merges, as published with the model (copied from
+# openai-whisper 20230124, whisper/assets/gpt2), pinned by their hashes
+GPT2_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gpt2")
+GPT2_FILES = {"vocab.json": "3ba3c3109ff33976c4bd966589c11ee14fcaa1f4c9e5e154c2ed7f99d80709e7",
+              "merges.txt": "fe36cab26d4f4421ed725e10a2e9ddb7f799449c603a96e7f29b5a3c82a95862"}
+DATA = os.path.join(os.path.dirname(GPT2_DIR), os.pardir, os.pardir, "query_resul.parquet")
+
+# The unicode and whitespace the server can receive on top of the corpus
+CORPUS = [
+    "oil prices rise as opec agrees to cut output",
+    "Oil Prices Rise, as OPEC agrees to cut output!",
+    "the company's q3 results weren't what they'd hoped and we'll see",
+    "mixed CASE, under_scores and hyphen-ated-words",
+    "numbers 1,234.56 and 2024-10-18 and ½ ² ٣",
+    "",
+    " ",
+    "   leading and trailing spaces   ",
+    "double  spaces  between   words",
+    "tabs\tand\nnewlines\r\nand\r carriage returns",
+    "\n\n\n",
+    "vertical\x0btab and form\x0cfeed and \x1cseparators\x1f",
+    "non\u00a0breaking\u00a0spaces, a\u2009thin space and an\u3000ideographic one",
+    "zero\u200bwidth space and\u200djoiner and \ufeffbyte order mark",
+    "café naïve résumé Zürich",
+    "cafe\u0301 nai\u0308ve, the same words with combining marks",
+    "Ελληνικά κείμενα, кириллица, 中文新闻, 日本語のニュース, 한국어 뉴스",
+    "right to left: עברית العربية",
+    "emoji 📈📉 🛢️ and a flag 🇺🇸",
+    "quotes “curly” ‘single’ — dashes – and … an ellipsis",
+    "symbols © ® ™ € £ ¥ ∑ ∫ √ and a \ufffd replacement character",
+    "a" * 300,
+]
+
+
+def bytes_to_unicode():
+    # The printable character GPT-2 uses for every byte
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(2 ** 8):
+        if b not in bs:
+            bs.append(b)
+            cs.append(2 ** 8 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+class ReferenceEncoder(object):
+    r"""
+    The original GPT-2 byte-level BPE encoder in pure Python.
+
+    This is the algorithm the slow `GPT2Tokenizer` implemented before
+    transformers 5, where `GPT2Tokenizer` became the Rust-backed one, so it
+    is the reference the fast tokenizer is checked against.
+
+    """
+
+    pattern = regex.compile(r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""")
+
+    def __init__(self, path):
+
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.encoder = json.load(f)
+        with open(os.path.join(path, "merges.txt"), encoding="utf-8") as f:
+            merges = [tuple(line.split()) for line in f.read().split("\n") if line and not line.startswith("#version")]
+        self.bpe_ranks = {merge: rank for rank, merge in enumerate(merges)}
+        self.byte_encoder = bytes_to_unicode()
+        self.pad_token_id = self.encoder["<|endoftext|>"]
+        # Merged pieces of every pre-token seen, as the original encoder kept
+        self.cache = {}
+
+        return
+
+    def bpe(self, token):
+        if token in self.cache:
+            return self.cache[token]
+        word = tuple(token)
+        while len(word) > 1:
+            pairs = set(zip(word, word[1:]))
+            pair = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float("inf")))
+            if pair not in self.bpe_ranks:
+                break
+            merged = []
+            i = 0
+            while i < len(word):
+                if i < len(word) - 1 and (word[i], word[i + 1]) == pair:
+                    merged.append(word[i] + word[i + 1])
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            word = tuple(merged)
+        self.cache[token] = word
+        return word
+
+    def encode(self, text):
+        ids = []
+        for token in self.pattern.findall(text):
+            token = "".join(self.byte_encoder[b] for b in token.encode("utf-8"))
+            ids.extend(self.encoder[piece] for piece in self.bpe(token))
+        return ids
+
+    def pad(self, texts):
+        # Left-padded ids and attention mask, as the classifier receives them
+        encodings = [self.encode(text) for text in texts]
+        longest = max(len(ids) for ids in encodings)
+        return {"input_ids": [[self.pad_token_id] * (longest - len(ids)) + ids for ids in encodings],
+                "attention_mask": [[0] * (longest - len(ids)) + [1] * len(ids) for ids in encodings]}
+
+
+@pytest.fixture(scope="module")
+def tokenizer_dir():
+    # Fails rather than skips: without the real files nothing is checked
+    for name, digest in GPT2_FILES.items():
+        path = os.path.join(GPT2_DIR, name)
+        if not os.path.isfile(path):
+            pytest.fail("%s is missing, the GPT-2 tokenizer files are vendored in %s." % (name, GPT2_DIR))
+        with open(path, "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == digest, "%s is not the pinned GPT-2 file." % path
+    return GPT2_DIR
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    if not os.path.isfile(DATA):
+        pytest.fail("%s is missing." % os.path.normpath(DATA))
+    return load_corpus(DATA)
+
+
+def test_corpus_matches_reference(tokenizer_dir, corpus):
+    reference = ReferenceEncoder(tokenizer_dir)
+    fast = load_gpt2_tokenizer(tokenizer_dir)
+    expected = [reference.encode(text) for text in corpus]
+
+    actual = fast(corpus, truncation=False, verbose=False)["input_ids"]
+    mismatches = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    assert len(corpus) > 1000
+    assert not mismatches, "%d of %d texts differ, first %r" % (len(mismatches), len(corpus), corpus[mismatches[0]][:80])
+
+    # Left-padded batches, as the classifier receives them
+    for start in range(0, len(corpus), 64):
+        batch = corpus[start:start + 64]
+        padded = fast(batch, padding=True, truncation=False, verbose=False)
+        assert padded["input_ids"] == reference.pad(batch)["input_ids"]
+        assert padded["attention_mask"] == reference.pad(batch)["attention_mask"]
+
+
+def test_ids_match_reference(tokenizer_dir):
+    reference = ReferenceEncoder(tokenizer_dir)
+    fast = load_gpt2_tokenizer(tokenizer_dir)
+    expected = [reference.encode(text) for text in CORPUS]
+
+    assert [fast.encode(text, verbose=False) for text in CORPUS] == expected
+    # One batch call, as the token cache and the training cache make
+    assert fast(CORPUS, truncation=False, verbose=False)["input_ids"] == expected
+
+
+def test_padded_batches_match_reference(tokenizer_dir):
+    reference = ReferenceEncoder(tokenizer_dir)
+    fast = load_gpt2_tokenizer(tokenizer_dir)
+
+    for start in range(0, len(CORPUS), 4):
+        batch = CORPUS[start:start + 4]
+        expected = reference.pad(batch)
+        actual = fast(batch, padding=True, truncation=False, verbose=False)
+        assert actual["input_ids"] == expected["input_ids"]
+        assert actual["attention_mask"] == expected["attention_mask"]
+
+
+def test_token_cache_matches_reference(tokenizer_dir):
+    reference = ReferenceEncoder(tokenizer_dir)
+    cache = TokenCache(load_gpt2_tokenizer(tokenizer_dir), max_entries=len(CORPUS))
+    expected = [reference.encode(text) for text in CORPUS]
+
+    # Misses are encoded in one batch, then every text is a hit
+    assert cache.encode(CORPUS) == expected
+    assert cache.encode(CORPUS) == expected
+    assert cache.hits.snapshot() == len(CORPUS)
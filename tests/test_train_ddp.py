@@ -0,0 +1,73 @@
+# Import necessary libraries
+import json
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from transformers import GPT2Config, GPT2ForSequenceClassification
+import training
+from dataset_cache import TokenizedCollator, TokenizedDataset
+from train_ddp import validate_shard
+
+# An odd number of examples, so `DistributedSampler` would repeat one
+N_EXAMPLES = 7
+N_LABELS = 3
+WORLD_SIZE = 2
+
+
+def write_token_cache(path, seed=0):
+    # A token cache in the format of `build_token_cache`, without a tokenizer
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(3, 10, size=N_EXAMPLES)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    os.makedirs(path)
+    np.save(os.path.join(path, 'input_ids.npy'), rng.integers(1, 50, size=int(offsets[-1])).astype(np.int32))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'labels.npy'), rng.integers(0, N_LABELS, size=N_EXAMPLES).astype(np.int64))
+    np.save(os.path.join(path, 'title_lengths.npy'), np.zeros(N_EXAMPLES, dtype=np.int32))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'classes': [str(label) for label in range(N_LABELS)], 'n_examples': N_EXAMPLES, 'split': 'valid'}, f)
+
+
+def load_fixture(tmp_dir):
+    model = GPT2ForSequenceClassification.from_pretrained(os.path.join(tmp_dir, 'model')).eval()
+    dataset = TokenizedDataset(os.path.join(tmp_dir, 'cache'))
+    return model, dataset, TokenizedCollator(pad_token_id=0, max_sequence_len=16)
+
+
+def _validate(rank, tmp_dir):
+    # One gloo process of the multi-process validation
+    dist.init_process_group('gloo', init_method='file://' + os.path.join(tmp_dir, 'rendezvous'), rank=rank, world_size=WORLD_SIZE)
+    try:
+        torch.set_num_threads(1)
+        model, dataset, collator = load_fixture(tmp_dir)
+        loss, accuracy, examples = validate_shard(model, dataset, collator, 1, torch.device('cpu'), rank, WORLD_SIZE)
+        with open(os.path.join(tmp_dir, 'rank-%d.json' % rank), 'w') as f:
+            json.dump({'loss': loss, 'accuracy': accuracy, 'examples': examples}, f)
+    finally:
+        dist.destroy_process_group()
+
+
+def test_validation_counts_every_example_once(tmp_path):
+    tmp_dir = str(tmp_path)
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=50, n_positions=16, n_embd=16, n_layer=1, n_head=2, num_labels=N_LABELS, pad_token_id=0)
+    GPT2ForSequenceClassification(config).save_pretrained(os.path.join(tmp_dir, 'model'))
+    write_token_cache(os.path.join(tmp_dir, 'cache'))
+
+    mp.spawn(_validate, args=(tmp_dir,), nprocs=WORLD_SIZE, join=True)
+
+    # One process over the whole split; with batches of one example the mean
+    # loss does not depend on how the split is cut
+    model, dataset, collator = load_fixture(tmp_dir)
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=1, collate_fn=collator)
+    true_labels, predictions_labels, loss = training.validation(model, dataloader, torch.device('cpu'), progress=False)
+    accuracy = float(np.mean(np.asarray(true_labels) == np.asarray(predictions_labels)))
+
+    for rank in range(WORLD_SIZE):
+        with open(os.path.join(tmp_dir, 'rank-%d.json' % rank)) as f:
+            result = json.load(f)
+        assert result['examples'] == N_EXAMPLES
+        assert result['accuracy'] == accuracy
+        assert abs(result['loss'] - loss) < 1e-5
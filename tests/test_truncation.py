@@ -0,0 +1,87 @@
+# Import necessary libraries
+import json
+import os
+import numpy as np
+import pytest
+from dataset_cache import TokenizedCollator
+from tokenization import TokenCache, load_gpt2_tokenizer
+from truncation import STRATEGIES, TitledText, encode, load_truncation, normalize_item, truncate_ids
+
+IDS = list(range(100))
+
+
+@pytest.fixture(scope="module")
+def tokenizer(checkpoint):
+    return load_gpt2_tokenizer(checkpoint)
+
+
+def test_strategies_keep_the_expected_tokens():
+    assert truncate_ids(IDS, 8, "head") == list(range(8))
+    assert truncate_ids(IDS, 8, "tail") == list(range(92, 100))
+    # A quarter of the budget for the start, the rest for the end
+    assert truncate_ids(IDS, 8, "head+tail") == [0, 1, 94, 95, 96, 97, 98, 99]
+    # Without a title `title+lead` is the head
+    assert truncate_ids(IDS, 8, "title+lead") == list(range(8))
+    for strategy in STRATEGIES:
+        # Texts within the budget are kept whole
+        assert truncate_ids(IDS[:5], 8, strategy) == IDS[:5]
+
+
+def test_title_follows_the_lead_of_the_paragraph():
+    # A 3 token title goes last, after the start of the paragraph
+    assert truncate_ids(IDS, 8, "title+lead", title_length=3) == [3, 4, 5, 6, 7, 0, 1, 2]
+    # A long title gets at most half the budget
+    assert truncate_ids(IDS, 8, "title+lead", title_length=20) == [20, 21, 22, 23, 0, 1, 2, 3]
+    # Short texts are reordered too, so training and serving agree
+    assert truncate_ids(IDS[:5], 8, "title+lead", title_length=2) == [2, 3, 4, 0, 1]
+    # A budget of one still keeps a token
+    assert truncate_ids(IDS, 1, "title+lead", title_length=3) == [0]
+
+
+def test_arrays_stay_arrays():
+    ids = np.arange(100, dtype=np.int32)
+    for strategy in STRATEGIES:
+        kept = truncate_ids(ids, 8, strategy, title_length=3)
+        assert isinstance(kept, np.ndarray) and len(kept) == 8
+        assert kept.tolist() == truncate_ids(IDS, 8, strategy, title_length=3)
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match="Unknown truncation strategy"):
+        truncate_ids(IDS, 8, "middle")
+
+
+def test_encode_finds_the_title_tokens(tokenizer):
+    text = normalize_item(TitledText(" Oil  prices rise", "OPEC agrees to cut output as demand slows down"))
+    title_ids = tokenizer("Oil prices rise")["input_ids"]
+    paragraph_ids = tokenizer(str(text))["input_ids"][len(title_ids):]
+
+    ids, = encode(tokenizer, [text], 8, "title+lead")
+    assert ids == paragraph_ids[:8 - len(title_ids)] + title_ids
+    # The same words sent untitled keep their head
+    untitled, = encode(tokenizer, [str(text)], 8, "title+lead")
+    assert untitled == tokenizer(str(text))["input_ids"][:8]
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_serving_and_training_cut_texts_the_same_way(tokenizer, strategy):
+    texts = [TitledText("Election day", "Votes are counted in every district " * 10), "The team won the final " * 8, "Short"]
+    served = encode(tokenizer, texts, 16, strategy)
+    assert served == encode(tokenizer, texts, 16, strategy, cache=TokenCache(tokenizer))
+    assert all(len(ids) <= 16 for ids in served)
+
+    # The collator cuts the cached ids of the training data with the same function
+    title_lengths = [len(tokenizer(text.heading)["input_ids"]) if isinstance(text, TitledText) else 0 for text in texts]
+    sequences = [{"input_ids": ids, "title_length": title_length, "label": 0}
+                 for ids, title_length in zip(tokenizer(texts)["input_ids"], title_lengths)]
+    batch = TokenizedCollator(tokenizer.pad_token_id, 16, strategy)(sequences)
+    for row, mask, ids in zip(batch["input_ids"].tolist(), batch["attention_mask"].tolist(), served):
+        assert [token for token, keep in zip(row, mask) if keep] == ids
+
+
+def test_budget_and_strategy_come_from_the_checkpoint(checkpoint, tmp_path):
+    assert load_truncation(checkpoint) == {"budget": 32, "strategy": "head"}
+    # Older checkpoints read the head of the text up to the default budget
+    with open(os.path.join(tmp_path, "config.json"), "w") as f:
+        json.dump({"model_type": "gpt2"}, f)
+    assert load_truncation(str(tmp_path), 1024) == {"budget": 1024, "strategy": "head"}
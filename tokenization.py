@@ -0,0 +1,221 @@
+# Import necessary libraries
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import Counter, Gauge
+
+
+def load_gpt2_tokenizer(name_or_path, **kwargs):
+    r"""
+    Load the Rust-backed GPT-2 tokenizer set up for classification.
+
+    `GPT2TokenizerFast` encodes a batch of texts on a pool of native threads
+    (`RAYON_NUM_THREADS`, all cores available to the process by default)
+    and gives the same ids as the original GPT-2 encoder, see
+    `tests/test_tokenization.py` and `python tokenization.py parity`.
+
+    Arguments:
+
+      name_or_path (:obj:`str`):
+          Hub name or directory passed to `from_pretrained`.
+
+    """
+
+    from transformers import GPT2TokenizerFast
+
+    tokenizer = GPT2TokenizerFast.from_pretrained(name_or_path, **kwargs)
+
+    # GPT-2 classifies from the last token, so pad batches on the left
+    tokenizer.padding_side = "left"
+
+    # Set the padding token to be the EOS token
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+class TokenCache(object):
+    r"""
+    Size-bounded LRU cache of the token ids of texts.
+
+    Texts seen recently, e.g. the same title over many paragraphs or texts
+    whose prediction is no longer cached, skip the tokenizer. The texts that
+    are missing are encoded together in one batch call.
+
+    Arguments:
+
+      tokenizer (:obj:`transformers.PreTrainedTokenizerBase`):
+          Tokenizer the ids come from.
+
+      max_entries (:obj:`int`):
+          Largest number of texts kept. `0` disables the cache.
+
+    """
+
+    def __init__(self, tokenizer, max_entries=10000):
+
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        # Text -> tuple of token ids, oldest first.
+        self._entries = OrderedDict()
+        # Inference workers encode from several threads.
+        self._lock = threading.Lock()
+        # Counters exported with the server stats.
+        self.hits = Counter()
+        self.misses = Counter()
+        self.size = Gauge()
+
+        return
+
+    def encode(self, texts):
+        r"""
+        Token ids of every text, untruncated and unpadded.
+
+        Returns:
+          :obj:`List[List[int]]`: Ids in the order of `texts`.
+
+        """
+
+        ids = [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                entry = self._entries.get(text)
+                if entry is not None:
+                    self._entries.move_to_end(text)
+                    ids[i] = entry
+
+        missing = [i for i, entry in enumerate(ids) if entry is None]
+        self.hits.inc(len(texts) - len(missing))
+        self.misses.inc(len(missing))
+        if missing:
+            # The tokenizer runs outside the lock so workers encode in parallel
+            encodings = self.tokenizer([str(texts[i]) for i in missing], truncation=False, verbose=False)['input_ids']
+            for i, encoding in zip(missing, encodings):
+                ids[i] = tuple(encoding)
+            if self.max_entries > 0:
+                with self._lock:
+                    for i in missing:
+                        self._entries[str(texts[i])] = ids[i]
+                        self._entries.move_to_end(str(texts[i]))
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    self.size.set(len(self._entries))
+
+        return [list(entry) for entry in ids]
+
+    def stats(self):
+        return {"hits": self.hits.snapshot(),
+                "misses": self.misses.snapshot(),
+                "size": self.size.snapshot()}
+
+
+def load_corpus(path):
+    # Texts as training sees them, and the raw titles and paragraphs with
+    # their punctuation, case and unicode
+    import pandas as pd
+    from data import load_splits
+
+    train_data, test_data = load_splits(path)
+    texts = list(train_data['text']) + list(test_data['text'])
+    if not os.path.isdir(path):
+        raw = pd.read_parquet(path, columns=['title', 'paragraph'])
+        texts += list(raw['title']) + list(raw['paragraph'])
+    return [text for text in texts if isinstance(text, str)]
+
+
+def parity(args):
+    r"""
+    Check that the fast tokenizer and its cache give exactly the ids of
+    `GPT2Tokenizer` on the corpus, and fail on the first difference.
+
+    """
+
+    from transformers import GPT2Tokenizer
+
+    texts = load_corpus(args.data)
+    reference = GPT2Tokenizer.from_pretrained(args.tokenizer)
+    reference.padding_side = "left"
+    reference.pad_token = reference.eos_token
+    fast = load_gpt2_tokenizer(args.tokenizer)
+    cache = TokenCache(fast, max_entries=len(texts))
+    print("Reference %s, candidate %s, %d texts." % (type(reference).__name__, type(fast).__name__, len(texts)))
+
+    expected = [reference.encode(text, verbose=False) for text in texts]
+    checks = {"batch": fast(texts, truncation=False, verbose=False)['input_ids'],
+              "cache, first pass": cache.encode(texts),
+              "cache, second pass": cache.encode(texts)}
+    failures = 0
+    for name, actual in checks.items():
+        mismatches = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+        failures += len(mismatches)
+        print("%-20s %d of %d texts differ" % (name, len(mismatches), len(texts)))
+        for i in mismatches[:3]:
+            print("  %r\n    expected %s\n    actual   %s" % (texts[i][:80], expected[i][:20], actual[i][:20]))
+
+    # Left-padded batches as the model receives them
+    for start in range(0, min(len(texts), args.padded_texts), 16):
+        batch = texts[start:start + 16]
+        a = reference(batch, padding=True, truncation=True)
+        b = fast(batch, padding=True, truncation=True)
+        if a['input_ids'] != b['input_ids'] or a['attention_mask'] != b['attention_mask']:
+            failures += 1
+            print("Padded batch at %d differs." % start)
+
+    if failures:
+        raise SystemExit("The tokenizers disagree.")
+    print("Token-for-token parity on all texts.")
+
+
+def bench(args):
+    r"""
+    Texts and tokens per second of the reference tokenizer one text at a
+    time, and of the fast tokenizer and its cache over batches.
+
+    """
+
+    from transformers import GPT2Tokenizer
+
+    texts = load_corpus(args.data)[:args.limit]
+    reference = GPT2Tokenizer.from_pretrained(args.tokenizer)
+    fast = load_gpt2_tokenizer(args.tokenizer)
+    n_tokens = sum(len(ids) for ids in fast(texts, truncation=False, verbose=False)['input_ids'])
+
+    def run(name, encode, batch_size):
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            encode(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        print("%-28s batch %5d %10.0f texts/s %12.0f tokens/s" % (name, batch_size, len(texts) / elapsed, n_tokens / elapsed), flush=True)
+
+    print("%d texts, %d tokens, %s threads" % (len(texts), n_tokens, os.environ.get("RAYON_NUM_THREADS", "all")))
+    run("GPT2Tokenizer, per text", lambda batch: [reference.encode(text, verbose=False) for text in batch], 1)
+    for batch_size in args.batch_sizes:
+        run("GPT2TokenizerFast", lambda batch: fast(batch, truncation=False, verbose=False), batch_size)
+    cache = TokenCache(fast, max_entries=len(texts))
+    cache.encode(texts)
+    for batch_size in args.batch_sizes:
+        run("TokenCache, all hits", cache.encode, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check parity of the fast GPT-2 tokenizer and benchmark tokenization.")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--tokenizer", default="gpt2")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("parity", help="Fail unless the ids match GPT2Tokenizer on every text of the corpus.")
+    sub.add_argument("--padded-texts", type=int, default=2000, help="Texts also compared as left-padded batches.")
+    sub.set_defaults(func=parity)
+
+    sub = subparsers.add_parser("bench", help="Measure tokenization throughput.")
+    sub.add_argument("--batch-sizes", type=lambda s: [int(v) for v in s.split(",")], default=[1, 8, 32, 256])
+    sub.add_argument("--limit", type=int, default=None, help="Only use the first N texts.")
+    sub.add_argument("--threads", type=int, default=None, help="Native threads of the fast tokenizer.")
+    sub.set_defaults(func=bench)
+
+    args = parser.parse_args()
+    if getattr(args, "threads", None):
+        # Read once, when the native thread pool starts
+        os.environ["RAYON_NUM_THREADS"] = str(args.threads)
+    args.func(args)
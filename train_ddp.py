@@ -0,0 +1,205 @@
+# Import necessary libraries
+import argparse
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from sklearn.utils.class_weight import compute_class_weight
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from transformers import (set_seed,
+                          GPT2Config,
+                          get_linear_schedule_with_warmup,
+                          GPT2ForSequenceClassification)
+from data import load_splits
+from dataset_cache import build_token_cache, TokenizedDataset, TokenizedCollator
+import training
+from checkpointing import Checkpointer
+from calibration import calibrate
+from tokenization import load_gpt2_tokenizer
+from truncation import STRATEGIES
+
+
+def setup_distributed():
+    # `torchrun` sets these; a plain `python train_ddp.py` runs as a single process
+    os.environ.setdefault("RANK", "0")
+    os.environ.setdefault("WORLD_SIZE", "1")
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "29500")
+    dist.init_process_group(backend="gloo")
+    return dist.get_rank(), dist.get_world_size()
+
+
+def all_reduce_metrics(true_labels, predictions_labels, avg_loss, n_batches):
+    # Sum loss, batch count and correct predictions over all ranks
+    totals = torch.tensor([avg_loss * n_batches, n_batches,
+                           sum(t == p for t, p in zip(true_labels, predictions_labels)), len(true_labels)],
+                          dtype=torch.float64)
+    dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+    loss_sum, batches, correct, examples = totals.tolist()
+    return loss_sum / batches, correct / examples, int(examples)
+
+
+def validate_shard(model, dataset, collator, batch_size, device_, rank, world_size, progress=False, bf16=False):
+    r"""
+    Validate every rank on its share of the split and all-reduce the metrics.
+
+    `DistributedSampler` pads the shards to the same size by repeating
+    examples, which counts some twice. Here rank `r` takes the examples
+    `r, r + world_size, ...`, so every example is counted exactly once and
+    the shards differ in size by at most one. The unwrapped model is run, so
+    a rank with one batch less never waits on a DDP collective.
+
+    Arguments:
+
+      model (:obj:`transformers.GPT2ForSequenceClassification`):
+          Model without its `DistributedDataParallel` wrapper.
+
+    Returns:
+      :obj:`Tuple[float, float, int]`: Loss, accuracy and the number of
+      examples over all ranks.
+
+    """
+
+    dataloader = DataLoader(dataset, batch_size=batch_size, sampler=range(rank, len(dataset), world_size), collate_fn=collator)
+    if len(dataloader):
+        true_labels, predictions_labels, avg_loss = training.validation(model, dataloader, device_, progress=progress, bf16=bf16)
+    else:
+        # More ranks than examples
+        true_labels, predictions_labels, avg_loss = [], [], 0.0
+    return all_reduce_metrics(true_labels, predictions_labels, avg_loss, len(dataloader))
+
+
+def main(args):
+    rank, world_size = setup_distributed()
+    is_main = rank == 0
+
+    # Split the cores between the processes on this host
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // world_size))
+    set_seed(args.seed)
+    device = torch.device('cpu')
+
+    # Load the data the same way as the notebook
+    train_data, test_data = load_splits(args.data)
+    if args.limit:
+        train_data, test_data = train_data[:args.limit], test_data[:args.limit]
+
+    tokenizer = load_gpt2_tokenizer(args.tokenizer)
+
+    # Rank 0 tokenizes into the cache, the other ranks then read it
+    if not is_main:
+        dist.barrier()
+    train_cache = build_token_cache(train_data, tokenizer, args.cache_dir, source_path=args.data, split='train')
+    train_dataset = TokenizedDataset(train_cache)
+    valid_cache = build_token_cache(test_data, tokenizer, args.cache_dir, source_path=args.data, split='valid',
+                                    classes=train_dataset.classes)
+    valid_dataset = TokenizedDataset(valid_cache)
+    if is_main:
+        dist.barrier()
+
+    collator = TokenizedCollator(pad_token_id=tokenizer.pad_token_id,
+                                 max_sequence_len=args.max_length or tokenizer.model_max_length,
+                                 strategy=args.truncation)
+
+    # Each rank trains on its own shard of the data, see `validate_shard` for validation
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=args.seed)
+    train_dataloader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler, collate_fn=collator)
+
+    # Class weights come from the whole training split, so every rank agrees
+    n_labels = len(train_dataset.classes)
+    class_weights = compute_class_weight('balanced', classes=np.arange(n_labels), y=np.asarray(train_dataset.labels))
+    class_weights = torch.tensor(class_weights, dtype=torch.float).to(device)
+    loss_fn = torch.nn.CrossEntropyLoss(weight=class_weights)
+
+    # Get model configuration and model, the same way as the notebook
+    model_config = GPT2Config.from_pretrained(pretrained_model_name_or_path=args.model_name_or_path, num_labels=n_labels)
+    model = GPT2ForSequenceClassification.from_pretrained(pretrained_model_name_or_path=args.model_name_or_path, config=model_config)
+    model.resize_token_embeddings(len(tokenizer))
+    model.config.pad_token_id = model.config.eos_token_id
+    model.config.id2label = dict(enumerate(train_dataset.classes))
+    model.config.label2id = {label: i for i, label in enumerate(train_dataset.classes)}
+    # The server truncates with the same budget and strategy
+    model.config.token_budget = collator.max_sequence_len
+    model.config.truncation_strategy = args.truncation
+    model.to(device)
+    if args.gradient_checkpointing:
+        training.enable_gradient_checkpointing(model)
+
+    # DDP averages the gradients of all ranks after each backward pass
+    ddp_model = DistributedDataParallel(model)
+
+    optimizer = torch.optim.AdamW(ddp_model.parameters(), lr=args.lr, eps=1e-8)
+    # One optimizer step for every `accumulation_steps` batches
+    total_steps = -(-len(train_dataloader) // args.accumulation_steps) * args.epochs
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=total_steps)
+
+    # Every rank resumes from the last checkpoint written by rank 0
+    checkpointer = Checkpointer(os.path.join(args.output_dir, "checkpoints"), keep_last=args.keep_checkpoints)
+    start_epoch, start_batch = 0, 0
+    if checkpointer.latest() is not None:
+        _, position = checkpointer.restore(checkpointer.latest(), model, optimizer, scheduler)
+        start_epoch, start_batch = position['epoch'], position['batch']
+        if is_main:
+            print("Resuming from %s at epoch %d, batch %d" % (checkpointer.latest(), start_epoch + 1, start_batch))
+
+    for epoch in range(start_epoch, args.epochs):
+        # Reshuffle the shards for this epoch
+        train_sampler.set_epoch(epoch)
+
+        def save_step_checkpoint(batches_done):
+            # Mid-epoch checkpoints from rank 0 every `--checkpoint-every` optimizer steps
+            if is_main and args.checkpoint_every and scheduler.last_epoch % args.checkpoint_every == 0:
+                checkpointer.save(scheduler.last_epoch, model, optimizer, scheduler, {'epoch': epoch, 'batch': batches_done})
+
+        train_labels, train_predict, train_loss = training.train(ddp_model, train_dataloader, optimizer, scheduler, device, loss_fn, progress=is_main,
+                                                                 accumulation_steps=args.accumulation_steps, bf16=args.bf16,
+                                                                 start_batch=start_batch if epoch == start_epoch else 0,
+                                                                 on_update=save_step_checkpoint)
+        train_loss, train_acc, _ = all_reduce_metrics(train_labels, train_predict, train_loss, len(train_dataloader))
+
+        val_loss, val_acc, _ = validate_shard(model, valid_dataset, collator, args.batch_size, device, rank, world_size,
+                                              progress=is_main, bf16=args.bf16)
+
+        # Only rank 0 prints and writes checkpoints
+        if is_main:
+            print("epoch %d - train_loss: %.5f - val_loss: %.5f - train_acc: %.5f - valid_acc: %.5f" % (epoch + 1, train_loss, val_loss, train_acc, val_acc))
+            checkpoint_dir = os.path.join(args.output_dir, "epoch-%d" % (epoch + 1))
+            model.save_pretrained(checkpoint_dir)
+            tokenizer.save_pretrained(checkpoint_dir)
+            checkpointer.save(scheduler.last_epoch, model, optimizer, scheduler, {'epoch': epoch + 1, 'batch': 0})
+        dist.barrier()
+
+    checkpointer.close()
+
+    # Rank 0 fits temperature scaling on the whole validation split and saves
+    # it with the last model
+    if is_main and args.epochs > start_epoch:
+        calibration_dataloader = DataLoader(valid_dataset, batch_size=args.batch_size, collate_fn=collator)
+        calibrate(model, calibration_dataloader, device, os.path.join(args.output_dir, "epoch-%d" % args.epochs), train_dataset.classes)
+    dist.barrier()
+
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel CPU training, launch with `torchrun --nproc_per_node=N train_ddp.py`.")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--output-dir", default="weights")
+    parser.add_argument("--cache-dir", default="token_cache")
+    parser.add_argument("--model-name-or-path", default="gpt2")
+    parser.add_argument("--tokenizer", default="gpt2")
+    parser.add_argument("--epochs", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=2, help="Batch size of each process.")
+    parser.add_argument("--lr", type=float, default=2e-5)
+    parser.add_argument("--max-length", type=int, default=None, help="Token budget, the model's maximum by default.")
+    parser.add_argument("--truncation", default="head", choices=list(STRATEGIES), help="Tokens kept of longer texts.")
+    parser.add_argument("--accumulation-steps", type=int, default=1, help="Batches per optimizer step.")
+    parser.add_argument("--bf16", action="store_true", help="Run forward passes under bfloat16 autocast.")
+    parser.add_argument("--gradient-checkpointing", action="store_true", help="Recompute block activations in the backward pass.")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="Also checkpoint every N optimizer steps.")
+    parser.add_argument("--keep-checkpoints", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per process.")
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N examples of each split.")
+    main(parser.parse_args())
@@ -0,0 +1,276 @@
+# Import necessary libraries
+import contextlib
+import resource
+import time
+import torch
+from tqdm.auto import tqdm
+
+# Batch entries passed to the model, anything else only goes to the loss.
+MODEL_INPUTS = ('input_ids', 'attention_mask', 'labels')
+
+
+def enable_gradient_checkpointing(model):
+  r"""
+  Recompute the activations of the GPT2 blocks during the backward pass
+  instead of keeping them, trading compute for memory.
+
+  """
+
+  model.config.use_cache = False
+  model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+
+
+def peak_rss_mb():
+  # Peak resident memory of this process, `ru_maxrss` is in KB on Linux.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def train(model, dataloader, optimizer_, scheduler_, device_, loss_fn, progress=True,
+          accumulation_steps=1, bf16=False, start_batch=0, on_update=None):
+  r"""
+  Train pytorch model on a single pass through the data loader.
+
+  This function is built with reusability in mind: it can be used as is as long
+    as the `dataloader` outputs a batch in dictionary format that can be passed
+    straight into the model - `model(**batch)`.
+
+  Arguments:
+
+      model (:obj:`torch.nn.Module`):
+          Model to train, possibly wrapped in `DistributedDataParallel`.
+
+      dataloader (:obj:`torch.utils.data.dataloader.DataLoader`):
+          Parsed data into batches of tensors.
+
+      optimizer_ (:obj:`transformers.optimization.AdamW`):
+          Optimizer used for training.
+
+      scheduler_ (:obj:`torch.optim.lr_scheduler.LambdaLR`):
+          PyTorch scheduler.
+
+      device_ (:obj:`torch.device`):
+          Device used to load tensors before feeding to model.
+
+      loss_fn (:obj:`torch.nn.Module`):
+          Loss computed from the logits, e.g. `CrossEntropyLoss` with class
+          weights. Batch entries the model does not take, like the teacher
+          logits in `distill.py`, are passed to it as keyword arguments.
+
+      progress (:obj:`bool`):
+          Show a progress bar and the throughput and peak memory at the end.
+
+      accumulation_steps (:obj:`int`):
+          Number of batches whose gradients are added up before each
+          optimizer step, so the effective batch size is `accumulation_steps`
+          times the batch size. The scheduler steps once per optimizer step.
+
+      bf16 (:obj:`bool`):
+          Run the forward pass under bfloat16 autocast.
+
+      start_batch (:obj:`int`):
+          Number of batches to skip, to resume an epoch from a checkpoint.
+          The dataloader must yield the batches in the same order as before.
+
+      on_update (:obj:`callable`, `optional`):
+          Called with the number of batches done in this epoch after every
+          optimizer step, e.g. to save step-based checkpoints.
+
+  Returns:
+
+      :obj:`List[List[int], List[int], float]`: List of [True Labels, Predicted
+        Labels, Train Average Loss].
+  """
+
+  # Tracking variables.
+  predictions_labels = []
+  true_labels = []
+  # Total loss for this epoch.
+  total_loss = 0
+  # Throughput tracking.
+  n_examples = 0
+  n_batches = 0
+  start_time = time.perf_counter()
+
+  # Put the model into training mode.
+  model.train()
+
+  # Always clear any previously calculated gradients before performing a
+  # backward pass.
+  model.zero_grad()
+
+  # For each batch of training data...
+  for step, batch in enumerate(tqdm(dataloader, total=len(dataloader), disable=not progress)):
+
+    # Skip the batches trained on before resuming.
+    if step < start_batch:
+      continue
+    n_batches += 1
+
+    # Add original labels - use later for evaluation.
+    true_labels += batch['labels'].numpy().flatten().tolist()
+    n_examples += len(batch['labels'])
+
+    # Keep the entries meant for the loss as they are.
+    loss_inputs = {k:batch.pop(k).to(device_) for k in list(batch) if k not in MODEL_INPUTS}
+
+    # move batch to device
+    batch = {k:v.type(torch.long).to(device_) for k,v in batch.items()}
+
+    # Take an optimizer step after every `accumulation_steps` batches and
+    # after the last one.
+    update = (step + 1) % accumulation_steps == 0 or step + 1 == len(dataloader)
+
+    # With DistributedDataParallel only synchronize gradients on update steps.
+    sync = contextlib.nullcontext() if update or not hasattr(model, 'no_sync') else model.no_sync()
+
+    with sync:
+      # Perform a forward pass (evaluate the model on this training batch).
+      # This will return the loss (rather than the model output) because we
+      # have provided the `labels`.
+      with torch.autocast(device_type=device_.type, dtype=torch.bfloat16, enabled=bf16):
+        outputs = model(**batch)
+
+      # The call to `model` always returns a tuple, so we need to pull the
+      # loss value out of the tuple along with the logits. We will use logits
+      # later to calculate training accuracy.
+      loss, logits = outputs[:2]
+      loss = loss_fn(logits.float(), batch['labels'], **loss_inputs)
+
+      # Accumulate the training loss over all of the batches so that we can
+      # calculate the average loss at the end. `loss` is a Tensor containing a
+      # single value; the `.item()` function just returns the Python value
+      # from the tensor.
+      total_loss += loss.item()
+
+      # Perform a backward pass to calculate the gradients, scaled so the
+      # accumulated gradients are the average over the batches.
+      (loss / accumulation_steps).backward()
+
+    if update:
+      # Clip the norm of the gradients to 1.0.
+      # This is to help prevent the "exploding gradients" problem.
+      torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+
+      # Update parameters and take a step using the computed gradient.
+      # The optimizer dictates the "update rule"--how the parameters are
+      # modified based on their gradients, the learning rate, etc.
+      optimizer_.step()
+
+      # Update the learning rate.
+      scheduler_.step()
+
+      # Clear the accumulated gradients.
+      model.zero_grad()
+
+      if on_update is not None:
+        on_update(step + 1)
+
+    # Move logits and labels to CPU
+    logits = logits.detach().float().cpu().numpy()
+
+    # Convert these logits to list of predicted labels values.
+    predictions_labels += logits.argmax(axis=-1).flatten().tolist()
+
+  # Calculate the average loss over the training data.
+  avg_epoch_loss = total_loss / max(1, n_batches)
+
+  # Report speed and memory so settings can be compared.
+  if progress:
+    elapsed = time.perf_counter() - start_time
+    print('  examples/sec: %.2f - peak RSS: %.0f MB'%(n_examples / elapsed, peak_rss_mb()))
+
+  # Return all true labels and prediction for future evaluations.
+  return true_labels, predictions_labels, avg_epoch_loss
+
+
+
+def validation(model, dataloader, device_, progress=True, bf16=False):
+  r"""Validation function to evaluate model performance on a
+  separate set of data.
+
+  This function will return the true and predicted labels so we can use later
+  to evaluate the model's performance.
+
+  This function is built with reusability in mind: it can be used as is as long
+    as the `dataloader` outputs a batch in dictionary format that can be passed
+    straight into the model - `model(**batch)`.
+
+  Arguments:
+
+    model (:obj:`torch.nn.Module`):
+          Model to evaluate.
+
+    dataloader (:obj:`torch.utils.data.dataloader.DataLoader`):
+          Parsed data into batches of tensors.
+
+    device_ (:obj:`torch.device`):
+          Device used to load tensors before feeding to model.
+
+    progress (:obj:`bool`):
+          Show a progress bar.
+
+    bf16 (:obj:`bool`):
+          Run the forward pass under bfloat16 autocast.
+
+  Returns:
+
+    :obj:`List[List[int], List[int], float]`: List of [True Labels, Predicted
+        Labels, Train Average Loss]
+  """
+
+  # Tracking variables
+  predictions_labels = []
+  true_labels = []
+  #total loss for this epoch.
+  total_loss = 0
+
+  # Put the model in evaluation mode--the dropout layers behave differently
+  # during evaluation.
+  model.eval()
+
+  # Evaluate data for one epoch
+  for batch in tqdm(dataloader, total=len(dataloader), disable=not progress):
+
+    # add original labels
+    true_labels += batch['labels'].numpy().flatten().tolist()
+
+    # move batch to device
+    batch = {k:v.type(torch.long).to(device_) for k,v in batch.items()}
+
+    # Telling the model not to compute or store gradients, saving memory and
+    # speeding up validation
+    with torch.no_grad():
+
+        # Forward pass, calculate logit predictions.
+        # This will return the logits rather than the loss because we have
+        # not provided labels.
+        # token_type_ids is the same as the "segment ids", which
+        # differentiates sentence 1 and 2 in 2-sentence tasks.
+        with torch.autocast(device_type=device_.type, dtype=torch.bfloat16, enabled=bf16):
+          outputs = model(**batch)
+
+        # The call to `model` always returns a tuple, so we need to pull the
+        # loss value out of the tuple along with the logits. We will use logits
+        # later to to calculate training accuracy.
+        loss, logits = outputs[:2]
+
+        # Move logits and labels to CPU
+        logits = logits.detach().float().cpu().numpy()
+
+        # Accumulate the training loss over all of the batches so that we can
+        # calculate the average loss at the end. `loss` is a Tensor containing a
+        # single value; the `.item()` function just returns the Python value
+        # from the tensor.
+        total_loss += loss.item()
+
+        # get predicitons to list
+        predict_content = logits.argmax(axis=-1).flatten().tolist()
+
+        # update list
+        predictions_labels += predict_content
+
+  # Calculate the average loss over the training data.
+  avg_epoch_loss = total_loss / len(dataloader)
+
+  # Return all true labels and prediciton for future evaluations.
+  return true_labels, predictions_labels, avg_epoch_loss
@@ -0,0 +1,244 @@
+# Import necessary libraries
+import argparse
+import json
+import os
+import time
+import numpy as np
+from cache import normalize_text
+
+# Ways to fit a text into the token budget:
+#   head        the first tokens, what the tokenizer does by default
+#   tail        the last tokens, i.e. the end of the paragraph
+#   head+tail   the start and the end, dropping the middle (Sun et al., 2019)
+#   title+lead  the start of the paragraph followed by the title, so the title
+#               sits right before the last token GPT-2 classifies from
+STRATEGIES = ("head", "tail", "head+tail", "title+lead")
+
+# Share of the budget given to the start of the text by `head+tail`
+HEAD_FRACTION = 0.25
+
+
+class TitledText(str):
+    r"""
+    The text `title paragraph` the model reads, remembering its title.
+
+    It is an ordinary string everywhere else (cache keys, the cascade), so
+    only `title+lead` needs to know where the title ends. The title is kept
+    as `heading`, since `str.title` is already a method.
+
+    """
+
+    def __new__(cls, title, paragraph):
+        text = super().__new__(cls, title + ' ' + paragraph if title else paragraph)
+        text.heading = title
+        text.paragraph = paragraph
+        return text
+
+    def __reduce__(self):
+        return TitledText, (self.heading, self.paragraph)
+
+
+def normalize_item(text):
+    r"""
+    Clean a text the way the server and `score.py` both do before encoding.
+
+    Unicode is put in NFC form and runs of whitespace are collapsed. A title
+    is normalized on its own, so `title+lead` still knows where it ends, and
+    a title without a paragraph is the whole text.
+
+    Arguments:
+
+      text (:obj:`Union[str, TitledText]`):
+          Text, or title and paragraph, as received.
+
+    Returns:
+      :obj:`Union[str, TitledText]`: The normalized text, a `TitledText` when
+      it has a title and a paragraph. A `ValueError` is raised when nothing is left to
+      classify.
+
+    """
+
+    if isinstance(text, TitledText):
+        title = normalize_text(text.heading)
+        paragraph = normalize_text(text.paragraph)
+        text = TitledText(title, paragraph) if title and paragraph else title or paragraph
+    else:
+        text = normalize_text(text)
+    if not text:
+        raise ValueError("A text is empty or only whitespace.")
+    return text
+
+
+def _join(start, end):
+    # Works on both the memory-mapped arrays of the token cache and lists
+    if isinstance(start, np.ndarray):
+        return np.concatenate((start, end))
+    return list(start) + list(end)
+
+
+def truncate_ids(ids, budget, strategy="head", title_length=0):
+    r"""
+    Cut the token ids of one text to at most `budget` tokens.
+
+    Arguments:
+
+      ids (:obj:`Union[List[int], np.ndarray]`):
+          Token ids of the whole text, title first.
+
+      budget (:obj:`int`):
+          Largest number of tokens kept.
+
+      strategy (:obj:`str`):
+          One of `STRATEGIES`.
+
+      title_length (:obj:`int`):
+          Number of leading ids that belong to the title. With 0, `title+lead`
+          keeps the head of the text like `head`.
+
+    Returns:
+      :obj:`Union[List[int], np.ndarray]`: The kept ids, of the same type as `ids`.
+
+    """
+
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown truncation strategy %r, use one of %s." % (strategy, ", ".join(STRATEGIES)))
+
+    if strategy == "title+lead" and title_length:
+        # The title keeps at most half the budget, the paragraph's lead the rest
+        title = ids[:min(title_length, budget // 2 or budget)]
+        return _join(ids[title_length:][:budget - len(title)], title)
+
+    if len(ids) <= budget:
+        return ids
+    if strategy == "tail":
+        return ids[len(ids) - budget:]
+    if strategy == "head+tail":
+        head = int(budget * HEAD_FRACTION)
+        return _join(ids[:head], ids[len(ids) - (budget - head):])
+    return ids[:budget]
+
+
+def encode(tokenizer, texts, budget, strategy="head", cache=None):
+    r"""
+    Tokenize texts and fit each into the token budget, the way the token cache
+    and `TokenizedCollator` do in training.
+
+    Arguments:
+
+      texts (:obj:`List[str]`):
+          Texts to encode; `TitledText` items tell `title+lead` their title.
+
+      cache (:obj:`tokenization.TokenCache`, `optional`):
+          Reuse the ids of texts encoded before.
+
+    Returns:
+      :obj:`List[List[int]]`: Token ids of every text, unpadded.
+
+    """
+
+    def token_ids(texts):
+        if cache is not None:
+            return cache.encode(texts)
+        return tokenizer(list(texts), truncation=False, verbose=False)['input_ids']
+
+    encodings = token_ids(texts)
+    title_lengths = [0] * len(encodings)
+    if strategy == "title+lead":
+        titled = [i for i, text in enumerate(texts) if isinstance(text, TitledText) and text.heading]
+        if titled:
+            titles = token_ids([texts[i].heading for i in titled])
+            for i, title in zip(titled, titles):
+                title_lengths[i] = len(title)
+    return [truncate_ids(ids, budget, strategy, title_length) for ids, title_length in zip(encodings, title_lengths)]
+
+
+def load_truncation(model_path, default_budget=1024):
+    r"""
+    Read the token budget and strategy a checkpoint was trained with.
+
+    They are saved in the model config as `token_budget` and
+    `truncation_strategy`; older checkpoints get the head of the text up to
+    `default_budget` tokens, which is how they were trained.
+
+    Returns:
+      :obj:`Dict[str, object]`: `budget` and `strategy`.
+
+    """
+
+    with open(os.path.join(model_path, 'config.json')) as f:
+        config = json.load(f)
+    return {'budget': config.get('token_budget') or default_budget,
+            'strategy': config.get('truncation_strategy') or "head"}
+
+
+def main(args):
+    # Accuracy and latency of the served model at every budget and strategy,
+    # on the held-out split
+    import torch
+    from sklearn.metrics import accuracy_score, f1_score
+    from backends import load_backend
+    from calibration import load_calibration
+    from data import encode_labels, load_splits
+    from model_loader import load_tokenizer
+    from score import score_texts
+
+    train_data, test_data = load_splits(args.data)
+    classes = sorted(train_data['news_list'].unique())
+    if args.limit:
+        test_data = test_data[:args.limit]
+    texts = [TitledText(title, paragraph) for title, paragraph in zip(test_data['title'], test_data['paragraph'])]
+    true_labels = encode_labels(classes, test_data['news_list'])
+
+    tokenizer = load_tokenizer(args.model_path, args.tokenizer)
+    backend = load_backend(args.backend, args.model_path)
+    temperature = load_calibration(args.model_path, backend)['temperature']
+    lengths = np.array([len(ids) for ids in tokenizer(list(texts), truncation=False, verbose=False)['input_ids']])
+    print("held-out texts: %d - tokens p50 %d, p90 %d, max %d" % (
+        len(texts), np.percentile(lengths, 50), np.percentile(lengths, 90), lengths.max()))
+
+    rows = []
+    for budget in args.budgets:
+        for strategy in args.strategies:
+            start = time.perf_counter()
+            labels, _ = score_texts(texts, tokenizer, backend, args.batch_size, temperature, budget=budget, strategy=strategy)
+            elapsed = time.perf_counter() - start
+
+            # Latency of single texts, the way /predict runs them when idle
+            timings = []
+            with torch.no_grad():
+                for text in texts[:args.latency_samples]:
+                    start = time.perf_counter()
+                    inputs = tokenizer.pad({'input_ids': encode(tokenizer, [text], budget, strategy)}, return_tensors="pt")
+                    backend.logits(inputs)
+                    timings.append(time.perf_counter() - start)
+
+            rows.append({'budget': budget, 'strategy': strategy,
+                         'accuracy': accuracy_score(true_labels, labels),
+                         'macro_f1': f1_score(true_labels, labels, average='macro'),
+                         'truncated': float((lengths > budget).mean()),
+                         'texts_per_second': len(texts) / elapsed,
+                         'latency_ms_p50': 1000 * float(np.percentile(timings, 50)),
+                         'latency_ms_p95': 1000 * float(np.percentile(timings, 95))})
+            print("%6d %-11s acc %.4f  macro-f1 %.4f  truncated %5.1f%%  %7.1f texts/s  p50 %6.1f  p95 %6.1f ms" % (
+                budget, strategy, rows[-1]['accuracy'], rows[-1]['macro_f1'], 100 * rows[-1]['truncated'],
+                rows[-1]['texts_per_second'], rows[-1]['latency_ms_p50'], rows[-1]['latency_ms_p95']), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'model_path': args.model_path, 'backend': args.backend, 'results': rows}, f, indent=2)
+        print("Saved results to %s" % args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark accuracy against latency for token budgets and truncation strategies.")
+    parser.add_argument("--model-path", default="weights/garr-epoch-0")
+    parser.add_argument("--data", default="query_resul.parquet")
+    parser.add_argument("--tokenizer", default="gpt2", help="Used when the checkpoint has no tokenizer files.")
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--budgets", type=lambda s: [int(v) for v in s.split(",")], default=[128, 256, 512])
+    parser.add_argument("--strategies", type=lambda s: s.split(","), default=list(STRATEGIES))
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--latency-samples", type=int, default=100, help="Texts timed one at a time.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N held-out examples.")
+    parser.add_argument("--output", default=None, help="Save the results as JSON.")
+    main(parser.parse_args())